@@ -1,49 +1,116 @@
-import os
+import click
 from dotenv import load_dotenv
 
-from flask import Flask, render_template, request, flash, redirect, session, g
-from flask_debugtoolbar import DebugToolbarExtension
+from flask import Blueprint, Flask, current_app, render_template, request, \
+    flash, redirect, session, g, url_for
 from sqlalchemy.exc import IntegrityError
 from werkzeug.exceptions import Unauthorized
 
-from forms import UserAddForm, LoginForm, MessageForm, CSRFProtectForm, \
-    EditUserForm
-from models import DEFAULT_IMAGE_URL, db, connect_db, User, Message, \
-    DEFAULT_HEADER_IMAGE_URL, MessagesLiked, Follows
+from forms import UserAddForm, LoginForm, MessageForm, EditUserForm
+from models import DEFAULT_IMAGE_URL, db, init_db, User, Message, \
+    DEFAULT_HEADER_IMAGE_URL, MessagesLiked, Follows, password_hasher
+import timeline
+import migrations
+import query_stats
+import profiling
+import metrics
+import http_cache
+import assets
+import fragment_cache
+import template_cache
+import load_plans
+from cache import TTLCache
+from config import configure, init_toolbar
+from query_stats import query_budget
+from load_plans import load_plan, planned
+from query_plans import check_query_plans
+from pagination import paginate
+from search import search_users, list_users_after
+from current_user import CURR_USER_KEY, WarblerGlobals, invalidate_profile, \
+    profile_cache
 
 load_dotenv()
 
-CURR_USER_KEY = "curr_user"
+# All of Warbler's views and commands; create_app registers them on an app
+bp = Blueprint('warbler', __name__, cli_group=None)
 
-app = Flask(__name__)
 
-# Get DB_URI from environ variable (useful for production/testing) or,
-# if not set there, use development local db.
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ['DATABASE_URL'].replace("postgres://", "postgresql://"))
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-app.config['SECRET_KEY'] = os.environ['SECRET_KEY']
-toolbar = DebugToolbarExtension(app)
+def create_app(config=None):
+    """Create and set up a Warbler app.
 
-connect_db(app)
+    Settings come from the environment and the WARBLER_ENV profile (see
+    config.py), then from the `config` dict, which may also choose the
+    profile with a WARBLER_ENV key. Nothing connects to the database until
+    the app first needs it, and no app context is pushed, so apps are cheap
+    to create and safe to fork.
+    """
+
+    app = Flask(__name__)
+    app.app_ctx_globals_class = WarblerGlobals
+
+    configure(app, config)
+    if app.config['SQLALCHEMY_DATABASE_URI'].startswith("postgresql"):
+        # Same as the default pool, but reports checkout waits to /metrics
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {
+            'poolclass': metrics.TimedQueuePool})
+    init_toolbar(app)
+
+    init_db(app)
+    query_stats.init_app(app)
+    load_plans.init_app(app)
+    profiling.init_app(app)
+    metrics.init_app(app)
+    http_cache.init_app(app)
+    assets.init_app(app)
+    fragment_cache.init_app(app)
+    template_cache.init_app(app)
+    metrics.watch_pool(lambda: db.engine)
+    metrics.watch_password_hasher(password_hasher)
+    metrics.watch_cache('profile', profile_cache)
+    if isinstance(app.extensions['fragment_cache'], TTLCache):
+        metrics.watch_cache('fragment', app.extensions['fragment_cache'])
+
+    app.register_blueprint(bp)
+
+    return app
+
+
+def __getattr__(name):
+    """Create `app`, configured from the environment, on first use.
+
+    This is what `gunicorn app:app` and `flask run` load; code that wants
+    its own settings should call create_app instead.
+    """
+
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 ##############################################################################
 # User signup/login/logout
 
 
-@app.before_request
+@bp.before_app_request
 def add_user_to_g():
-    """If we're logged in, add curr user and csrf validation to Flask global."""
+    """Reset curr user and csrf validation on the Flask global.
 
-    if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
-        g.csrf_form = CSRFProtectForm()
+    Both are built on first use (see current_user.py), so requests that
+    never touch them don't pay for them.
+
+    An app context pushed outside any request (as the tests and scripts do)
+    is reused by every request made inside it, and so is its `g`; that
+    includes Flask-WTF's per-request token cache, which would otherwise hand
+    one session's CSRF token to everyone.
+    """
+
+    g.pop('user', None)
+    g.pop('csrf_form', None)
+    g.pop('csrf_token', None)
 
-    else:
-        g.user = None
 
 def do_login(user):
     """Log in user."""
@@ -58,7 +125,7 @@ def do_logout():
         del session[CURR_USER_KEY]
 
 
-@app.route('/signup', methods=["GET", "POST"])
+@bp.route('/signup', methods=["GET", "POST"])
 def signup():
     """Handle user signup.
 
@@ -96,7 +163,7 @@ def signup():
         return render_template('users/signup.html', form=form)
 
 
-@app.route('/login', methods=["GET", "POST"])
+@bp.route('/login', methods=["GET", "POST"])
 def login():
     """Handle user login and redirect to homepage on success."""
 
@@ -108,6 +175,8 @@ def login():
             form.password.data)
 
         if user:
+            # authenticate may have upgraded the password hash
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -117,7 +186,7 @@ def login():
     return render_template('users/login.html', form=form)
 
 
-@app.post('/logout')
+@bp.post('/logout')
 def logout():
     """Handle logout of user and redirect to homepage."""
 
@@ -134,11 +203,13 @@ def logout():
 ##############################################################################
 # General user routes:
 
-@app.get('/users')
+@bp.get('/users')
+@query_budget(6)
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search by that username
+    (see search.py); results come a page at a time.
     """
 
     if not g.user:
@@ -148,14 +219,21 @@ def list_users():
     search = request.args.get('q')
 
     if not search:
-        users = User.query.all()
+        users, after = list_users_after(request.args.get('after', type=int))
+        next_url = after and url_for('.list_users', after=after)
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        page = request.args.get('page', 1, type=int)
+        users, has_more = search_users(search, page)
+        next_url = has_more and url_for('.list_users', q=search, page=page + 1)
+
+    g.user.preload_following(users)
 
-    return render_template('users/index.html', users=users)
+    return render_template('users/index.html', users=users, next_url=next_url)
 
 
-@app.get('/users/<int:user_id>')
+@bp.get('/users/<int:user_id>')
+@query_budget(6)
+@load_plan()
 def show_user(user_id):
     """Show user profile."""
 
@@ -167,10 +245,27 @@ def show_user(user_id):
 
     user = User.query.get_or_404(user_id)
 
-    return render_template('users/show.html', user=user, form=form)
+    cached = http_cache.not_modified(http_cache.user_stamp(user))
+    if cached:
+        return cached
+
+    messages, next_cursor = paginate(
+        planned(Message.by_user(user.id)),
+        Message.timestamp,
+        Message.id,
+        cursor=request.args.get('before'))
+    g.user.preload_liked(messages)
 
+    return render_template(
+        'users/show.html',
+        user=user,
+        messages=messages,
+        next_cursor=next_cursor,
+        form=form)
 
-@app.get('/users/<int:user_id>/following')
+
+@bp.get('/users/<int:user_id>/following')
+@query_budget(6)
 def show_following(user_id):
     """Show list of people this user is following."""
 
@@ -179,10 +274,18 @@ def show_following(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
+
+    cached = http_cache.not_modified(http_cache.user_stamp(user))
+    if cached:
+        return cached
+
+    g.user.preload_following(user.following)
+
     return render_template('users/following.html', user=user)
 
 
-@app.get('/users/<int:user_id>/followers')
+@bp.get('/users/<int:user_id>/followers')
+@query_budget(6)
 def show_followers(user_id):
     """Show list of followers of this user."""
 
@@ -191,10 +294,18 @@ def show_followers(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
+
+    cached = http_cache.not_modified(http_cache.user_stamp(user))
+    if cached:
+        return cached
+
+    g.user.preload_following(user.followers)
+
     return render_template('users/followers.html', user=user)
 
 
-@app.post('/users/follow/<int:follow_id>')
+@bp.post('/users/follow/<int:follow_id>')
+@query_budget(10)
 def start_following(follow_id):
     """Add a follow for the currently-logged-in user.
 
@@ -205,14 +316,23 @@ def start_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
+    if follow_id == g.user.id:
+        flash("You can't follow yourself.", "danger")
+        return redirect(f"/users/{g.user.id}/following")
+
     followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
-    db.session.commit()
+
+    if not g.user.is_following(followed_user):
+        g.user.follow(followed_user)
+        timeline.add_followed_user(g.user.id, followed_user.id)
+        db.session.commit()
+        metrics.writes_total.inc(kind='follow')
 
     return redirect(f"/users/{g.user.id}/following")
 
 
-@app.post('/users/stop-following/<int:follow_id>')
+@bp.post('/users/stop-following/<int:follow_id>')
+@query_budget(10)
 def stop_following(follow_id):
     """Have currently-logged-in-user stop following this user.
 
@@ -223,14 +343,18 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
-    db.session.commit()
+    followed_user = User.query.get_or_404(follow_id)
+
+    if g.user.is_following(followed_user):
+        g.user.unfollow(followed_user)
+        timeline.remove_followed_user(g.user.id, followed_user.id)
+        db.session.commit()
+        metrics.writes_total.inc(kind='unfollow')
 
     return redirect(f"/users/{g.user.id}/following")
 
 
-@app.route('/users/profile', methods=["GET", "POST"])
+@bp.route('/users/profile', methods=["GET", "POST"])
 def profile():
     """Update profile for current user.
         GET: Show a form to edit user profile
@@ -241,7 +365,7 @@ def profile():
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = g.user
+    user = g.user.load()
 
     form = EditUserForm(obj=user)
 
@@ -252,8 +376,10 @@ def profile():
             user.image_url = form.image_url.data or DEFAULT_IMAGE_URL
             user.header_image_url = form.header_image_url.data or DEFAULT_HEADER_IMAGE_URL
             user.bio = form.bio.data
+            User.adjust_counts(user.id, version=1)
 
             db.session.commit()
+            invalidate_profile(user.id)
             return redirect(f"/users/{user.id}")
         else:
             flash("Invalid credentials.", 'danger')
@@ -262,7 +388,9 @@ def profile():
         return render_template('/users/edit.html', form=form, user=g.user)
 
 
-@app.get('/users/<int:user_id>/likedmessages')
+@bp.get('/users/<int:user_id>/likedmessages')
+@query_budget(8)
+@load_plan(selectin=[Message.user])
 def show_liked_messages(user_id):
     """ Show list of liked messages for this user """
 
@@ -273,10 +401,23 @@ def show_liked_messages(user_id):
             return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('/users/messages_liked.html', user=user, form=form)
 
+    messages, next_cursor = paginate(
+        planned(Message.liked_by(user.id)),
+        Message.timestamp,
+        Message.id,
+        cursor=request.args.get('before'))
+    g.user.preload_liked(messages)
+
+    return render_template(
+        '/users/messages_liked.html',
+        user=user,
+        messages=messages,
+        next_cursor=next_cursor,
+        form=form)
 
-@app.post('/users/delete')
+
+@bp.post('/users/delete')
 def delete_user():
     """Delete user.
 
@@ -287,7 +428,33 @@ def delete_user():
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
+    own_message_ids = db.select(Message.id).where(Message.user_id == g.user.id)
+    likes_of_own_messages = MessagesLiked.query.filter(
+        MessagesLiked.message_id.in_(own_message_ids))
+    lost_likes = (
+        db.select(db.func.count())
+        .select_from(MessagesLiked)
+        .where(MessagesLiked.user_id == User.id)
+        .where(MessagesLiked.message_id.in_(own_message_ids))
+        .scalar_subquery())
+
+    # Other users' counters lose whatever pointed at this user
+    User.adjust_counts(
+        db.select(Follows.user_being_followed_id)
+        .where(Follows.user_following_id == g.user.id),
+        followers_count=-1, version=1)
+    User.adjust_counts(
+        db.select(Follows.user_following_id)
+        .where(Follows.user_being_followed_id == g.user.id),
+        following_count=-1, version=1)
+    User.adjust_counts(
+        db.select(MessagesLiked.user_id)
+        .where(MessagesLiked.message_id.in_(own_message_ids)),
+        likes_count=-lost_likes, version=1)
+
+    likes_of_own_messages.delete(synchronize_session=False)
     MessagesLiked.query.filter(MessagesLiked.user_id == g.user.id).delete()
+    timeline.remove_user(g.user.id)
     Message.query.filter(Message.user_id == g.user.id).delete()
     Follows.query.filter(
         (Follows.user_being_followed_id == g.user.id) | 
@@ -297,8 +464,9 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    db.session.delete(g.user.load())
     db.session.commit()
+    invalidate_profile(g.user.id)
 
     return redirect("/signup")
 
@@ -306,7 +474,8 @@ def delete_user():
 ##############################################################################
 # Messages routes:
 
-@app.route('/messages/new', methods=["GET", "POST"])
+@bp.route('/messages/new', methods=["GET", "POST"])
+@query_budget(8)
 def add_message():
     """Add a message:
 
@@ -322,14 +491,20 @@ def add_message():
     if form.validate_on_submit():
         msg = Message(text=form.text.data)
         g.user.messages.append(msg)
+        db.session.flush()
+        User.adjust_counts(g.user.id, messages_count=1, version=1)
+        timeline.fan_out_message(msg)
         db.session.commit()
+        metrics.writes_total.inc(kind='message')
 
         return redirect(f"/users/{g.user.id}")
 
     return render_template('messages/create.html', form=form)
 
 
-@app.get('/messages/<int:message_id>')
+@bp.get('/messages/<int:message_id>')
+@query_budget(6)
+@load_plan(joined=[Message.user])
 def show_message(message_id):
     """Show a message."""
 
@@ -337,11 +512,17 @@ def show_message(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    msg = Message.query.get_or_404(message_id)
+    msg = planned(Message.query).get_or_404(message_id)
+
+    cached = http_cache.not_modified(
+        msg.id, http_cache.user_stamp(msg.user))
+    if cached:
+        return cached
+
     return render_template('messages/show.html', message=msg)
 
 
-@app.post('/messages/<int:message_id>/delete')
+@bp.post('/messages/<int:message_id>/delete')
 def delete_message(message_id):
     """Delete a message.
 
@@ -354,12 +535,19 @@ def delete_message(message_id):
         return redirect("/")
 
     msg = Message.query.get_or_404(message_id)
+    User.adjust_counts(msg.user_id, messages_count=-1, version=1)
+    User.adjust_counts(
+        db.select(MessagesLiked.user_id)
+        .where(MessagesLiked.message_id == msg.id),
+        likes_count=-1, version=1)
+    timeline.remove_message(msg.id)
     db.session.delete(msg)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}")
 
-@app.post('/messages/<int:message_id>/likedtoggle')
+@bp.post('/messages/<int:message_id>/likedtoggle')
+@query_budget(6)
 def liked_toggle(message_id):
     """
         Input: message_id (integer)
@@ -372,8 +560,9 @@ def liked_toggle(message_id):
     if not form.validate_on_submit():
         raise Unauthorized
 
-    MessagesLiked.toggle_liked(message_id, g.user.id)
+    liked = MessagesLiked.toggle_liked(message_id, g.user.id)
     db.session.commit()
+    metrics.writes_total.inc(kind='like' if liked else 'unlike')
 
     from_url = request.form['from-url']
     return redirect(from_url)
@@ -383,46 +572,140 @@ def liked_toggle(message_id):
 # Homepage and error pages
 
 
-@app.get('/')
+@bp.get('/')
+@query_budget(6)
+@load_plan(selectin=[Message.user])
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: most recent messages of followed_users, a page at a time
     """
 
     if g.user:
         form = g.csrf_form
-        following_and_self_ids = [f.id for f in g.user.following]
-        following_and_self_ids.append(g.user.id)
-
-        messages = (
-            Message
-            .query
-            .filter(Message.user_id.in_(following_and_self_ids))
-            .order_by(Message.timestamp.desc())
-            .limit(100)
-            .all())
-
-        return render_template('home.html', messages=messages, form=form)
+        messages, next_cursor = timeline.home_timeline(
+            g.user.id,
+            cursor=request.args.get('before'))
+        g.user.preload_liked(messages)
+
+        return render_template(
+            'home.html',
+            messages=messages,
+            next_cursor=next_cursor,
+            form=form)
     else:
         return render_template('home-anon.html')
 
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
-
-@app.after_request
-def add_header(response):
-    """Add non-caching headers on every request."""
-
-    # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Cache-Control
-    response.cache_control.no_store = True
-    return response
+# Metrics
+
+
+@bp.get('/metrics')
+def show_metrics():
+    """Metrics for Prometheus to scrape (see metrics.py)."""
+
+    return (
+        metrics.exposition(current_app.config['METRICS_DIR']),
+        {'Content-Type': metrics.CONTENT_TYPE})
+
+
+##############################################################################
+# Maintenance commands
+
+
+@bp.cli.command('backfill-timelines')
+def backfill_timelines_command():
+    """Rebuild every home timeline from existing follows and messages."""
+
+    count = timeline.backfill_timelines()
+    db.session.commit()
+    print(f"Wrote {count} timeline entries.")
+
+
+@bp.cli.group('db')
+def db_command():
+    """Manage the database schema."""
+
+
+@db_command.command('upgrade')
+def db_upgrade_command():
+    """Apply pending schema migrations."""
+
+    for name in migrations.upgrade():
+        print(f"Applied: {name}")
+
+
+@db_command.command('stamp')
+def db_stamp_command():
+    """Mark all migrations applied (for a database made by create_all)."""
+
+    migrations.stamp()
+
+
+@db_command.command('check-plans')
+def db_check_plans_command():
+    """Fail if a hot query no longer uses its index (PostgreSQL only)."""
+
+    failures = check_query_plans()
+
+    for name, expected, used in failures:
+        print(f"{name}: expected one of {sorted(expected)}, used {sorted(used)}")
+
+    if failures:
+        raise SystemExit(1)
+
+    print("All hot queries use their indexes.")
+
+
+@bp.cli.command('calibrate-bcrypt')
+@click.option('--target-ms', default=250, help="Target time for one hash.")
+def calibrate_bcrypt_command(target_ms):
+    """Pick the BCRYPT_LOG_ROUNDS that hashes in about --target-ms here."""
+
+    log_rounds, timings = password_hasher.calibrate(target_ms / 1000)
+
+    for rounds, seconds in timings:
+        print(f"{rounds:2} rounds: {seconds * 1000:8.1f}ms")
+
+    print(f"BCRYPT_LOG_ROUNDS={log_rounds}")
+
+
+@bp.cli.command('reconcile-counters')
+def reconcile_counters_command():
+    """Recompute every user's message/follow/like counters."""
+
+    User.reconcile_counts()
+    db.session.commit()
+    print("Reconciled user counters.")
+
+
+@bp.cli.command('compile-templates')
+def compile_templates_command():
+    """Compile every template into TEMPLATE_CACHE_DIR."""
+
+    if not current_app.config['TEMPLATE_CACHE_DIR']:
+        raise click.UsageError("TEMPLATE_CACHE_DIR is not set.")
+
+    count, seconds = template_cache.preload(current_app)
+    print(f"Compiled {count} templates in {seconds * 1000:.0f}ms.")
+
+
+@bp.cli.group('assets')
+def assets_command():
+    """Manage fingerprinted static assets."""
+
+
+@assets_command.command('build')
+def assets_build_command():
+    """Fingerprint, minify and precompress static/ into static/build/."""
+
+    manifest = assets.build(
+        current_app.static_folder, f"{current_app.static_url_path}/")
+    assets.set_manifest(current_app, manifest)
+
+    print(f"Built {len(manifest)} assets.")
 
 
 # Questions relation to Authentication
@@ -0,0 +1,251 @@
+"""Fingerprinted, precompressed static assets.
+
+`flask assets build` copies every file in static/ to static/build/ under a
+name containing a hash of its contents (style.css -> style.3f2a9c1d0b7e.css),
+minifying CSS on the way and rewriting the /static/ URLs inside it, and
+writes gzip (and, if the `brotli` package is installed, brotli) copies of
+text files next to them. static/build/manifest.json maps each original name
+to its fingerprinted one. Run it as part of each deploy.
+
+Templates link to assets with `asset_url('stylesheets/style.css')`, or
+`url | asset_url` for URLs that may be a /static/ path (like users'
+default pictures, which are stored unfingerprinted so rebuilding doesn't
+break them). With a manifest, these give the fingerprinted URL, which
+http_cache lets browsers cache for a year; without one (e.g. in
+development), the plain static URL.
+
+Fingerprinted files are served precompressed when the browser accepts it.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+
+from flask import current_app, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Where fingerprinted files go, relative to the static folder
+BUILD_DIR = 'build'
+
+MANIFEST_NAME = 'manifest.json'
+
+HASH_LENGTH = 12
+
+# Worth compressing; images are compressed already
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.ico', '.json', '.txt'}
+
+CSS_COMMENT_RE = re.compile(r"/\*.*?\*/", re.DOTALL)
+CSS_SPACE_RE = re.compile(r"\s*([{};,>])\s*|(:)\s+")
+CSS_URL_RE = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+# Built files named by `fingerprinted_name`, e.g. build/style.3f2a9c1d0b7e.css
+FINGERPRINTED_RE = re.compile(
+    rf"^{BUILD_DIR}/.+\.[0-9a-f]{{{HASH_LENGTH}}}(?:\.[^./]+)?$")
+
+# Encodings we precompress, best first: (Content-Encoding, file suffix)
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+##############################################################################
+# Building
+
+
+def minify_css(css):
+    """Strip comments and needless whitespace from `css`."""
+
+    css = CSS_COMMENT_RE.sub("", css)
+    css = CSS_SPACE_RE.sub(lambda match: match.group(1) or ':', css)
+    css = " ".join(css.split())
+
+    return css.replace(";}", "}").strip()
+
+
+def fingerprinted_name(name, content):
+    digest = hashlib.sha256(content).hexdigest()[:HASH_LENGTH]
+    root, ext = os.path.splitext(name)
+
+    return f"{root}.{digest}{ext}"
+
+
+def rewrite_css_urls(css, manifest, url_prefix):
+    """Point /static/ URLs in `css` at their fingerprinted files."""
+
+    def replace(match):
+        quote, url = match.groups()
+        name = url[len(url_prefix):] if url.startswith(url_prefix) else None
+
+        if name in manifest:
+            url = f"{url_prefix}{BUILD_DIR}/{manifest[name]}"
+
+        return f"url({quote}{url}{quote})"
+
+    return CSS_URL_RE.sub(replace, css)
+
+
+def compress(path, content):
+    """Write compressed copies of `content` beside `path`, where smaller."""
+
+    variants = [('.gz', gzip.compress(content, 9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(content)))
+
+    for suffix, compressed in variants:
+        if len(compressed) < len(content):
+            with open(path + suffix, 'wb') as f:
+                f.write(compressed)
+
+
+def source_names(static_dir):
+    """Return the names of the files to build, relative to `static_dir`,
+    CSS last so the files it refers to are already in the manifest."""
+
+    names = []
+
+    for root, dirs, files in os.walk(static_dir):
+        if root == static_dir and BUILD_DIR in dirs:
+            dirs.remove(BUILD_DIR)
+
+        for filename in files:
+            path = os.path.join(root, filename)
+            names.append(
+                os.path.relpath(path, static_dir).replace(os.sep, '/'))
+
+    return sorted(names, key=lambda name: (name.endswith('.css'), name))
+
+
+def build(static_dir, url_prefix='/static/'):
+    """Rebuild static_dir/build; return the manifest."""
+
+    build_dir = os.path.join(static_dir, BUILD_DIR)
+    shutil.rmtree(build_dir, ignore_errors=True)
+
+    manifest = {}
+
+    for name in source_names(static_dir):
+        with open(os.path.join(static_dir, name), 'rb') as f:
+            content = f.read()
+
+        if name.endswith('.css'):
+            css = minify_css(content.decode('utf-8'))
+            css = rewrite_css_urls(css, manifest, url_prefix)
+            content = css.encode('utf-8')
+
+        manifest[name] = fingerprinted_name(name, content)
+
+        path = os.path.join(build_dir, manifest[name])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+
+        if os.path.splitext(name)[1] in COMPRESSIBLE_EXTENSIONS:
+            compress(path, content)
+
+    with open(os.path.join(build_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    return manifest
+
+
+def load_manifest(static_dir):
+    """Return the manifest built in `static_dir`, or {} if there isn't one."""
+
+    try:
+        with open(os.path.join(static_dir, BUILD_DIR, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def manifest_version(manifest):
+    """Return a hash of `manifest`, which changes whenever any asset does."""
+
+    content = json.dumps(manifest, sort_keys=True).encode('utf-8')
+
+    return hashlib.sha256(content).hexdigest()[:HASH_LENGTH]
+
+
+##############################################################################
+# Flask integration
+
+
+def asset_url(name):
+    """Return the URL for static file `name`, fingerprinted if built.
+
+    `name` may also be a URL: /static/ URLs are resolved the same way, and
+    anything else is returned as is.
+    """
+
+    if not name:
+        return name
+
+    manifest = current_app.extensions['assets']
+    prefix = f"{current_app.static_url_path}/"
+
+    if name.startswith(prefix):
+        name = name[len(prefix):]
+    elif name.startswith('/') or ':' in name:
+        return name
+
+    if name in manifest:
+        return url_for('static', filename=f"{BUILD_DIR}/{manifest[name]}")
+
+    return url_for('static', filename=name)
+
+
+def set_manifest(app, manifest):
+    """Have `app` link to the assets in `manifest`."""
+
+    app.extensions['assets'] = manifest
+    app.extensions['assets_version'] = manifest_version(manifest)
+
+
+def is_fingerprinted(filename):
+    """Is static file `filename` one of the built, fingerprinted ones?
+
+    Other files in the build, like the manifest, change from build to build.
+    """
+
+    return FINGERPRINTED_RE.match(filename) is not None
+
+
+def send_static_file(filename):
+    """Serve a static file, precompressed if fingerprinted and accepted."""
+
+    static_dir = current_app.static_folder
+
+    if is_fingerprinted(filename):
+        for encoding, suffix in ENCODINGS:
+            if encoding not in request.accept_encodings:
+                continue
+            if not os.path.isfile(os.path.join(static_dir, filename + suffix)):
+                continue
+
+            response = send_from_directory(
+                static_dir, filename + suffix,
+                mimetype=mimetypes.guess_type(filename)[0])
+            response.headers['Content-Encoding'] = encoding
+            response.vary.add('Accept-Encoding')
+            return response
+
+    response = current_app.send_static_file(filename)
+    if is_fingerprinted(filename):
+        response.vary.add('Accept-Encoding')
+
+    return response
+
+
+def init_app(app):
+    """Load `app`'s asset manifest, and serve and link to its assets."""
+
+    set_manifest(app, load_manifest(app.static_folder))
+    app.view_functions['static'] = send_static_file
+    app.jinja_env.globals['asset_url'] = asset_url
+    app.jinja_env.filters['asset_url'] = asset_url
@@ -0,0 +1,484 @@
+"""Load test Warbler's main routes against a local gunicorn.
+
+Seeds a database at the chosen scale, starts gunicorn on it, logs in
+--concurrency synthetic users through /login, and has each of them drive a
+weighted mix of routes (see ROUTE_WEIGHTS) for --duration seconds. Prints a
+JSON report of overall and per-route requests/s, error rate and latency
+percentiles. Run from the project root, e.g.:
+
+    createdb warbler_loadtest
+    python benchmarks/loadtest.py --scale medium --concurrency 32 \\
+        --duration 60 --output results.json
+
+    # later, after a change:
+    python benchmarks/loadtest.py --scale medium --concurrency 32 \\
+        --duration 60 --baseline results.json
+
+With --baseline, routes whose p95 latency or throughput got worse by more
+than --tolerance are listed on stderr and the exit status is 1.
+
+Use --no-seed to reuse an already-seeded database, and --url to test a
+server that is already running instead of starting gunicorn. The database
+is dropped and recreated when seeding, so point --database-url at a
+database used only for load tests.
+
+The client is plain urllib in threads, one thread per synthetic user, so
+for high concurrency run it on a different machine from the server or its
+own CPU use will skew the results.
+"""
+
+import argparse
+import csv
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+from itertools import islice
+from math import ceil
+from random import Random
+from time import perf_counter, sleep
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, HTTPRedirectHandler, \
+    build_opener
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Sizes passed to generator/create_csvs.py for each --scale
+SCALES = {
+    'small': dict(users=300, messages=1_000, follows=5_000, likes=3_000),
+    'medium': dict(
+        users=10_000, messages=100_000, follows=500_000, likes=300_000),
+    'large': dict(
+        users=100_000, messages=2_000_000, follows=10_000_000,
+        likes=5_000_000),
+}
+
+# Every generated user's password
+PASSWORD = "password"
+
+# How often each synthetic user picks each action
+ROUTE_WEIGHTS = {
+    'home': 35,
+    'show_user': 20,
+    'search_users': 10,
+    'new_message': 10,
+    'like': 15,
+    'follow': 10,
+}
+
+CSRF_TOKEN_RE = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+REQUEST_TIMEOUT = 30
+SERVER_START_TIMEOUT = 30
+
+
+##############################################################################
+# Dataset and server
+
+
+def run(args, env):
+    """Run a command from the project root, with its output on stderr."""
+
+    subprocess.run(args, cwd=ROOT, env=env, stdout=sys.stderr, check=True)
+
+
+def seed_database(args, env):
+    """Generate CSVs at args.scale into args.data_dir and seed them."""
+
+    sizes = SCALES[args.scale]
+
+    run([
+        sys.executable, 'generator/create_csvs.py',
+        '--out-dir', args.data_dir,
+        '--seed', str(args.seed),
+        *(f"--{name}={count}" for name, count in sizes.items()),
+    ], env)
+    run([sys.executable, 'seed.py', '--data-dir', args.data_dir], env)
+
+
+class Dataset:
+    """What synthetic users need to know about the seeded data."""
+
+    def __init__(self, data_dir, num_usernames):
+        with open(os.path.join(data_dir, 'users.csv'), newline='') as f:
+            rows = csv.DictReader(f)
+            self.usernames = [
+                row['username'] for row in islice(rows, num_usernames)]
+            self.num_users = len(self.usernames) + sum(1 for _ in rows)
+
+        with open(os.path.join(data_dir, 'messages.csv'), newline='') as f:
+            self.num_messages = sum(1 for _ in csv.DictReader(f))
+
+
+def start_gunicorn(args, env):
+    """Start gunicorn on args.port; return the process once it's serving."""
+
+    server = subprocess.Popen([
+        sys.executable, '-m', 'gunicorn',
+        '--workers', str(args.workers),
+        '--bind', f"127.0.0.1:{args.port}",
+        '--log-level', 'warning',
+        'app:app',
+    ], cwd=ROOT, env=env, stdout=sys.stderr)
+
+    deadline = perf_counter() + SERVER_START_TIMEOUT
+    opener = build_opener()
+
+    while perf_counter() < deadline:
+        if server.poll() is not None:
+            sys.exit(f"gunicorn exited with status {server.returncode}")
+        try:
+            opener.open(f"{args.url}/login", timeout=1).read()
+            return server
+        except (URLError, OSError):
+            sleep(0.2)
+
+    server.terminate()
+    sys.exit("gunicorn didn't start in time")
+
+
+##############################################################################
+# Synthetic users
+
+
+class NoRedirects(HTTPRedirectHandler):
+    """Report redirects as responses instead of following them, so each
+    request times one route."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class SyntheticUser:
+    """A logged-in user with their own cookies, acting at random."""
+
+    def __init__(self, base_url, username, dataset, rng):
+        self.base_url = base_url
+        self.username = username
+        self.dataset = dataset
+        self.rng = rng
+        self.opener = build_opener(
+            HTTPCookieProcessor(CookieJar()), NoRedirects())
+        self.csrf_token = None
+        self.following = set()
+
+    def request(self, path, data=None):
+        """Make a request; return (status, body)."""
+
+        if data is not None:
+            data = urlencode(data).encode()
+
+        try:
+            with self.opener.open(
+                    f"{self.base_url}{path}", data,
+                    timeout=REQUEST_TIMEOUT) as response:
+                return response.status, response.read().decode()
+        except HTTPError as error:
+            return error.code, error.read().decode(errors='replace')
+
+    def refresh_csrf_token(self, body):
+        match = CSRF_TOKEN_RE.search(body)
+        if match:
+            self.csrf_token = match.group(1)
+
+    def login(self):
+        """Log in through /login; return whether it worked."""
+
+        status, body = self.request('/login')
+        self.refresh_csrf_token(body)
+
+        status, _ = self.request('/login', dict(
+            username=self.username,
+            password=PASSWORD,
+            csrf_token=self.csrf_token,
+        ))
+        if status != 302:
+            return False
+
+        # The session's token, from the logout form on every page
+        status, body = self.request('/')
+        self.refresh_csrf_token(body)
+
+        return status == 200
+
+    def random_user_id(self):
+        return self.rng.randint(1, self.dataset.num_users)
+
+    # Each action returns (route, succeeded)
+
+    def home(self):
+        status, _ = self.request('/')
+        return 'home', status == 200
+
+    def show_user(self):
+        status, _ = self.request(f"/users/{self.random_user_id()}")
+        return 'show_user', status == 200
+
+    def search_users(self):
+        username = self.rng.choice(self.dataset.usernames)
+        status, _ = self.request(f"/users?{urlencode(dict(q=username[:3]))}")
+        return 'search_users', status == 200
+
+    def new_message(self):
+        status, _ = self.request('/messages/new', dict(
+            text=f"Load test message {self.rng.random()}",
+            csrf_token=self.csrf_token,
+        ))
+        return 'new_message', status == 302
+
+    def like(self):
+        message_id = self.rng.randint(1, self.dataset.num_messages)
+        status, _ = self.request(f"/messages/{message_id}/likedtoggle", {
+            'csrf_token': self.csrf_token,
+            'from-url': '/',
+        })
+        return 'like', status == 302
+
+    def follow(self):
+        """Follow a random user, or unfollow them if already following."""
+
+        user_id = self.random_user_id()
+
+        if user_id in self.following:
+            route = 'unfollow'
+            status, _ = self.request(f"/users/stop-following/{user_id}", {})
+            self.following.discard(user_id)
+        else:
+            route = 'follow'
+            status, _ = self.request(f"/users/follow/{user_id}", {})
+            self.following.add(user_id)
+
+        return route, status == 302
+
+
+##############################################################################
+# Running and reporting
+
+
+class Results:
+    """Latencies and error counts per route."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, route, seconds, succeeded):
+        self.latencies.setdefault(route, []).append(seconds)
+        self.errors.setdefault(route, 0)
+        if not succeeded:
+            self.errors[route] += 1
+
+    def merge(self, other):
+        for route, latencies in other.latencies.items():
+            self.latencies.setdefault(route, []).extend(latencies)
+            self.errors[route] = (
+                self.errors.get(route, 0) + other.errors[route])
+
+
+def drive(user, warmup_until, deadline):
+    """Have `user` act until `deadline`; return the Results after warmup."""
+
+    results = Results()
+    actions = [getattr(user, name) for name in ROUTE_WEIGHTS]
+    weights = list(ROUTE_WEIGHTS.values())
+
+    while (start := perf_counter()) < deadline:
+        action = user.rng.choices(actions, weights)[0]
+
+        try:
+            route, succeeded = action()
+        except (URLError, OSError):
+            route, succeeded = action.__name__, False
+
+        if start >= warmup_until:
+            results.record(route, perf_counter() - start, succeeded)
+
+    return results
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an ascending list."""
+
+    return sorted_values[max(0, ceil(pct / 100 * len(sorted_values)) - 1)]
+
+
+def summarize(latencies, errors, seconds):
+    latencies = sorted(latencies)
+    count = len(latencies)
+
+    return dict(
+        requests=count,
+        rps=round(count / seconds, 2),
+        errors=errors,
+        error_rate=round(errors / count, 4) if count else 0,
+        mean_ms=round(1000 * sum(latencies) / count, 2) if count else None,
+        **{
+            f"p{pct}_ms": round(1000 * percentile(latencies, pct), 2)
+            if count else None
+            for pct in (50, 95, 99)
+        },
+    )
+
+
+def report(args, results, seconds):
+    all_latencies = [s for latencies in results.latencies.values()
+                     for s in latencies]
+
+    return dict(
+        config=dict(
+            scale=args.scale,
+            concurrency=args.concurrency,
+            workers=args.workers,
+            duration=args.duration,
+            warmup=args.warmup,
+            seed=args.seed,
+            weights=ROUTE_WEIGHTS,
+        ),
+        total=summarize(all_latencies, sum(results.errors.values()), seconds),
+        routes={
+            route: summarize(latencies, results.errors[route], seconds)
+            for route, latencies in sorted(results.latencies.items())
+        },
+    )
+
+
+def regressions(current, baseline, tolerance):
+    """List the ways `current` is worse than `baseline` beyond `tolerance`."""
+
+    found = []
+    pairs = [('total', current['total'], baseline['total'])] + [
+        (route, stats, baseline['routes'][route])
+        for route, stats in current['routes'].items()
+        if route in baseline['routes']
+    ]
+
+    for name, now, before in pairs:
+        if now['p95_ms'] and before['p95_ms'] and \
+                now['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            found.append(
+                f"{name}: p95 {before['p95_ms']}ms -> {now['p95_ms']}ms")
+        if now['rps'] < before['rps'] * (1 - tolerance):
+            found.append(f"{name}: {before['rps']} -> {now['rps']} req/s")
+        if now['error_rate'] > before['error_rate'] + tolerance / 10:
+            found.append(
+                f"{name}: error rate "
+                f"{before['error_rate']} -> {now['error_rate']}")
+
+    return found
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--scale', choices=SCALES, default='small')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help="synthetic users, each making one request at a time")
+    parser.add_argument('--duration', type=float, default=30,
+                        help="seconds to measure for")
+    parser.add_argument('--warmup', type=float, default=5,
+                        help="seconds to run before measuring")
+    parser.add_argument('--workers', type=int, default=4,
+                        help="gunicorn worker processes")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--url', help="test this server instead of starting one")
+    parser.add_argument('--database-url',
+                        default=os.environ.get(
+                            'LOADTEST_DATABASE_URL',
+                            'postgresql:///warbler_loadtest'))
+    parser.add_argument('--no-seed', action='store_true',
+                        help="use the database as it is")
+    parser.add_argument('--data-dir',
+                        help="where the CSVs are written (default: a "
+                             "temporary directory; generator/ with --no-seed)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the report here, not stdout")
+    parser.add_argument('--baseline', help="report from an earlier run")
+    parser.add_argument('--tolerance', type=float, default=0.1)
+
+    args = parser.parse_args(argv)
+
+    args.start_server = args.url is None
+    if args.start_server:
+        args.url = f"http://127.0.0.1:{args.port}"
+    args.url = args.url.rstrip('/')
+
+    if args.data_dir:
+        args.data_dir = os.path.abspath(args.data_dir)
+
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    env = dict(os.environ, DATABASE_URL=args.database_url)
+    env.setdefault('SECRET_KEY', 'loadtest')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.data_dir is None:
+            args.data_dir = os.path.join(ROOT, 'generator') \
+                if args.no_seed else tmp
+
+        if not args.no_seed:
+            seed_database(args, env)
+
+        dataset = Dataset(args.data_dir, max(args.concurrency, 1000))
+
+    if len(dataset.usernames) < args.concurrency:
+        sys.exit(f"Only {dataset.num_users} users to log in as")
+
+    server = start_gunicorn(args, env) if args.start_server else None
+
+    try:
+        rng = Random(args.seed)
+        users = [
+            SyntheticUser(args.url, username, dataset, Random(rng.random()))
+            for username in rng.sample(dataset.usernames, args.concurrency)
+        ]
+
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            failed = [user.username for user, ok
+                      in zip(users, pool.map(SyntheticUser.login, users))
+                      if not ok]
+            if failed:
+                sys.exit(f"Couldn't log in as: {', '.join(failed)}")
+
+            warmup_until = perf_counter() + args.warmup
+            deadline = warmup_until + args.duration
+
+            results = Results()
+            for user_results in pool.map(
+                    drive, users,
+                    [warmup_until] * len(users), [deadline] * len(users)):
+                results.merge(user_results)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    current = report(args, results, args.duration)
+    output = json.dumps(current, indent=2)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        found = regressions(current, baseline, args.tolerance)
+        for regression in found:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Compare Warbler's startup and per-request cost in each WARBLER_ENV.
+
+For each profile, imports the app in --runs fresh interpreters and times
+the import, then serves --requests requests of each of PATHS through the
+test client and times them. Prints a JSON report with the medians, whether
+Flask-DebugToolbar was loaded, and each profile's difference from
+development. Run from the project root, e.g.:
+
+    python benchmarks/startup.py --runs 10 --requests 200
+
+Requests are served to an anonymous user, so they need a database to
+connect to but no data in it; point --database-url at any Warbler database.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from statistics import median
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENVIRONMENTS = ('development', 'testing', 'production')
+
+# Pages that render a template without a logged-in user
+PATHS = ('/login', '/signup')
+
+# Run in a fresh interpreter for each measurement; prints one JSON line
+PROBE = """
+import json, sys
+from time import perf_counter
+
+start = perf_counter()
+from app import app
+import_seconds = perf_counter() - start
+
+client = app.test_client()
+request_seconds = {}
+for path in %(paths)r:
+    client.get(path)
+    start = perf_counter()
+    for _ in range(%(requests)d):
+        client.get(path)
+    request_seconds[path] = (perf_counter() - start) / %(requests)d
+
+print(json.dumps(dict(
+    import_seconds=import_seconds,
+    request_seconds=request_seconds,
+    toolbar='flask_debugtoolbar' in sys.modules,
+)))
+"""
+
+
+def probe(env, database_url, requests):
+    environ = dict(
+        os.environ,
+        WARBLER_ENV=env,
+        DATABASE_URL=database_url,
+        TEST_DATABASE_URL=database_url,
+        SECRET_KEY=os.environ.get('SECRET_KEY', 'benchmark'))
+    environ.pop('FLASK_DEBUG', None)
+
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE % dict(paths=PATHS, requests=requests)],
+        cwd=ROOT, env=environ, capture_output=True, text=True, check=True,
+    ).stdout
+
+    return json.loads(output.splitlines()[-1])
+
+
+def measure(env, database_url, runs, requests):
+    """Return the median import and per-request times of `env`."""
+
+    probes = [probe(env, database_url, requests) for _ in range(runs)]
+
+    return dict(
+        import_ms=median(p['import_seconds'] for p in probes) * 1000,
+        request_ms={
+            path: median(p['request_seconds'][path] for p in probes) * 1000
+            for path in PATHS
+        },
+        toolbar=probes[0]['toolbar'],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5,
+                        help="fresh interpreters per profile")
+    parser.add_argument('--requests', type=int, default=100,
+                        help="requests per path per interpreter")
+    parser.add_argument('--database-url',
+                        default=os.environ.get(
+                            'DATABASE_URL', 'postgresql:///warbler'))
+    args = parser.parse_args()
+
+    report = {
+        env: measure(env, args.database_url, args.runs, args.requests)
+        for env in ENVIRONMENTS
+    }
+
+    development = report['development']
+    for env in ENVIRONMENTS[1:]:
+        report[env]['saved_vs_development'] = dict(
+            import_ms=development['import_ms'] - report[env]['import_ms'],
+            request_ms={
+                path: development['request_ms'][path]
+                - report[env]['request_ms'][path]
+                for path in PATHS
+            },
+        )
+
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Small in-process caches."""
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+class TTLCache:
+    """A size-bounded LRU cache whose entries also expire after `ttl` seconds.
+
+    Safe to share between threads. Each worker process has its own copy, so
+    only cache things where being up to `ttl` seconds stale is acceptable.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        """Return the cached value for `key`, or None if missing or expired."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or entry[0] < monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        """Cache `value` under `key`, evicting the least recently used entry."""
+
+        with self._lock:
+            self._entries[key] = (monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """Drop `key` from the cache, if present."""
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,125 @@
+"""App configuration for each environment.
+
+WARBLER_ENV picks the profile: development, testing or production. If it
+isn't set, it's development when Flask's debug mode is on (FLASK_DEBUG=1 or
+`flask run --debug`) and production otherwise.
+
+Settings that differ between deployments rather than environments (the
+database, secrets, bcrypt cost, ...) still come from environment variables,
+whatever the profile. The exception is the testing profile's database,
+which is TEST_DATABASE_URL (default postgresql:///warbler_test) so tests
+never touch the DATABASE_URL a developer has set. When tests run in
+parallel under pytest-xdist, each worker adds its id to the database name
+(warbler_test_gw0, warbler_test_gw1, ...), and those databases must exist.
+Tests that change the schema itself create and drop databases of their own
+next to it (see fixtures.OwnDatabaseTestCase).
+"""
+
+import os
+
+from flask.helpers import get_debug_flag
+
+ENVIRONMENTS = ('development', 'testing', 'production')
+
+PROFILES = {
+    'development': dict(
+        DEBUG=True,
+        # Only development loads Flask-DebugToolbar at all
+        DEBUG_TB_ENABLED=True,
+        DEBUG_TB_INTERCEPT_REDIRECTS=False,
+    ),
+    'testing': dict(
+        TESTING=True,
+        SECRET_KEY="testing",
+        # The lowest cost bcrypt allows; hashing dominates test time otherwise
+        BCRYPT_LOG_ROUNDS=4,
+        DEBUG_TB_ENABLED=False,
+        QUERY_BUDGET_STRICT=True,
+        LOAD_PLAN_STRICT=True,
+        # Keep tests from reading or writing compiled templates on disk
+        TEMPLATE_CACHE_DIR=None,
+    ),
+    'production': dict(
+        DEBUG=False,
+        DEBUG_TB_ENABLED=False,
+    ),
+}
+
+
+def get_env():
+    """Return the name of the profile to use."""
+
+    env = os.environ.get('WARBLER_ENV')
+    if env is None:
+        return 'development' if get_debug_flag() else 'production'
+
+    if env not in ENVIRONMENTS:
+        raise ValueError(
+            f"WARBLER_ENV must be one of {', '.join(ENVIRONMENTS)}, "
+            f"not {env!r}")
+
+    return env
+
+
+def test_database_url():
+    """Return the database for this test process (see above)."""
+
+    url = os.environ.get('TEST_DATABASE_URL', "postgresql:///warbler_test")
+    worker = os.environ.get('PYTEST_XDIST_WORKER')
+
+    return f"{url}_{worker}" if worker else url
+
+
+def configure(app, overrides=None):
+    """Set `app`'s config from the environment, its profile and `overrides`.
+
+    The profile is overrides['WARBLER_ENV'] if given, else get_env().
+    """
+
+    overrides = dict(overrides or {})
+    env = overrides.pop('WARBLER_ENV', None) or get_env()
+    app.config['WARBLER_ENV'] = env
+
+    if env == 'testing':
+        database_url = test_database_url()
+    else:
+        database_url = os.environ.get('DATABASE_URL')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_DATABASE_URI'] = (
+        database_url and database_url.replace("postgres://", "postgresql://"))
+    app.config['SQLALCHEMY_ECHO'] = False
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
+
+    # bcrypt cost; keep it low for tests, use `flask calibrate-bcrypt` in prod
+    app.config['BCRYPT_LOG_ROUNDS'] = int(
+        os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+
+    # Concurrent bcrypt hashes per worker process, and how many more may wait
+    app.config['PASSWORD_HASH_WORKERS'] = int(
+        os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    app.config['PASSWORD_HASH_QUEUE'] = int(
+        os.environ.get('PASSWORD_HASH_QUEUE', 4))
+
+    app.config.update(PROFILES[env])
+    app.config.update(overrides)
+
+    for key, variable in [
+        ('SQLALCHEMY_DATABASE_URI', 'DATABASE_URL'),
+        ('SECRET_KEY', 'SECRET_KEY'),
+    ]:
+        if not app.config[key]:
+            raise RuntimeError(f"Set {variable} in the environment or .env")
+
+
+def init_toolbar(app):
+    """Add Flask-DebugToolbar to `app` if its profile enables it.
+
+    The import is done here so other environments never load the toolbar.
+    """
+
+    if not app.config.get('DEBUG_TB_ENABLED'):
+        return None
+
+    from flask_debugtoolbar import DebugToolbarExtension
+
+    return DebugToolbarExtension(app)
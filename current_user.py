@@ -0,0 +1,117 @@
+"""The logged-in user, loaded lazily and cached between requests.
+
+`g.user` and `g.csrf_form` are only built the first time a view or template
+touches them. `g.user` is a `SessionUser`: the handful of profile fields
+every page's navbar needs come from a short-lived per-process cache, and
+the full `User` row is loaded only if something else is asked of it.
+"""
+
+from flask import session
+from flask.ctx import _AppCtxGlobals
+from werkzeug.exceptions import Unauthorized
+
+from cache import TTLCache
+from forms import CSRFProtectForm
+from models import db, User
+
+CURR_USER_KEY = "curr_user"
+
+PROFILE_FIELDS = ('id', 'username', 'image_url', 'header_image_url')
+
+# Profiles can be up to `ttl` seconds stale in workers other than the one
+# that changed them; invalidate_profile handles the local worker.
+profile_cache = TTLCache(max_size=10_000, ttl=30)
+
+
+def invalidate_profile(user_id):
+    """Forget the cached profile for `user_id` after it changes."""
+
+    profile_cache.delete(user_id)
+
+
+def get_profile(user_id):
+    """Return the cached profile fields for `user_id` as a dict, or None."""
+
+    profile = profile_cache.get(user_id)
+
+    if profile is None:
+        row = (
+            db.session.query(*(getattr(User, f) for f in PROFILE_FIELDS))
+            .filter(User.id == user_id)
+            .first())
+
+        if row is None:
+            return None
+
+        profile = dict(zip(PROFILE_FIELDS, row))
+        profile_cache.set(user_id, profile)
+
+    return profile
+
+
+class SessionUser:
+    """Stand-in for the logged-in `User`.
+
+    Profile fields are answered from the cached profile; any other attribute
+    or method loads the `User` (once per request) and is delegated to it.
+    Use `load()` where the real model instance is needed, e.g. to modify or
+    delete it.
+    """
+
+    def __init__(self, profile):
+        self._profile = profile
+        self._user = None
+
+    def __getattr__(self, name):
+        profile = self.__dict__['_profile']
+
+        if name in profile:
+            return profile[name]
+
+        return getattr(self.load(), name)
+
+    def __repr__(self):
+        return f"<SessionUser #{self._profile['id']}>"
+
+    def load(self):
+        """Return the `User` model instance for this user."""
+
+        if self._user is None:
+            user = db.session.get(User, self._profile['id'])
+
+            if user is None:
+                # Deleted by another worker since the profile was cached
+                invalidate_profile(self._profile['id'])
+                raise Unauthorized()
+
+            # Answers preloaded during one request mustn't leak into the next
+            user.reset_request_caches()
+            self._user = user
+
+        return self._user
+
+
+def load_session_user():
+    """Return a SessionUser for the logged-in user, or None."""
+
+    if CURR_USER_KEY not in session:
+        return None
+
+    profile = get_profile(session[CURR_USER_KEY])
+
+    return profile and SessionUser(profile)
+
+
+class WarblerGlobals(_AppCtxGlobals):
+    """Flask `g` that builds `user` and `csrf_form` on first access."""
+
+    def __getattr__(self, name):
+        if name == 'user':
+            value = load_session_user()
+        elif name == 'csrf_form':
+            value = CSRFProtectForm()
+        else:
+            return super().__getattr__(name)
+
+        setattr(self, name, value)
+        return value
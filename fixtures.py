@@ -0,0 +1,192 @@
+"""Shared setup for database tests.
+
+Subclass DatabaseTestCase and put the rows every test needs in
+`create_fixtures`; they're committed once per class. Each test then runs
+inside a transaction that is rolled back afterwards, so it sees exactly
+those rows however much it changes them, including through views that
+commit. Tests can still call db.session.rollback() (e.g. after an
+IntegrityError): the session works inside a savepoint that is restarted
+whenever it ends.
+
+All test cases in a process share one app and its database (see
+config.test_database_url), whose tables are created on first use. Tests
+that change the schema itself subclass OwnDatabaseTestCase instead, which
+gives each test fresh tables in a database of its own.
+"""
+
+from unittest import TestCase
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+import search
+from app import create_app
+from current_user import profile_cache
+from models import db
+
+_app = None
+
+
+def get_app():
+    """Return this process's test app, creating its tables the first time.
+
+    An app context for it stays pushed, as models and fixtures need one.
+    """
+
+    global _app
+
+    if _app is None:
+        _app = create_app({
+            'WARBLER_ENV': 'testing',
+            # Don't have WTForms use CSRF at all, since it's a pain to test
+            'WTF_CSRF_ENABLED': False,
+        })
+        _app.app_context().push()
+
+        db.drop_all()
+        db.create_all()
+
+    return _app
+
+
+def delete_all_rows():
+    """Empty every table, children first."""
+
+    for table in reversed(db.metadata.sorted_tables):
+        db.session.execute(table.delete())
+
+    db.session.commit()
+
+
+def clear_process_caches():
+    """Forget per-process caches that a rolled-back test may have filled."""
+
+    profile_cache.clear()
+    search.invalidate_username_trie(None, None, None)
+
+    # Rolling back can return a row to a version whose fragment is stale
+    if _app is not None:
+        _app.extensions['fragment_cache'].clear()
+
+
+class DatabaseTestCase(TestCase):
+    """Runs each test in a transaction that is rolled back after it."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.app = get_app()
+        delete_all_rows()
+
+        cls.create_fixtures()
+        db.session.commit()
+        db.session.remove()
+
+    @classmethod
+    def tearDownClass(cls):
+        db.session.remove()
+        delete_all_rows()
+        clear_process_caches()
+
+        super().tearDownClass()
+
+    @classmethod
+    def create_fixtures(cls):
+        """Add rows shared by every test; store their ids on `cls`."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.connection = db.engine.connect()
+        self.transaction = self.connection.begin()
+        self.savepoint = self.connection.begin_nested()
+
+        # Swap in a session on our connection for the rest of the test
+        factory = sessionmaker(bind=self.connection)
+
+        @event.listens_for(factory, 'after_transaction_end')
+        def restart_savepoint(session, transaction):
+            if not self.savepoint.is_active:
+                self.savepoint = self.connection.begin_nested()
+
+        self.app_session = db.session
+        db.session = scoped_session(factory)
+
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.session = self.app_session
+
+        self.transaction.rollback()
+        self.connection.close()
+        clear_process_caches()
+
+        super().tearDown()
+
+
+
+class OwnDatabaseTestCase(TestCase):
+    """Runs each test against fresh tables in a database of the class's own.
+
+    For tests that drop or alter tables and indexes, so the shared database
+    other test cases use is left alone. The database is the shared one's
+    name plus `database_suffix`; it is created for the class and dropped
+    after it, so the test database's owner needs permission to create
+    databases. The class's app context is pushed for the length of each
+    test.
+    """
+
+    database_suffix = 'own'
+
+    @classmethod
+    def database_command(cls, command):
+        # On the shared app's engine, outside a transaction, as CREATE and
+        # DROP DATABASE need
+        with db.engine.connect() as connection:
+            connection.execution_options(isolation_level='AUTOCOMMIT')
+            connection.exec_driver_sql(command)
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        url = make_url(get_app().config['SQLALCHEMY_DATABASE_URI'])
+        cls.database = f"{url.database}_{cls.database_suffix}"
+
+        cls.database_command(f"DROP DATABASE IF EXISTS {cls.database}")
+        cls.database_command(f"CREATE DATABASE {cls.database}")
+
+        cls.app = create_app({
+            'WARBLER_ENV': 'testing',
+            'WTF_CSRF_ENABLED': False,
+            'SQLALCHEMY_DATABASE_URI': str(url.set(database=cls.database)),
+        })
+
+    @classmethod
+    def tearDownClass(cls):
+        with cls.app.app_context():
+            db.engine.dispose()
+
+        cls.database_command(f"DROP DATABASE {cls.database}")
+
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.drop_all()
+        db.create_all()
+
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        self.app_context.pop()
+        clear_process_caches()
+
+        super().tearDown()
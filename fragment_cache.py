@@ -0,0 +1,89 @@
+"""Caching of rendered template fragments.
+
+Wrap markup that depends only on some rows, not on who is looking, in a
+`cache` block naming the fragment and stamping those rows' versions:
+
+    {% cache 'user-card', user.id, user.version %}
+      ... the user's picture, name and bio ...
+    {% endcache %}
+
+The first render of each (name, stamps) is stored and later renders reuse
+it without evaluating the body. Since the stamps change whenever the rows
+do, entries never need invalidating; old ones just fall out of the LRU.
+Keys also carry the asset manifest's version, so fragments linking to
+fingerprinted assets (see assets.py) are rebuilt when the assets are.
+Keep viewer-specific parts (follow and like buttons, CSRF tokens) outside
+the block.
+
+Stamp with only what the block shows: a version covers everything about a
+row, so a block showing just an author's name and picture should be
+stamped with those, not with a version that changes on every like.
+
+The store is a per-process TTLCache sized by FRAGMENT_CACHE_SIZE, unless
+FRAGMENT_CACHE_STORE is set to a shared one: any object with get(key),
+returning None if missing, and set(key, value), e.g. a thin wrapper around
+a Redis client. Keys and values are strings.
+"""
+
+from flask import current_app
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from cache import TTLCache
+
+DEFAULT_SIZE = 10_000
+
+# Entries are never stale, so this only bounds how long unused ones linger
+DEFAULT_TTL = 24 * 60 * 60
+
+
+def fragment_key(name, assets_version, stamps):
+    return ':'.join(['fragment', name, assets_version, *map(str, stamps)])
+
+
+class FragmentCacheExtension(Extension):
+    """Adds the `{% cache name, stamp, ... %}...{% endcache %}` tag."""
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+
+        name = parser.parse_expression()
+        stamps = []
+        while parser.stream.skip_if('comma'):
+            stamps.append(parser.parse_expression())
+
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        call = self.call_method('_render', [name, nodes.List(stamps)])
+
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render(self, name, stamps, caller):
+        store = current_app.extensions.get('fragment_cache')
+        if store is None:
+            return caller()
+
+        key = fragment_key(
+            name, current_app.extensions.get('assets_version', ''), stamps)
+        fragment = store.get(key)
+
+        if fragment is None:
+            fragment = caller()
+            store.set(key, str(fragment))
+
+        return Markup(fragment)
+
+
+def init_app(app):
+    """Add the `cache` tag to `app`'s templates, and set up its store."""
+
+    store = app.config.get('FRAGMENT_CACHE_STORE')
+    if store is None:
+        store = TTLCache(
+            max_size=app.config.get('FRAGMENT_CACHE_SIZE', DEFAULT_SIZE),
+            ttl=DEFAULT_TTL)
+
+    app.extensions['fragment_cache'] = store
+    app.jinja_env.add_extension(FragmentCacheExtension)
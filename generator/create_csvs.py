@@ -3,12 +3,30 @@
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
 tweak the CSV formats or generate fewer/more rows.
+
+Run it from the project root, e.g.:
+
+    python generator/create_csvs.py --users 10000000 --follows 1000000000
+
+Output depends only on the arguments (including --seed and --until), never on
+--workers, so a dataset can be regenerated exactly. Nothing held in memory
+grows with the number of rows: each table is split into fixed-size shards,
+which worker processes generate in parallel and stream to disk, and the
+shards are then concatenated in order.
+
+User and message ids in the other CSVs assume users.csv and messages.csv
+are loaded into empty tables, so they get ids 1 to --users and --messages.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
+import os
+import shutil
+from datetime import date, datetime, time
+from math import gcd, log
+from multiprocessing import Pool
+from random import Random
+
 from faker import Faker
 from helpers import get_random_datetime
 
@@ -17,14 +35,44 @@ MAX_WARBLER_LENGTH = 140
 USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
 MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+LIKES_CSV_HEADERS = ['user_id', 'message_id']
 
 NUM_USERS = 300
 NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
+NUM_FOLLOWS = 5000
+NUM_LIKES = 3000
+
+# bcrypt hash of "password"
+PASSWORD_HASH = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
+
+# Rows per shard; each shard is generated by one worker, in bounded memory
+SHARD_SIZE = 100_000
 
-fake = Faker()
+# How many distinct fake names, sentences, etc. to draw rows from. Faker is
+# far too slow to call per row for millions of rows.
+FAKE_POOL_SIZE = 10_000
 
-# Generate random profile image URLs to use for users
+# Follower counts follow a power law: the user with popularity rank r is
+# followed with probability proportional to r ** -FOLLOW_EXPONENT.
+FOLLOW_EXPONENT = 1.1
+
+# Likes are skewed the same way twice over: a few hot messages get most of
+# the likes, and a few heavy likers give most of them.
+HOT_MESSAGE_EXPONENT = 1.1
+HEAVY_LIKER_EXPONENT = 0.9
+
+# Most likes one user gives. Each user's likes are drawn in memory at once,
+# so this bounds a worker's memory however large --likes is.
+MAX_LIKES_PER_USER = 100_000
+
+# Spread popularity ranks over ids, so the most-followed users aren't simply
+# the first ones created. Heavy likers use a different stride and offset, so
+# they aren't the most-followed users too.
+RANK_STRIDE = 2_654_435_761
+LIKER_RANK_STRIDE = 2_246_822_519
+LIKER_RANK_OFFSET = 1_640_531_527
+
+# Profile image URLs to use for users
 
 image_urls = [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
@@ -32,46 +80,351 @@ image_urls = [
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
+# Header image URLs to use for users (from splashbase.co)
 
 header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
+    f"https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_{name}_1280.jpg"
+    for name in [
+        "mnh0n9pHJW1st5lhmo1", "mnh0uemhCk1st5lhmo1", "mnh121HEWa1st5lhmo1",
+        "mnh17lfd9R1st5lhmo1", "mnh1d7s3UD1st5lhmo1", "mnh1jdFvHR1st5lhmo1",
+        "mnh1uhYnog1st5lhmo1", "mnh25vNOvI1st5lhmo1", "mnh29fxz111st5lhmo1",
+        "mnh2m1hnS81st5lhmo1", "mo1h6tGOZf1st5lhmo1", "mo2wz2LTCs1st5lhmo1",
+        "mo2x3aAnRH1st5lhmo1", "mo2x80NkDu1st5lhmo1", "mo2x9xqeef1st5lhmo1",
+        "mo2xbk8JUK1st5lhmo1", "mo2xdqmle51st5lhmo1", "mo2xfarCvW1st5lhmo1",
+        "mo2xgqdEFn1st5lhmo1", "mo2xijE2nr1st5lhmo1", "mopq4kHmAg1st5lhmo1",
+        "mopq69jlcS1st5lhmo1", "mopq8fyQwI1st5lhmo1", "mopqamedKu1st5lhmo1",
+        "mopqc3ZZcz1st5lhmo1", "mopqdfx05t1st5lhmo1", "mopqfpSTPN1st5lhmo1",
+        "mopqhxFulr1st5lhmo1", "mopqj9QUeq1st5lhmo1", "mopqkkwK2M1st5lhmo1",
+        "mp6rzyNlAN1st5lhmo1", "mp6s1hAudo1st5lhmo1", "mp6s32zb6l1st5lhmo1",
+        "mp6s4dzqHA1st5lhmo1", "mp6s661UgK1st5lhmo1", "mp6s7lR1lS1st5lhmo1",
+        "mp6s995bvI1st5lhmo1", "mp6sasSvPZ1st5lhmo1", "mp6scv2xrZ1st5lhmo1",
+        "mpp6f50W261st5lhmo1", "mpp6gwrYvm1st5lhmo1", "mpp6l06zXi1st5lhmo1",
+        "mpp6poZxE51st5lhmo1", "mpp6tjdFhf1st5lhmo1", "mpp6w0dxAm1st5lhmo1",
+    ]
 ]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+# Set in each worker process by init_worker
+fake_pools = None
+
+
+##############################################################################
+# Random helpers
+
+
+def shard_rng(seed, table, shard):
+    """Return the RNG for one shard of a table.
+
+    Each shard gets its own stream, so shards can be generated in any order
+    or in parallel and still produce the same rows.
+    """
+
+    return Random(f"{seed}:{table}:{shard}")
+
+
+def make_fake_pools(seed):
+    """Return lists of fake values to draw rows from, built with Faker."""
+
+    fake = Faker()
+    fake.seed_instance(seed)
+
+    def pool(make):
+        return [make() for _ in range(FAKE_POOL_SIZE)]
+
+    return dict(
+        user_names=pool(fake.user_name),
+        email_domains=pool(fake.free_email_domain),
+        bios=pool(fake.sentence),
+        locations=pool(fake.city),
+        texts=pool(lambda: fake.paragraph()[:MAX_WARBLER_LENGTH]),
+    )
+
+
+def init_worker(pools):
+    global fake_pools
+    fake_pools = pools
+
+
+class PowerLawIds:
+    """Draws ids from 1 to `size`, where the id with popularity rank r is
+    drawn with probability proportional to r ** -exponent.
+
+    Ranks are drawn by inverting the CDF of the continuous power law, so each
+    draw is O(1) with no per-id tables. Ranks map to ids by
+    (rank - 1) * stride + offset, mod size; distributions over the same ids
+    with different strides and offsets rank them independently.
+    """
+
+    def __init__(self, size, exponent, stride=RANK_STRIDE, offset=0):
+        self.size = size
+        self.exponent = exponent
+        self.power = 1 - exponent
+        self.span = (size + 1) ** self.power - 1
+
+        stride = stride % size or 1
+        while gcd(stride, size) != 1:
+            stride += 1
+        self.stride = stride
+        self.inverse_stride = pow(stride, -1, size) if size > 1 else 0
+        self.offset = offset % size
+
+    def draw(self, rng):
+        if self.exponent == 1:
+            rank = (self.size + 1) ** rng.random()
+        else:
+            rank = (self.span * rng.random() + 1) ** (1 / self.power)
+
+        return self.id_for_rank(min(int(rank), self.size))
+
+    def id_for_rank(self, rank):
+        # A bijection, since stride is coprime to size
+        return ((rank - 1) * self.stride + self.offset) % self.size + 1
+
+    def rank_of(self, id):
+        return (id - 1 - self.offset) * self.inverse_stride % self.size + 1
+
+    def cumulative(self, rank):
+        """Fraction of draws landing on ranks 1 to `rank`."""
+
+        if self.exponent == 1:
+            return log(rank + 1) / log(self.size + 1)
+
+        return ((rank + 1) ** self.power - 1) / self.span
+
+    def share(self, id, total):
+        """Split `total` over ids in proportion to the distribution.
+
+        The shares of all ids sum to exactly `total`.
+        """
+
+        rank = self.rank_of(id)
+        return (
+            int(total * self.cumulative(rank)) -
+            int(total * self.cumulative(rank - 1)))
+
+
+def distinct_draws(rng, distribution, count, exclude=None):
+    """Return `count` distinct ids drawn from `distribution`, never `exclude`."""
+
+    size = distribution.size
+
+    if 2 * count >= size:
+        # Wants most ids; rejection sampling would crawl
+        ids = rng.sample(range(1, size + 1), count + (exclude is not None))
+        return sorted([id for id in ids if id != exclude][:count])
+
+    ids = set()
+    draws = 0
+    while len(ids) < count:
+        # Fall back to uniform draws if the head of the distribution is
+        # exhausted
+        if draws < 20 * count:
+            id = distribution.draw(rng)
+        else:
+            id = rng.randint(1, size)
+        draws += 1
+
+        if id != exclude:
+            ids.add(id)
+
+    return sorted(ids)
+
+
+##############################################################################
+# Shards
+
+
+def shard_bounds(shard, per_shard, total):
+    """Return the 1-based [start, stop) range of items in `shard`."""
+
+    start = shard * per_shard + 1
+    return start, min(start + per_shard, total + 1)
+
+
+def num_shards(total, per_shard):
+    return max(1, -(-total // per_shard))
+
+
+def write_users_shard(args, shard, path):
+    rng = shard_rng(args.seed, 'users', shard)
+    start, stop = shard_bounds(shard, SHARD_SIZE, args.users)
+
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+
+        for user_id in range(start, stop):
+            # Suffixing the id keeps usernames (and so emails) unique
+            username = f"{rng.choice(fake_pools['user_names'])}{user_id}"
+
+            writer.writerow([
+                f"{username}@{rng.choice(fake_pools['email_domains'])}",
+                username,
+                rng.choice(image_urls),
+                PASSWORD_HASH,
+                rng.choice(fake_pools['bios']),
+                rng.choice(header_image_urls),
+                rng.choice(fake_pools['locations']),
+            ])
+
+
+def write_messages_shard(args, shard, path):
+    rng = shard_rng(args.seed, 'messages', shard)
+    start, stop = shard_bounds(shard, SHARD_SIZE, args.messages)
+
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+
+        for _ in range(start, stop):
+            writer.writerow([
+                rng.choice(fake_pools['texts']),
+                get_random_datetime(now=args.until, rng=rng),
+                rng.randint(1, args.users),
+            ])
+
+
+def users_per_shard(args, rows):
+    """Follows and likes are sharded by user; aim for ~SHARD_SIZE rows each."""
+
+    return max(1, SHARD_SIZE * args.users // max(rows, 1))
+
+
+def num_following(follower_id, args):
+    """How many users `follower_id` follows.
+
+    Spreads --follows as evenly as possible over users, so the counts sum to
+    exactly --follows whichever shards they are computed in.
+    """
+
+    return (
+        args.follows * follower_id // args.users -
+        args.follows * (follower_id - 1) // args.users)
+
+
+def write_follows_shard(args, shard, path):
+    rng = shard_rng(args.seed, 'follows', shard)
+    start, stop = shard_bounds(
+        shard, users_per_shard(args, args.follows), args.users)
+    popular = PowerLawIds(args.users, args.follow_exponent)
+
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+
+        for follower_id in range(start, stop):
+            followed = distinct_draws(
+                rng, popular, num_following(follower_id, args),
+                exclude=follower_id)
+
+            writer.writerows((user_id, follower_id) for user_id in followed)
+
+
+def write_likes_shard(args, shard, path):
+    rng = shard_rng(args.seed, 'likes', shard)
+    start, stop = shard_bounds(
+        shard, users_per_shard(args, args.likes), args.users)
+    hot_messages = PowerLawIds(args.messages, args.hot_message_exponent)
+    heavy_likers = PowerLawIds(
+        args.users, args.heavy_liker_exponent,
+        stride=LIKER_RANK_STRIDE, offset=LIKER_RANK_OFFSET)
+
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+
+        for user_id in range(start, stop):
+            # Nobody can like a message twice, and nobody gives more than
+            # --max-likes-per-user, so the heaviest likers may fall short of
+            # their share
+            count = min(
+                heavy_likers.share(user_id, args.likes),
+                args.messages, args.max_likes_per_user)
+            liked = distinct_draws(rng, hot_messages, count)
+
+            writer.writerows((user_id, message_id) for message_id in liked)
+
+
+##############################################################################
+# Output
+
+
+def write_csv(pool, args, name, headers, write_shard, shards):
+    """Generate every shard of a table in `pool`, then join them into one CSV."""
+
+    path = os.path.join(args.out_dir, f"{name}.csv")
+    parts = [f"{path}.{shard}.part" for shard in range(shards)]
+
+    pool.starmap(
+        write_shard,
+        [(args, shard, part) for shard, part in enumerate(parts)])
+
+    with open(path, 'w', newline='') as out:
+        csv.writer(out).writerow(headers)
+
+        for part in parts:
+            with open(part, newline='') as f:
+                shutil.copyfileobj(f, out)
+            os.remove(part)
+
+    print(f"Wrote {path}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--follows', type=int, default=NUM_FOLLOWS)
+    parser.add_argument(
+        '--follow-exponent', type=float, default=FOLLOW_EXPONENT,
+        help="power-law exponent of follower counts (higher is more skewed)")
+    parser.add_argument('--likes', type=int, default=NUM_LIKES)
+    parser.add_argument(
+        '--hot-message-exponent', type=float, default=HOT_MESSAGE_EXPONENT,
+        help="power-law exponent of likes per message")
+    parser.add_argument(
+        '--heavy-liker-exponent', type=float, default=HEAVY_LIKER_EXPONENT,
+        help="power-law exponent of likes per user")
+    parser.add_argument(
+        '--max-likes-per-user', type=int, default=MAX_LIKES_PER_USER,
+        help="most likes one user gives; bounds each worker's memory")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--until', type=datetime.fromisoformat,
+        default=datetime.combine(date.today(), time()),
+        help="latest message timestamp, as an ISO date (default: today)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--out-dir', default='generator')
+
+    args = parser.parse_args(argv)
+
+    if args.users < 2:
+        parser.error("--users must be at least 2")
+    if args.follows > args.users * (args.users - 1):
+        parser.error("--follows exceeds the number of possible follows")
+    if args.likes and args.messages < 1:
+        parser.error("--likes needs at least one message")
+    if args.max_likes_per_user < 1:
+        parser.error("--max-likes-per-user must be positive")
+    for name in ['follow_exponent', 'hot_message_exponent', 'heavy_liker_exponent']:
+        if getattr(args, name) <= 0:
+            parser.error(f"--{name.replace('_', '-')} must be positive")
+
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    with Pool(args.workers, init_worker, (make_fake_pools(args.seed),)) as pool:
+        write_csv(
+            pool, args, 'users', USERS_CSV_HEADERS, write_users_shard,
+            num_shards(args.users, SHARD_SIZE))
+        write_csv(
+            pool, args, 'messages', MESSAGES_CSV_HEADERS, write_messages_shard,
+            num_shards(args.messages, SHARD_SIZE))
+        write_csv(
+            pool, args, 'follows', FOLLOWS_CSV_HEADERS, write_follows_shard,
+            num_shards(args.users, users_per_shard(args, args.follows)))
+        write_csv(
+            pool, args, 'likes', LIKES_CSV_HEADERS, write_likes_shard,
+            num_shards(args.users, users_per_shard(args, args.likes)))
+
+
+if __name__ == '__main__':
+    main()
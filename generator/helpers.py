@@ -1,14 +1,18 @@
 """Support functions for CSV generation."""
 
 from datetime import datetime
-from random import uniform
+import random
 
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+def get_random_datetime(year_gap=2, now=None, rng=random):
+    """Get a random datetime within the `year_gap` years before `now`.
 
-    now = datetime.now()
+    `now` defaults to the current time; pass a fixed one, and a seeded
+    random.Random as `rng`, to get repeatable results.
+    """
+
+    now = now or datetime.now()
     then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+    random_timestamp = rng.uniform(then.timestamp(), now.timestamp())
 
     return datetime.fromtimestamp(random_timestamp)
@@ -0,0 +1,47 @@
+"""gunicorn settings for Warbler; gunicorn reads this from the project root."""
+
+import os
+import sys
+
+from metrics import clear_snapshots
+
+# Threaded workers, so each process has several requests in flight and its
+# shared limits mean something: in particular, PasswordHasher's bcrypt pool
+# (see passwords.py) caps the whole host at workers * PASSWORD_HASH_WORKERS
+# concurrent hashes. With sync workers every process only ever has one
+# request, so that cap and its queue would never come into play.
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+
+def on_starting(server):
+    """Forget metrics left behind by the previous server (see metrics.py)."""
+
+    directory = os.environ.get('METRICS_DIR')
+    if directory and os.path.isdir(directory):
+        clear_snapshots(directory)
+
+
+def post_fork(server, worker):
+    """With --preload, the app was created before forking; make sure the
+    worker doesn't share database connections the master opened."""
+
+    app = vars(sys.modules.get('app', object)).get('app')
+    if app is None:
+        return
+
+    from models import db
+
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    """Load every template before the worker takes requests, from the
+    compiled ones if `flask compile-templates` has been run."""
+
+    from template_cache import preload
+
+    count, seconds = preload(worker.wsgi)
+    worker.log.info(
+        "Loaded %d templates in %.0fms", count, seconds * 1000)
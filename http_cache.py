@@ -0,0 +1,123 @@
+"""HTTP caching policy for Warbler.
+
+- Fingerprinted static files (see `is_fingerprinted` and assets.py) never
+  change, so they are cached for a year and marked immutable. Other static
+  files may be cached but must be revalidated, which Flask answers from
+  their mtime.
+- Pages that can be validated cheaply call `not_modified` once they know
+  what they'll show, passing version stamps of it (e.g. `user_stamp`). The
+  stamps, the URL and the viewer make a weak ETag; if the browser already
+  has that version, a 304 is returned before anything is rendered. These
+  pages are personal, so they are `private, no-cache`: kept by the browser
+  but not by shared caches, and always revalidated.
+- Everything else is `no-store`.
+
+Stamps are cheap rather than exact: e.g. a followers list is stamped with
+the user's follower count and version, not with the profile of everyone on
+it, so a follower's new picture may show only once the page changes for
+another reason, or after the ETag's time bucket (half the CSRF token
+lifetime, so a cached page's forms always still work) runs out.
+"""
+
+import hashlib
+from time import time
+
+from flask import current_app, g, request, session
+
+import assets
+
+# For fingerprinted static files
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def is_fingerprinted(req):
+    """Does this static file URL name one exact version of the file?"""
+
+    filename = (req.view_args or {}).get('filename', '')
+
+    return assets.is_fingerprinted(filename)
+
+
+def user_stamp(user):
+    """Version stamp for what a page shows about `user`.
+
+    User.version changes with anything the user does and whenever their
+    followers change, even if the count ends up the same (one unfollows,
+    another follows); the counters also catch what others do to them.
+    """
+
+    return (
+        user.id,
+        user.version,
+        user.messages_count,
+        user.following_count,
+        user.followers_count,
+        user.likes_count,
+    )
+
+
+def viewer_stamp():
+    """Version stamp for the parts of a page that depend on who's looking:
+    the navbar, follow and like buttons, and CSRF tokens."""
+
+    time_limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    bucket = int(time() // (time_limit / 2)) if time_limit else 0
+
+    return (
+        user_stamp(g.user.load()) if g.user else None,
+        session.get('csrf_token'),
+        bucket,
+    )
+
+
+def make_etag(*stamps):
+    return hashlib.sha1(repr(stamps).encode()).hexdigest()
+
+
+def not_modified(*stamps):
+    """Return a 304 response if the browser's copy of this page, as given by
+    `stamps`, is current; otherwise None, and the page gets an ETag."""
+
+    # A flashed message would be lost from a 304, and isn't in the ETag
+    if '_flashes' in session:
+        return None
+
+    etag = make_etag(request.full_path, viewer_stamp(), *stamps)
+    g.etag = etag
+
+    if request.if_none_match.contains_weak(etag):
+        return current_app.response_class(status=304)
+
+    return None
+
+
+def init_app(app):
+    """Give each of `app`'s responses its caching headers."""
+
+    @app.before_request
+    def forget_etag():
+        g.pop('etag', None)
+
+    @app.after_request
+    def add_cache_headers(response):
+        etag = g.pop('etag', None)
+
+        if request.endpoint == 'static':
+            response.cache_control.public = True
+            if is_fingerprinted(request):
+                # send_file marks everything no-cache
+                response.cache_control.no_cache = None
+                response.cache_control.max_age = STATIC_MAX_AGE
+                response.cache_control.immutable = True
+            else:
+                response.cache_control.no_cache = True
+
+        elif etag and response.status_code in (200, 304):
+            response.set_etag(etag, weak=True)
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+
+        else:
+            response.cache_control.no_store = True
+
+        return response
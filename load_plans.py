@@ -0,0 +1,79 @@
+"""Declared eager loading for views.
+
+A view states which relationships of the rows it queries its template
+needs, and how to load them: `joined` into the same query (best for a
+many-to-one on a few rows) or `selectin`, one extra query for all rows
+(best for long lists, where a join would repeat the related row on each):
+
+    @bp.get('/')
+    @query_budget(6)
+    @load_plan(selectin=[Message.user])
+    def homepage():
+        ...messages = planned(Message.query...).all()
+
+`planned` applies the plan of the view handling the request to a query.
+With LOAD_PLAN_STRICT set (as in the tests), every relationship the plan
+leaves out, on the queried rows and on the ones loaded with them, raises
+on access instead of being lazily loaded, so a template that starts using
+one fails loudly rather than quietly adding a query per row.
+"""
+
+from flask import current_app, has_request_context, request
+from sqlalchemy.orm import joinedload, raiseload, selectinload
+
+
+class LoadPlan:
+    """The relationships a view loads up front, by loader strategy."""
+
+    def __init__(self, joined=(), selectin=()):
+        self.joined = list(joined)
+        self.selectin = list(selectin)
+
+    def options(self, strict=False):
+        """Return loader options for a query; see the module docstring."""
+
+        options = [joinedload(rel) for rel in self.joined]
+        options += [selectinload(rel) for rel in self.selectin]
+
+        if strict:
+            options = [option.raiseload('*') for option in options]
+            options.append(raiseload('*'))
+
+        return options
+
+
+def load_plan(joined=(), selectin=()):
+    """Declare the relationships a view loads; put under @app.route."""
+
+    def decorate(view):
+        view.load_plan = LoadPlan(joined, selectin)
+        return view
+
+    return decorate
+
+
+def current_plan():
+    if not has_request_context():
+        return None
+
+    view = current_app.view_functions.get(request.endpoint)
+
+    return getattr(view, 'load_plan', None)
+
+
+def planned(query):
+    """Return `query` loading what the current view's plan says.
+
+    Queries made outside a planned view are returned unchanged.
+    """
+
+    plan = current_plan()
+    if plan is None:
+        return query
+
+    return query.options(
+        *plan.options(strict=current_app.config['LOAD_PLAN_STRICT']))
+
+
+def init_app(app):
+    app.config.setdefault('LOAD_PLAN_STRICT', False)
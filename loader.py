@@ -0,0 +1,200 @@
+"""Bulk-load CSV files into Warbler's tables.
+
+On PostgreSQL each file is streamed in with `COPY ... FROM STDIN`, which is
+far faster than INSERTs, and secondary indexes and foreign keys are dropped
+for the duration of the load and rebuilt afterwards (building an index once
+over all the rows is much cheaper than updating it row by row). Primary keys
+and unique constraints are kept so bad data is still rejected.
+
+Other databases (e.g. SQLite) fall back to batched executemany INSERTs.
+
+CSV files must have a header row naming the columns they contain; columns
+left out (e.g. `id`) get their defaults.
+"""
+
+import csv
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import islice
+from time import perf_counter
+
+from sqlalchemy.schema import AddConstraint, CreateIndex, DropIndex
+
+from models import db, User, create_username_search_index
+
+INSERT_BATCH_SIZE = 10_000
+
+USERNAME_SEARCH_INDEXES = ['ix_users_username_trgm', 'ix_users_username_prefix']
+
+
+def is_postgresql():
+    return db.engine.dialect.name == 'postgresql'
+
+
+@contextmanager
+def deferred_indexes(models):
+    """Drop secondary indexes and foreign keys on `models`' tables, then
+    rebuild them when the block exits, even if the load in it failed.
+
+    Does nothing except on PostgreSQL.
+    """
+
+    if not is_postgresql():
+        yield
+        return
+
+    tables = [model.__table__ for model in models]
+    foreign_keys = [fk for t in tables for fk in t.foreign_key_constraints]
+    indexes = [index for t in tables for index in t.indexes]
+
+    with db.engine.begin() as connection:
+        # Our foreign keys are named by PostgreSQL, so look the names up
+        inspector = db.inspect(connection)
+        for table in tables:
+            for fk in inspector.get_foreign_keys(table.name):
+                connection.exec_driver_sql(
+                    f"ALTER TABLE {table.name} DROP CONSTRAINT {fk['name']}")
+        for index in indexes:
+            connection.execute(DropIndex(index))
+        if User.__table__ in tables:
+            for name in USERNAME_SEARCH_INDEXES:
+                connection.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+
+    try:
+        yield
+    except BaseException:
+        # Let go of the failed load's locks, or rebuilding would wait on them
+        db.session.rollback()
+        raise
+    finally:
+        restore_indexes(tables, foreign_keys, indexes)
+
+
+def restore_indexes(tables, foreign_keys, indexes):
+    """Recreate what deferred_indexes dropped."""
+
+    with db.engine.begin() as connection:
+        for index in indexes:
+            timed(f"index {index.name}", connection.execute, CreateIndex(index))
+        if User.__table__ in tables:
+            timed(
+                "username search index",
+                create_username_search_index, User.__table__, connection)
+        for fk in foreign_keys:
+            timed(
+                f"foreign key {fk.parent.name}.{fk.column_keys[0]}",
+                connection.execute, AddConstraint(fk))
+
+
+def timed(label, fn, *args):
+    """Call fn(*args), reporting how long it took."""
+
+    start = perf_counter()
+    result = fn(*args)
+    print(f"{label}: {perf_counter() - start:.2f}s")
+
+    return result
+
+
+def load_csv(model, path):
+    """Load the CSV file at `path` into `model`'s table.
+
+    Prints and returns the number of rows loaded.
+    """
+
+    table = model.__table__
+
+    start = perf_counter()
+    with open(path, newline='') as f:
+        columns = next(csv.reader(f))
+        f.seek(0)
+
+        if is_postgresql():
+            rows = copy_from_csv(table, columns, f)
+        else:
+            rows = insert_from_csv(table, columns, f)
+
+    seconds = perf_counter() - start
+    print(
+        f"{table.name}: {rows:,} rows in {seconds:.2f}s "
+        f"({rows / max(seconds, 1e-9):,.0f} rows/s)")
+
+    return rows
+
+
+def copy_from_csv(table, columns, f):
+    """COPY the CSV in file `f` into `table`; return the row count."""
+
+    column_list = ", ".join(columns)
+    connection = db.engine.raw_connection()
+
+    try:
+        cursor = connection.cursor()
+        cursor.copy_expert(
+            f"COPY {table.name} ({column_list}) "
+            f"FROM STDIN WITH (FORMAT csv, HEADER true)",
+            f)
+        rows = cursor.rowcount
+        connection.commit()
+    finally:
+        connection.close()
+
+    return rows
+
+
+def insert_from_csv(table, columns, f):
+    """INSERT the CSV in file `f` into `table` in batches; return the count."""
+
+    reader = csv.DictReader(f)
+    rows = 0
+
+    # COPY parses values itself; here, match what it would produce
+    datetime_columns = [
+        name for name in columns
+        if isinstance(table.c[name].type, db.DateTime)
+    ]
+
+    def convert(row):
+        row = {name: (value if value != '' else None)
+               for name, value in row.items()}
+        for name in datetime_columns:
+            if row[name] is not None:
+                row[name] = datetime.fromisoformat(row[name])
+        return row
+
+    with db.engine.begin() as connection:
+        while batch := list(islice(reader, INSERT_BATCH_SIZE)):
+            connection.execute(table.insert(), [convert(row) for row in batch])
+            rows += len(batch)
+
+    return rows
+
+
+def reset_sequences(models):
+    """Move each table's id sequence past the largest id loaded.
+
+    Needed when CSVs include ids, or later INSERTs would collide with them.
+    """
+
+    if not is_postgresql():
+        return
+
+    with db.engine.begin() as connection:
+        for model in models:
+            if 'id' not in model.__table__.c:
+                continue
+            table = model.__table__.name
+            connection.exec_driver_sql(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) FROM {table}")
+
+
+def analyze(models):
+    """Refresh the planner's statistics after a bulk load."""
+
+    if not is_postgresql():
+        return
+
+    with db.engine.begin() as connection:
+        for model in models:
+            connection.exec_driver_sql(f"ANALYZE {model.__table__.name}")
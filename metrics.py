@@ -0,0 +1,511 @@
+"""Prometheus-style metrics for Warbler.
+
+Metrics are registered in `registry`, either directly (a Counter, Gauge or
+HistogramMetric that code updates as things happen) or through a collector:
+a function, called at scrape time, that returns metrics built from state
+kept elsewhere (the DB pool, caches, route timings). `/metrics` renders them
+in Prometheus' text exposition format.
+
+Under gunicorn each worker process has its own registry. When METRICS_DIR is
+set, every worker writes a snapshot of its registry there (at most every
+METRICS_FLUSH_SECONDS, and whenever it serves /metrics), and /metrics adds up
+the snapshots of all workers: counters and histograms from every worker
+that has run, including ones since restarted, and gauges from live workers
+only. gunicorn.conf.py empties the directory when the server starts.
+"""
+
+import json
+import os
+import threading
+from bisect import bisect_left
+from glob import glob
+from time import monotonic, perf_counter
+
+from flask import request
+from sqlalchemy.pool import QueuePool
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """Counts of observations falling in each of a fixed set of buckets."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        # The last count is for observations over the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def copy(self):
+        histogram = Histogram(self.buckets)
+        histogram.counts = list(self.counts)
+        histogram.count = self.count
+        histogram.sum = self.sum
+
+        return histogram
+
+    def quantile(self, q):
+        """Estimate the `q` quantile (0 to 1) as the upper bound of the
+        bucket it falls in."""
+
+        if not self.count:
+            return None
+
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+
+        return float('inf')
+
+
+##############################################################################
+# Metric types
+
+
+class Metric:
+    """A named metric with a value for each combination of label values."""
+
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def snapshot_value(self, value):
+        return value
+
+    def snapshot(self):
+        """Return this metric as JSON-friendly data, for `merge`."""
+
+        with self.lock:
+            samples = [
+                [list(key), self.snapshot_value(value)]
+                for key, value in self.values.items()
+            ]
+
+        return dict(
+            type=self.type,
+            help=self.help,
+            labelnames=list(self.labelnames),
+            samples=samples,
+        )
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+
+class HistogramMetric(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = Histogram(self.buckets)
+            self.values[key].observe(value)
+
+    def snapshot_value(self, histogram):
+        return dict(
+            buckets=list(histogram.buckets),
+            counts=list(histogram.counts),
+            sum=histogram.sum,
+        )
+
+
+##############################################################################
+# Registry
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=BUCKETS):
+        return self.register(HistogramMetric(name, help, labelnames, buckets))
+
+    def add_collector(self, collect):
+        """Call `collect()` at each scrape for a list of extra metrics."""
+
+        self.collectors.append(collect)
+        return collect
+
+    def snapshot(self):
+        """Return {name: metric snapshot} for every metric."""
+
+        metrics = list(self.metrics)
+        for collect in self.collectors:
+            metrics.extend(collect())
+
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+
+registry = Registry()
+
+
+def merge(snapshots):
+    """Add up [(pid, snapshot), ...] from several processes.
+
+    Gauges only count from processes that are still running.
+    """
+
+    merged = {}
+
+    for pid, snapshot in snapshots:
+        for name, metric in snapshot.items():
+            if metric['type'] == 'gauge' and not is_running(pid):
+                continue
+
+            target = merged.setdefault(name, dict(metric, samples={}))
+            samples = target['samples']
+
+            for labels, value in metric['samples']:
+                key = tuple(labels)
+                if metric['type'] == 'histogram':
+                    total = samples.setdefault(key, dict(
+                        buckets=value['buckets'],
+                        counts=[0] * len(value['counts']),
+                        sum=0.0))
+                    total['counts'] = [
+                        a + b for a, b in zip(total['counts'], value['counts'])]
+                    total['sum'] += value['sum']
+                else:
+                    samples[key] = samples.get(key, 0) + value
+
+    return merged
+
+
+def is_running(pid):
+    if pid == os.getpid():
+        return True
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+##############################################################################
+# Text exposition
+
+
+def escape_label_value(value):
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace('"', '\\"')
+        .replace("\n", "\\n"))
+
+
+def format_labels(names, values, **extra):
+    pairs = list(zip(names, values)) + list(extra.items())
+    if not pairs:
+        return ""
+
+    return "{" + ",".join(
+        f'{name}="{escape_label_value(value)}"' for name, value in pairs) + "}"
+
+
+def format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(merged):
+    """Render merged snapshots in the Prometheus text format."""
+
+    lines = []
+
+    for name, metric in sorted(merged.items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        labelnames = metric['labelnames']
+
+        for key, value in sorted(metric['samples'].items()):
+            if metric['type'] != 'histogram':
+                lines.append(
+                    f"{name}{format_labels(labelnames, key)} "
+                    f"{format_value(value)}")
+                continue
+
+            cumulative = 0
+            bounds = value['buckets'] + [float('inf')]
+            for bound, count in zip(bounds, value['counts']):
+                cumulative += count
+                labels = format_labels(labelnames, key, le=format_value(bound))
+                lines.append(f"{name}_bucket{labels} {cumulative}")
+
+            labels = format_labels(labelnames, key)
+            lines.append(f"{name}_sum{labels} {format_value(value['sum'])}")
+            lines.append(f"{name}_count{labels} {cumulative}")
+
+    return "\n".join(lines) + "\n"
+
+
+##############################################################################
+# Multi-process snapshots
+
+
+def write_snapshot(directory):
+    """Write this process's snapshot to `directory`, atomically."""
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{os.getpid()}.json")
+
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(f"{path}.tmp", path)
+
+
+def read_snapshots(directory):
+    """Return [(pid, snapshot), ...] for every process in `directory`."""
+
+    snapshots = []
+
+    for path in glob(os.path.join(directory, "*.json")):
+        pid = int(os.path.basename(path).split(".")[0])
+        try:
+            with open(path) as f:
+                snapshots.append((pid, json.load(f)))
+        except (OSError, ValueError):
+            # Removed, or being replaced, since we listed it
+            continue
+
+    return snapshots
+
+
+def clear_snapshots(directory):
+    for path in glob(os.path.join(directory, "*.json")):
+        os.remove(path)
+
+
+def exposition(directory=None):
+    """Return the text for /metrics, from every worker if `directory` is set."""
+
+    if not directory:
+        return render(merge([(os.getpid(), registry.snapshot())]))
+
+    write_snapshot(directory)
+    return render(merge(read_snapshots(directory)))
+
+
+##############################################################################
+# Database pool
+
+
+pool_checkout_seconds = registry.histogram(
+    'warbler_db_pool_checkout_seconds',
+    "Time spent waiting to check a connection out of the pool.")
+
+
+class TimedQueuePool(QueuePool):
+    """A QueuePool that records how long each checkout waits."""
+
+    def _do_get(self):
+        start = perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_checkout_seconds.observe(perf_counter() - start)
+
+
+# Returns the engine whose pool is reported; set by watch_pool
+watched_engine = None
+
+
+def watch_pool(engine_getter):
+    """Report the size of the pool of the engine `engine_getter()` returns.
+
+    Each call replaces the last, so an app created later (e.g. in tests)
+    is the one reported.
+    """
+
+    global watched_engine
+    watched_engine = engine_getter
+
+
+@registry.add_collector
+def collect_pool():
+    if watched_engine is None:
+        return []
+
+    pool = watched_engine().pool
+    if not isinstance(pool, QueuePool):
+        return []
+
+    gauges = [
+        ('warbler_db_pool_size', "Connections the pool keeps open.",
+         pool.size()),
+        ('warbler_db_pool_checked_out', "Connections in use.",
+         pool.checkedout()),
+        ('warbler_db_pool_overflow', "Connections open beyond the pool size.",
+         max(pool.overflow(), 0)),
+    ]
+
+    metrics = []
+    for name, help, value in gauges:
+        gauge = Gauge(name, help)
+        gauge.set(value)
+        metrics.append(gauge)
+
+    return metrics
+
+
+watched_caches = {}
+
+
+def watch_cache(name, cache):
+    """Report hits and misses of TTLCache `cache`; its hit ratio is
+    hits / (hits + misses)."""
+
+    watched_caches[name] = cache
+
+
+@registry.add_collector
+def collect_caches():
+    hits = Counter(
+        'warbler_cache_hits_total', "Cache lookups that hit.", ['cache'])
+    misses = Counter(
+        'warbler_cache_misses_total', "Cache lookups that missed.", ['cache'])
+
+    for name, cache in watched_caches.items():
+        hits.inc(cache.hits, cache=name)
+        misses.inc(cache.misses, cache=name)
+
+    return [hits, misses]
+
+
+# The PasswordHasher whose pool is reported; set by watch_password_hasher
+watched_password_hasher = None
+
+
+def watch_password_hasher(hasher):
+    """Report the load on PasswordHasher `hasher`'s pool."""
+
+    global watched_password_hasher
+    watched_password_hasher = hasher
+
+
+@registry.add_collector
+def collect_password_hasher():
+    if watched_password_hasher is None:
+        return []
+
+    stats = watched_password_hasher.stats()
+
+    gauges = [
+        ('warbler_password_hash_active', "Password hashes running.",
+         stats['active']),
+        ('warbler_password_hash_queued',
+         "Password hashes waiting for a worker.", stats['queued']),
+    ]
+    counters = [
+        ('warbler_password_hash_completed_total', "Password hashes finished.",
+         stats['completed']),
+        ('warbler_password_hash_rejected_total',
+         "Password hashes turned away because the queue was full.",
+         stats['rejected']),
+    ]
+
+    metrics = []
+    for name, help, value in gauges:
+        gauge = Gauge(name, help)
+        gauge.set(value)
+        metrics.append(gauge)
+    for name, help, value in counters:
+        counter = Counter(name, help)
+        counter.inc(value)
+        metrics.append(counter)
+
+    return metrics
+
+
+##############################################################################
+# Flask integration
+
+
+requests_total = registry.counter(
+    'warbler_requests_total', "HTTP requests served.",
+    ['endpoint', 'method', 'status'])
+
+writes_total = registry.counter(
+    'warbler_writes_total',
+    "Rows written by users, by kind (message, like, unlike, follow, unfollow).",
+    ['kind'])
+
+
+def init_app(app):
+    """Count `app`'s requests and keep its METRICS_DIR snapshot fresh."""
+
+    app.config.setdefault('METRICS_DIR', os.environ.get('METRICS_DIR'))
+    app.config.setdefault('METRICS_FLUSH_SECONDS', 1)
+
+    last_flush = 0
+
+    @app.after_request
+    def count_request(response):
+        nonlocal last_flush
+
+        requests_total.inc(
+            endpoint=request.endpoint or 'unmatched',
+            method=request.method,
+            status=response.status_code)
+
+        directory = app.config['METRICS_DIR']
+        if directory and monotonic() - last_flush >= app.config['METRICS_FLUSH_SECONDS']:
+            last_flush = monotonic()
+            write_snapshot(directory)
+
+        return response
@@ -0,0 +1,149 @@
+"""Schema migrations for Warbler.
+
+A fresh database gets the whole schema from `db.create_all()` and is then
+stamped as up to date. An existing database is brought up to date by
+`upgrade()`, which runs, in order, each migration in MIGRATIONS that isn't
+recorded in the `schema_migrations` table yet. Each migration runs in its
+own transaction and is written to be safe on a database that already has
+some of its changes.
+
+Add new migrations to the end of MIGRATIONS; never renumber old ones.
+"""
+
+from datetime import datetime
+
+from models import db, User, Message, Follows, MessagesLiked, TimelineEntry, \
+    create_username_search_index
+import timeline
+
+schema_migrations = db.Table(
+    'schema_migrations',
+    db.Column('version', db.Integer, primary_key=True),
+    db.Column('name', db.Text, nullable=False),
+    db.Column('applied_at', db.DateTime, nullable=False),
+)
+
+USER_COUNTER_COLUMNS = [
+    'messages_count',
+    'following_count',
+    'followers_count',
+    'likes_count',
+]
+
+
+def create_index_if_missing(connection, model, name):
+    """Create the index `name` declared on `model`, unless it exists."""
+
+    index = next(i for i in model.__table__.indexes if i.name == name)
+    index.create(connection, checkfirst=True)
+
+
+##############################################################################
+# Migrations
+
+
+def add_timeline_entries(connection):
+    TimelineEntry.__table__.create(connection, checkfirst=True)
+    timeline.backfill_timelines(connection)
+
+
+def add_user_counters(connection):
+    existing = {
+        column['name']
+        for column in db.inspect(connection).get_columns('users')
+    }
+
+    for name in USER_COUNTER_COLUMNS:
+        if name not in existing:
+            connection.execute(db.text(
+                f"ALTER TABLE users "
+                f"ADD COLUMN {name} INTEGER NOT NULL DEFAULT 0"))
+
+    User.reconcile_counts(connection)
+
+
+def add_username_search_index(connection):
+    create_username_search_index(User.__table__, connection)
+
+
+def add_hot_query_indexes(connection):
+    create_index_if_missing(
+        connection, Message, 'ix_messages_user_id_timestamp')
+    create_index_if_missing(
+        connection, Follows, 'ix_follows_user_following_id')
+    create_index_if_missing(
+        connection, MessagesLiked, 'ix_messages_liked_user_id')
+
+
+def add_user_versions(connection):
+    existing = {
+        column['name']
+        for column in db.inspect(connection).get_columns('users')
+    }
+
+    if 'version' not in existing:
+        connection.execute(db.text(
+            "ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 0"))
+
+
+MIGRATIONS = [
+    (1, "add timeline_entries", add_timeline_entries),
+    (2, "add user counters", add_user_counters),
+    (3, "add username search index", add_username_search_index),
+    (4, "add hot query indexes", add_hot_query_indexes),
+    (5, "add user versions", add_user_versions),
+]
+
+
+##############################################################################
+# Running migrations
+
+
+def applied_versions():
+    """Return the set of migration versions recorded as applied."""
+
+    schema_migrations.create(db.engine, checkfirst=True)
+
+    with db.engine.connect() as connection:
+        return {
+            version for (version,)
+            in connection.execute(db.select(schema_migrations.c.version))
+        }
+
+
+def record(connection, version, name):
+    connection.execute(schema_migrations.insert().values(
+        version=version,
+        name=name,
+        applied_at=datetime.utcnow(),
+    ))
+
+
+def upgrade():
+    """Run every pending migration; return the names of those run."""
+
+    done = applied_versions()
+    ran = []
+
+    for version, name, migrate in MIGRATIONS:
+        if version in done:
+            continue
+
+        with db.engine.begin() as connection:
+            migrate(connection)
+            record(connection, version, name)
+
+        ran.append(name)
+
+    return ran
+
+
+def stamp():
+    """Record every migration as applied (for databases made by create_all)."""
+
+    done = applied_versions()
+
+    with db.engine.begin() as connection:
+        for version, name, _ in MIGRATIONS:
+            if version not in done:
+                record(connection, version, name)
@@ -5,9 +5,14 @@ from pickle import FALSE
 
 from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.orm import configure_mappers
+
+from passwords import PasswordHasher
 
 bcrypt = Bcrypt()
 db = SQLAlchemy()
+password_hasher = PasswordHasher(bcrypt)
 
 DEFAULT_IMAGE_URL = "/static/images/default-pic.png"
 DEFAULT_HEADER_IMAGE_URL = "/static/images/warbler-hero.jpg"
@@ -30,6 +35,15 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # The primary key serves "who follows X"; this serves "who does X follow"
+    __table_args__ = (
+        db.Index(
+            'ix_follows_user_following_id',
+            user_following_id,
+            user_being_followed_id,
+        ),
+    )
+
 
 class User(db.Model):
     """User in the system."""
@@ -76,6 +90,47 @@ class User(db.Model):
         nullable=False,
     )
 
+    # Denormalized counts, kept up to date by `adjust_counts` wherever the
+    # underlying rows change; `reconcile_counts` recomputes them from scratch
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # Bumped by every change this user makes (profile, messages, follows,
+    # likes) or that changes who follows them, so pages about or for them
+    # can be revalidated cheaply; see http_cache.py
+    version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
     messages = db.relationship('Message', backref="user")
 
     liked_messages = db.relationship(
@@ -92,6 +147,11 @@ class User(db.Model):
         backref="following",
     )
 
+    # Per-instance {message_id: liked?} and {user_id: followed?} answers;
+    # see preload_liked and preload_following
+    _liked_cache = None
+    _following_cache = None
+
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
@@ -102,7 +162,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = password_hasher.hash(password)
 
         user = User(
             username=username,
@@ -124,30 +184,201 @@ class User(db.Model):
 
         If this can't find matching user (or if password is wrong), returns
         False.
+
+        If the stored hash was made at a different bcrypt cost than is now
+        configured, it is replaced with a new hash (commit to save it).
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = password_hasher.check(user.password, password)
             if is_auth:
+                if password_hasher.needs_rehash(user.password):
+                    user.password = password_hasher.hash(password)
                 return user
 
         return False
 
+    @classmethod
+    def adjust_counts(cls, user_ids, **deltas):
+        """Add `deltas` to the counters of `user_ids` (an id or a select of ids).
+
+        e.g. User.adjust_counts(user.id, followers_count=1)
+
+        A delta may also be a SQL expression correlated to the users row.
+
+        This is a single UPDATE evaluated in the database, so concurrent
+        adjustments don't overwrite each other; commit it with the change
+        being counted.
+        """
+
+        if isinstance(user_ids, int):
+            condition = cls.id == user_ids
+        else:
+            condition = cls.id.in_(user_ids)
+
+        values = {
+            getattr(cls, name): getattr(cls, name) + delta
+            for name, delta in deltas.items()
+        }
+
+        db.session.execute(
+            db.update(cls)
+            .where(condition)
+            .values(values)
+            .execution_options(synchronize_session='fetch'))
+
+    @classmethod
+    def reconcile_counts(cls, connection=None):
+        """Recompute every user's counters from the source tables.
+
+        Runs in the session unless given a `connection`.
+        """
+
+        def count(model, column):
+            return (
+                db.select(db.func.count())
+                .select_from(model)
+                .where(column == cls.id)
+                .scalar_subquery())
+
+        stmt = (
+            db.update(cls)
+            .values(
+                messages_count=count(Message, Message.user_id),
+                following_count=count(Follows, Follows.user_following_id),
+                followers_count=count(Follows, Follows.user_being_followed_id),
+                likes_count=count(MessagesLiked, MessagesLiked.user_id),
+            ))
+
+        if connection is not None:
+            connection.execute(stmt)
+        else:
+            db.session.execute(
+                stmt.execution_options(synchronize_session='fetch'))
+
+    def reset_request_caches(self):
+        """Forget answers preloaded for a previous request."""
+
+        self._liked_cache = None
+        self._following_cache = None
+
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [
-            user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return db.session.query(
+            Follows
+            .query
+            .filter_by(
+                user_being_followed_id=self.id,
+                user_following_id=other_user.id)
+            .exists()
+        ).scalar()
 
     def is_following(self, other_user):
-        """Is this user following `other_use`?"""
+        """Is this user following `other_use`?
+
+        Answered from `preload_following` (or an earlier call) when possible;
+        otherwise checks the single follows row.
+        """
+
+        if self._following_cache is None:
+            self._following_cache = {}
+
+        if other_user.id not in self._following_cache:
+            self._following_cache[other_user.id] = db.session.query(
+                Follows
+                .query
+                .filter_by(
+                    user_being_followed_id=other_user.id,
+                    user_following_id=self.id)
+                .exists()
+            ).scalar()
+
+        return self._following_cache[other_user.id]
+
+    def following_ids_among(self, user_ids):
+        """Return the set of `user_ids` this user follows, in a single query."""
+
+        if not user_ids:
+            return set()
+
+        rows = db.session.query(Follows.user_being_followed_id).filter(
+            (Follows.user_following_id == self.id) &
+            (Follows.user_being_followed_id.in_(user_ids))
+        )
+
+        return {user_id for (user_id,) in rows}
+
+    def preload_following(self, users):
+        """Look up which of `users` this user follows, in a single query.
+
+        Like `preload_liked`, the answers are kept on this instance for
+        `is_following` to use.
+        """
+
+        user_ids = [user.id for user in users]
+        followed_ids = self.following_ids_among(user_ids)
+
+        if self._following_cache is None:
+            self._following_cache = {}
+
+        for user_id in user_ids:
+            self._following_cache[user_id] = user_id in followed_ids
+
+    def _expire_follows(self, other_user):
+        """Have the collections a follow changes reload when next used."""
+
+        db.session.expire(self, ['following'])
+        db.session.expire(other_user, ['followers'])
+
+    def follow(self, other_user):
+        """Start following `other_user`, updating both users' counters."""
+
+        # Add the row itself, rather than through `following`, which would
+        # load everyone this user follows
+        db.session.add(Follows(
+            user_being_followed_id=other_user.id,
+            user_following_id=self.id,
+        ))
+        self._expire_follows(other_user)
+        User.adjust_counts(self.id, following_count=1, version=1)
+        User.adjust_counts(other_user.id, followers_count=1, version=1)
 
-        found_user_list = [
-            user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        if self._following_cache is not None:
+            self._following_cache[other_user.id] = True
+
+    def unfollow(self, other_user):
+        """Stop following `other_user`, updating both users' counters."""
+
+        Follows.query.filter_by(
+            user_being_followed_id=other_user.id,
+            user_following_id=self.id,
+        ).delete()
+        self._expire_follows(other_user)
+        User.adjust_counts(self.id, following_count=-1, version=1)
+        User.adjust_counts(other_user.id, followers_count=-1, version=1)
+
+        if self._following_cache is not None:
+            self._following_cache[other_user.id] = False
+
+    def preload_liked(self, messages):
+        """Look up which of `messages` this user likes, in a single query.
+
+        The answers are kept on this instance, so when it is `g.user` they
+        last for the current request and `Message.is_liked_by` can answer
+        from them without querying.
+        """
+
+        message_ids = [message.id for message in messages]
+        liked_ids = MessagesLiked.liked_message_ids(self.id, message_ids)
+
+        if self._liked_cache is None:
+            self._liked_cache = {}
+
+        for message_id in message_ids:
+            self._liked_cache[message_id] = message_id in liked_ids
 
 
 class Message(db.Model):
@@ -177,13 +408,89 @@ class Message(db.Model):
         nullable=False,
     )
 
+    __table_args__ = (
+        db.Index(
+            'ix_messages_user_id_timestamp',
+            user_id,
+            timestamp.desc(),
+            id.desc(),
+        ),
+    )
+
     # .users to reference User because of backref
 
+    @classmethod
+    def by_user(cls, user_id):
+        """Query for messages written by `user_id`."""
+
+        return cls.query.filter(cls.user_id == user_id)
+
+    @classmethod
+    def liked_by(cls, user_id):
+        """Query for messages liked by `user_id`."""
+
+        return (
+            cls
+            .query
+            .join(MessagesLiked, MessagesLiked.message_id == cls.id)
+            .filter(MessagesLiked.user_id == user_id))
+
     def is_liked_by(self, curr_user):
-        """Is this message liked by current user?"""
+        """Is this message liked by current user?
+
+        Answered from `curr_user.preload_liked` when this message was
+        preloaded; otherwise checks the single messages_liked row.
+        """
+
+        liked_cache = curr_user._liked_cache
+        if liked_cache is not None and self.id in liked_cache:
+            return liked_cache[self.id]
+
+        return db.session.query(
+            MessagesLiked
+            .query
+            .filter_by(message_id=self.id, user_id=curr_user.id)
+            .exists()
+        ).scalar()
+
+
+
+class TimelineEntry(db.Model):
+    """A message delivered to a user's home timeline.
 
-        return any(user.id for user in self.users_who_liked if user.id == curr_user.id)
+    Rows are written when a message is posted (one per follower, plus the
+    author), so reading a home feed is a single range scan on
+    (user_id, timestamp).
+    """
 
+    __tablename__ = 'timeline_entries'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete="cascade"),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete="cascade"),
+        primary_key=True,
+    )
+
+    # Copied from the message so the feed can be ordered without a join
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index(
+            'ix_timeline_entries_user_id_timestamp',
+            user_id,
+            timestamp.desc(),
+            message_id.desc(),
+        ),
+    )
 
 
 class MessagesLiked(db.Model):
@@ -208,13 +515,31 @@ class MessagesLiked(db.Model):
         nullable=False
     )
 
-    __table_args__ = (db.UniqueConstraint(message_id, user_id),)
+    __table_args__ = (
+        db.UniqueConstraint(message_id, user_id),
+        db.Index('ix_messages_liked_user_id', user_id, message_id),
+    )
+
+    @classmethod
+    def liked_message_ids(cls, user_id, message_ids):
+        """Return the set of `message_ids` liked by `user_id`."""
+
+        if not message_ids:
+            return set()
 
+        rows = db.session.query(cls.message_id).filter(
+            (cls.user_id == user_id) &
+            (cls.message_id.in_(message_ids))
+        )
+
+        return {message_id for (message_id,) in rows}
 
     @classmethod
     def toggle_liked(cls, message_id, user_id):
         """ Is the message currently liked by current user?
             Add or remove record from messages_liked table
+            and keep the user's likes_count in step.
+            Returns whether the message is now liked.
         """
 
         message_liked = cls.query.filter(
@@ -227,17 +552,59 @@ class MessagesLiked(db.Model):
             new_like = cls(message_id=message_id, user_id=user_id)
 
             db.session.add(new_like)
-        else:
-            db.session.delete(message_liked)
+            User.adjust_counts(user_id, likes_count=1, version=1)
+            return True
+
+        db.session.delete(message_liked)
+        User.adjust_counts(user_id, likes_count=-1, version=1)
+        return False
+
+
+##############################################################################
+# Username search index (see search.py)
+#
+# With pg_trgm available, a trigram GIN index serves `ILIKE '%q%'` searches;
+# without it, fall back to a prefix index on lower(username).
+
+
+def has_trigram_support(connection):
+    """Is the pg_trgm extension available to this PostgreSQL database?"""
+
+    return connection.execute(db.text(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+    )).first() is not None
+
+
+@event.listens_for(User.__table__, 'after_create')
+def create_username_search_index(target, connection, **kw):
+    """Create the best username search index this database supports."""
+
+    if connection.dialect.name != 'postgresql':
+        return
+
+    if has_trigram_support(connection):
+        connection.execute(db.text(
+            "CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        connection.execute(db.text(
+            "CREATE INDEX IF NOT EXISTS ix_users_username_trgm "
+            "ON users USING gin (username gin_trgm_ops)"))
+    else:
+        connection.execute(db.text(
+            "CREATE INDEX IF NOT EXISTS ix_users_username_prefix "
+            "ON users (lower(username) text_pattern_ops)"))
+
+
+# Set up backrefs (e.g. Message.user) now, so views can name them when
+# they're defined (see load_plans.py)
+configure_mappers()
 
 
-def connect_db(app):
+def init_db(app):
     """Connect this database to provided Flask app.
 
-    You should call this in your Flask app.
+    create_app calls this; it doesn't connect until the app first queries.
     """
 
-    app.app_context().push()
-    db.app = app
     db.init_app(app)
+    password_hasher.init_app(app)
 
@@ -0,0 +1,70 @@
+"""Keyset (cursor) pagination for message lists.
+
+Pages are keyed on (timestamp, id) rather than an OFFSET, so fetching any
+page is a bounded index range scan no matter how deep into a list it is.
+The cursor handed to templates is the key of the last message shown;
+the next page is everything strictly older than it.
+"""
+
+from datetime import datetime
+
+from werkzeug.exceptions import BadRequest
+
+from models import db
+
+MESSAGES_PER_PAGE = 100
+
+
+def encode_cursor(timestamp, id):
+    """Encode a (timestamp, id) key as an opaque querystring value."""
+
+    return f"{timestamp.isoformat()}_{id}"
+
+
+def decode_cursor(cursor):
+    """Decode a cursor made by `encode_cursor`; raise BadRequest if invalid."""
+
+    try:
+        timestamp, id = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(timestamp), int(id)
+    except ValueError:
+        raise BadRequest("Invalid page cursor.")
+
+
+def page_query(query, timestamp_col, id_col, cursor=None,
+               per_page=MESSAGES_PER_PAGE):
+    """Return `query` restricted to one page (plus one row, to detect more).
+
+    `timestamp_col` and `id_col` are the columns the page is keyed on; there
+    should be an index covering them in that order (descending).
+    """
+
+    if cursor:
+        timestamp, id = decode_cursor(cursor)
+        query = query.filter(
+            db.tuple_(timestamp_col, id_col) < db.tuple_(timestamp, id))
+
+    return (
+        query
+        .order_by(timestamp_col.desc(), id_col.desc())
+        .limit(per_page + 1))
+
+
+def paginate(query, timestamp_col, id_col, cursor=None,
+             per_page=MESSAGES_PER_PAGE):
+    """Return a page of `query`, newest first, and the cursor for the next.
+
+    See `page_query`. The second item returned is None when there are no
+    older rows.
+    """
+
+    rows = page_query(
+        query, timestamp_col, id_col, cursor=cursor, per_page=per_page).all()
+
+    if len(rows) <= per_page:
+        return rows, None
+
+    rows = rows[:per_page]
+    last = rows[-1]
+
+    return rows, encode_cursor(last.timestamp, last.id)
@@ -0,0 +1,177 @@
+"""Password hashing on a small, bounded worker pool.
+
+bcrypt is deliberately slow (~250ms a hash) and releases the GIL while it
+works, so running it on a dedicated thread pool caps how many CPU cores
+credential checks can take at once. When more than `max_queue` requests are
+already waiting, new ones are turned away with a 503 rather than piling up
+behind each other and starving the rest of the app.
+
+The pool is per process, and only limits anything when a process serves
+several requests at once: gunicorn runs gthread workers with
+GUNICORN_THREADS threads each (see gunicorn.conf.py), so a host hashes at
+most workers * PASSWORD_HASH_WORKERS passwords at a time. Keep
+PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE below the thread count, so a
+burst of logins is refused before it takes every thread.
+
+The bcrypt cost (log rounds) comes from BCRYPT_LOG_ROUNDS, so it can be low
+in tests and calibrated to the hardware in production (see `calibrate`).
+Hashes made at a different cost are upgraded when their owner next logs in.
+"""
+
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import perf_counter
+
+from werkzeug.exceptions import ServiceUnavailable
+
+from metrics import registry
+
+DEFAULT_LOG_ROUNDS = 12
+
+BCRYPT_COST_RE = re.compile(r'^\$2[abxy]?\$(\d\d)\$')
+
+bcrypt_seconds = registry.histogram(
+    'warbler_bcrypt_seconds',
+    "Time to hash or check a password with bcrypt, not counting queueing.",
+    ['operation'])
+
+
+class PasswordHasherBusy(ServiceUnavailable):
+    """Too many password hashes are already queued."""
+
+    description = "Too many login attempts right now; please try again."
+
+
+class PasswordHasher:
+    """Runs Flask-Bcrypt hashing and verification on a bounded thread pool."""
+
+    def __init__(self, bcrypt, max_workers=2, max_queue=4,
+                 log_rounds=DEFAULT_LOG_ROUNDS):
+        self.bcrypt = bcrypt
+        self.log_rounds = log_rounds
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+
+        self._lock = Lock()
+        self._executor = None
+        self._pid = None
+
+        self.in_flight = 0
+        self.active = 0
+        self.completed = 0
+        self.rejected = 0
+        self.busy_seconds = 0.0
+
+    def init_app(self, app):
+        """Read the BCRYPT_LOG_ROUNDS and PASSWORD_HASH_* settings."""
+
+        self.log_rounds = app.config.get('BCRYPT_LOG_ROUNDS', self.log_rounds)
+        self.max_workers = app.config.get(
+            'PASSWORD_HASH_WORKERS', self.max_workers)
+        self.max_queue = app.config.get(
+            'PASSWORD_HASH_QUEUE', self.max_queue)
+
+    def hash(self, password):
+        """Return the bcrypt hash of `password` as a string."""
+
+        return self._run(
+            lambda: self._hash(password, self.log_rounds), operation='hash')
+
+    def check(self, pw_hash, password):
+        """Does `password` match the bcrypt hash `pw_hash`?"""
+
+        return self._run(
+            lambda: self.bcrypt.check_password_hash(pw_hash, password),
+            operation='check')
+
+    def needs_rehash(self, pw_hash):
+        """Was `pw_hash` made with a different cost than is now configured?"""
+
+        match = BCRYPT_COST_RE.match(pw_hash)
+        return match is None or int(match.group(1)) != self.log_rounds
+
+    def calibrate(self, target_seconds, min_rounds=4, max_rounds=16):
+        """Find the highest cost whose hash takes at most `target_seconds`.
+
+        Each extra round doubles the time, so this times one hash per cost
+        on this machine and returns [(log_rounds, seconds), ...] along with
+        the chosen cost (never below `min_rounds`).
+        """
+
+        timings = []
+        chosen = min_rounds
+
+        for log_rounds in range(min_rounds, max_rounds + 1):
+            start = perf_counter()
+            self._hash("calibration password", log_rounds)
+            seconds = perf_counter() - start
+
+            timings.append((log_rounds, seconds))
+            if seconds > target_seconds:
+                break
+            chosen = log_rounds
+
+        return chosen, timings
+
+    def stats(self):
+        """Return a snapshot of the pool's load, for metrics."""
+
+        with self._lock:
+            return {
+                'workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'active': self.active,
+                'queued': self.in_flight - self.active,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'busy_seconds': self.busy_seconds,
+            }
+
+    def _hash(self, password, log_rounds):
+        return self.bcrypt.generate_password_hash(
+            password, rounds=log_rounds).decode('UTF-8')
+
+    def _get_executor(self):
+        # Threads don't survive a fork, so each gunicorn worker needs its
+        # own pool; build it lazily in whichever process first hashes.
+        if self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix='password-hasher')
+            self._pid = os.getpid()
+
+        return self._executor
+
+    def _run(self, work, operation=None):
+        with self._lock:
+            if self.in_flight >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise PasswordHasherBusy()
+
+            self.in_flight += 1
+            executor = self._get_executor()
+
+        try:
+            return executor.submit(self._timed, work, operation).result()
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def _timed(self, work, operation):
+        with self._lock:
+            self.active += 1
+
+        start = perf_counter()
+        try:
+            return work()
+        finally:
+            seconds = perf_counter() - start
+            if operation:
+                bcrypt_seconds.observe(seconds, operation=operation)
+
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+                self.busy_seconds += seconds
@@ -0,0 +1,315 @@
+"""Lightweight request timing and sampling profiler, safe for production.
+
+Every request's wall time is split into time spent in the database (from
+query_stats), rendering templates (less any queries run while rendering)
+and everything else ("python"), and each part is added to a per-endpoint
+histogram in `route_timings`.
+
+The sampling profiler is off unless configured:
+
+- PROFILE_SAMPLE_RATE = N profiles one request in N from start to finish.
+- PROFILE_SLOW_MS = T profiles any request still running after T ms (from
+  then on), which catches slow requests without profiling fast ones.
+
+Profiling is done by one background thread per process, which every
+PROFILE_INTERVAL_MS looks at the stack of each request being profiled;
+nothing is traced, so requests themselves run at full speed. Each profile is
+written to PROFILE_DIR in the "folded stacks" format read by flamegraph.pl
+and speedscope.
+"""
+
+import os
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
+from time import perf_counter, sleep
+
+from flask import before_render_template, g, request, template_rendered
+
+from metrics import Histogram, HistogramMetric, registry
+
+TIMING_PARTS = ('total', 'db', 'template', 'python')
+
+
+##############################################################################
+# Route timings
+
+
+class RouteTimings:
+    """A histogram per endpoint for each part of TIMING_PARTS."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, endpoint, **seconds):
+        with self.lock:
+            histograms = self.histograms.setdefault(
+                endpoint, {part: Histogram() for part in TIMING_PARTS})
+            for part, value in seconds.items():
+                histograms[part].observe(value)
+
+    def summary(self):
+        """Return {endpoint: {part: {count, mean, p50, p95, p99}}}."""
+
+        with self.lock:
+            return {
+                endpoint: {
+                    part: dict(
+                        count=histogram.count,
+                        mean=histogram.sum / histogram.count
+                        if histogram.count else None,
+                        p50=histogram.quantile(0.5),
+                        p95=histogram.quantile(0.95),
+                        p99=histogram.quantile(0.99),
+                    )
+                    for part, histogram in histograms.items()
+                }
+                for endpoint, histograms in self.histograms.items()
+            }
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+
+    def collect(self):
+        """Return the timings as a metric, for /metrics."""
+
+        metric = HistogramMetric(
+            'warbler_request_duration_seconds',
+            "Time spent serving requests, by endpoint and part "
+            "(total, db, template, python).",
+            ['endpoint', 'part'])
+
+        with self.lock:
+            for endpoint, histograms in self.histograms.items():
+                for part, histogram in histograms.items():
+                    metric.values[(endpoint, part)] = histogram.copy()
+
+        return [metric]
+
+
+route_timings = RouteTimings()
+registry.add_collector(route_timings.collect)
+
+
+class RequestTiming:
+    """Where the time of one request went."""
+
+    def __init__(self, query_stats):
+        self.started = perf_counter()
+        self.query_stats = query_stats
+        self.template_seconds = 0.0
+        self.template_db_seconds = 0.0
+        self._render_started = None
+
+    def db_seconds(self):
+        return self.query_stats.seconds if self.query_stats else 0.0
+
+    def start_render(self):
+        self._render_started = (perf_counter(), self.db_seconds())
+
+    def finish_render(self):
+        if self._render_started is None:
+            return
+
+        started, db_seconds = self._render_started
+        self.template_seconds += perf_counter() - started
+        self.template_db_seconds += self.db_seconds() - db_seconds
+        self._render_started = None
+
+    def parts(self):
+        """Return {part: seconds} for each of TIMING_PARTS."""
+
+        total = perf_counter() - self.started
+        db = self.db_seconds()
+        template = max(self.template_seconds - self.template_db_seconds, 0)
+
+        return dict(
+            total=total,
+            db=db,
+            template=template,
+            python=max(total - db - template, 0),
+        )
+
+
+##############################################################################
+# Sampling profiler
+
+
+def fold_stack(frame):
+    """Return `frame`'s stack as one line of folded stacks, outermost first."""
+
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(
+            f"{code.co_name} "
+            f"({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+
+    return ";".join(reversed(names))
+
+
+class Profile:
+    """Stack samples taken from one thread."""
+
+    def __init__(self, thread_id, start_after):
+        self.thread_id = thread_id
+        self.started = perf_counter()
+        self.start_after = start_after
+        self.stacks = Counter()
+
+
+class SamplingProfiler:
+    """Samples the stacks of registered threads from a background thread."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.profiles = {}
+        self.lock = threading.Lock()
+        # Set while there's anything to profile, so an idle worker's
+        # profiler thread sleeps
+        self.active = threading.Event()
+        self.pid = None
+
+    def ensure_running(self):
+        # Threads don't survive a fork, so each gunicorn worker starts its own
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+
+        threading.Thread(
+            target=self.run, name="sampling-profiler", daemon=True
+        ).start()
+
+    def start(self, start_after=0.0):
+        """Profile the calling thread, beginning `start_after` seconds from now."""
+
+        self.ensure_running()
+        profile = Profile(threading.get_ident(), start_after)
+
+        with self.lock:
+            self.profiles[profile.thread_id] = profile
+            self.active.set()
+
+        return profile
+
+    def stop(self, profile):
+        with self.lock:
+            self.profiles.pop(profile.thread_id, None)
+
+    def sample(self):
+        now = perf_counter()
+        frames = sys._current_frames()
+
+        with self.lock:
+            profiles = list(self.profiles.values())
+            if not profiles:
+                self.active.clear()
+
+        stacks = [
+            (profile, fold_stack(frames[profile.thread_id]))
+            for profile in profiles
+            if profile.thread_id in frames
+            and now - profile.started >= profile.start_after
+        ]
+
+        # Only count into profiles that are still running: once stop() has
+        # returned, the profile's stacks may be being written out
+        with self.lock:
+            for profile, stack in stacks:
+                if self.profiles.get(profile.thread_id) is profile:
+                    profile.stacks[stack] += 1
+
+    def run(self):
+        while True:
+            self.active.wait()
+            sleep(self.interval)
+            self.sample()
+
+
+def write_profile(directory, endpoint, seconds, profile):
+    """Write `profile` as folded stacks; return the file's path."""
+
+    os.makedirs(directory, exist_ok=True)
+
+    timestamp = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+    path = os.path.join(
+        directory, f"{timestamp}-{endpoint}-{seconds * 1000:.0f}ms.folded")
+
+    with open(path, 'w') as f:
+        for stack, count in profile.stacks.most_common():
+            f.write(f"{stack} {count}\n")
+
+    return path
+
+
+##############################################################################
+# Flask integration
+
+
+def init_app(app):
+    """Time each of `app`'s requests, and profile them if configured.
+
+    Call after query_stats.init_app, so DB time is available.
+    """
+
+    app.config.setdefault('PROFILE_SAMPLE_RATE', 0)
+    app.config.setdefault('PROFILE_SLOW_MS', 0)
+    app.config.setdefault('PROFILE_INTERVAL_MS', 5)
+    app.config.setdefault('PROFILE_DIR', 'profiles')
+
+    profiler = SamplingProfiler(app.config['PROFILE_INTERVAL_MS'] / 1000)
+    request_count = 0
+
+    @app.before_request
+    def start_request_timing():
+        nonlocal request_count
+
+        g.request_timing = RequestTiming(g.get('query_stats'))
+
+        sample_rate = app.config['PROFILE_SAMPLE_RATE']
+        slow_ms = app.config['PROFILE_SLOW_MS']
+        request_count += 1
+
+        if sample_rate and request_count % sample_rate == 0:
+            g.profile = profiler.start()
+        elif slow_ms:
+            g.profile = profiler.start(start_after=slow_ms / 1000)
+
+    @before_render_template.connect_via(app)
+    def start_render_timing(sender, template, context, **extra):
+        timing = g.get('request_timing')
+        if timing:
+            timing.start_render()
+
+    @template_rendered.connect_via(app)
+    def finish_render_timing(sender, template, context, **extra):
+        timing = g.get('request_timing')
+        if timing:
+            timing.finish_render()
+
+    @app.teardown_request
+    def finish_request_timing(exc):
+        timing = g.pop('request_timing', None)
+        if timing is None:
+            return
+
+        endpoint = request.endpoint or 'unmatched'
+        parts = timing.parts()
+        route_timings.observe(endpoint, **parts)
+
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+
+        profiler.stop(profile)
+        if profile.stacks:
+            path = write_profile(
+                app.config['PROFILE_DIR'], endpoint, parts['total'], profile)
+            app.logger.warning(
+                "Profiled %s %s (%.0fms): %s",
+                request.method, request.path, parts['total'] * 1000, path)
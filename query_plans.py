@@ -0,0 +1,118 @@
+"""EXPLAIN checks for Warbler's hot queries (PostgreSQL only).
+
+Each query the app runs on every page view is registered here with the
+index it is expected to use. `check_query_plans()` asks PostgreSQL for each
+query's plan and reports any that no longer use their index, e.g. because a
+query's filter or ordering changed, or an index was dropped.
+
+Sequential scans are disabled while explaining: on small test tables the
+planner would rightly prefer them, and what we want to know is whether the
+index *can* serve the query.
+"""
+
+from models import db, Message, Follows, MessagesLiked, TimelineEntry
+from pagination import page_query
+from search import search_query, USERS_PER_PAGE
+import timeline
+
+HOT_QUERIES = {}
+
+SAMPLE_USER_ID = 1
+
+
+def hot_query(name, *index_names):
+    """Register a function returning a query that must use one of `index_names`."""
+
+    def register(build_query):
+        HOT_QUERIES[name] = (build_query, index_names)
+        return build_query
+
+    return register
+
+
+@hot_query('home_timeline', 'ix_timeline_entries_user_id_timestamp')
+def home_timeline_query():
+    return page_query(
+        timeline.timeline_query(SAMPLE_USER_ID),
+        TimelineEntry.timestamp,
+        TimelineEntry.message_id)
+
+
+@hot_query('user_messages', 'ix_messages_user_id_timestamp')
+def user_messages_query():
+    return page_query(
+        Message.by_user(SAMPLE_USER_ID), Message.timestamp, Message.id)
+
+
+@hot_query('liked_messages', 'ix_messages_liked_user_id')
+def liked_messages_query():
+    return page_query(
+        Message.liked_by(SAMPLE_USER_ID), Message.timestamp, Message.id)
+
+
+@hot_query('following', 'ix_follows_user_following_id')
+def following_query():
+    return Follows.query.filter(Follows.user_following_id == SAMPLE_USER_ID)
+
+
+@hot_query('followers', 'follows_pkey')
+def followers_query():
+    return Follows.query.filter(
+        Follows.user_being_followed_id == SAMPLE_USER_ID)
+
+
+@hot_query('liked_ids', 'ix_messages_liked_user_id', 'messages_liked_message_id_user_id_key')
+def liked_ids_query():
+    return MessagesLiked.query.filter(
+        (MessagesLiked.user_id == SAMPLE_USER_ID) &
+        (MessagesLiked.message_id.in_([1, 2, 3])))
+
+
+@hot_query('username_search', 'ix_users_username_trgm', 'ix_users_username_prefix')
+def username_search_query():
+    return search_query("warbler").limit(USERS_PER_PAGE + 1)
+
+
+def index_names_in_plan(node):
+    """Return every index name used anywhere in an EXPLAIN (FORMAT JSON) plan."""
+
+    names = set()
+
+    if 'Index Name' in node:
+        names.add(node['Index Name'])
+
+    for child in node.get('Plans', []):
+        names |= index_names_in_plan(child)
+
+    return names
+
+
+def explain(query):
+    """Return the JSON plan PostgreSQL would use for `query`."""
+
+    statement = query.statement if hasattr(query, 'statement') else query
+    compiled = statement.compile(
+        dialect=db.engine.dialect,
+        compile_kwargs={"render_postcompile": True})
+
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        (plan,) = connection.exec_driver_sql(
+            f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()
+
+    return plan['Plan']
+
+
+def check_query_plans():
+    """Return [(name, expected index names, used index names), ...] for
+    every registered hot query that uses none of its expected indexes."""
+
+    failures = []
+
+    for name, (build_query, index_names) in HOT_QUERIES.items():
+        used = index_names_in_plan(explain(build_query()))
+
+        if not used & set(index_names):
+            failures.append((name, index_names, used))
+
+    return failures
@@ -0,0 +1,194 @@
+"""Per-request SQL query counting.
+
+Every statement SQLAlchemy runs while a QueryStats collector is active is
+counted and timed. Each request gets a collector (see `init_app`), whose
+totals are added to the response as X-Query-Count and X-Query-Time-Ms
+headers and logged, along with any statement run suspiciously often in the
+one request -- usually a lazy load in a template loop, i.e. an N+1.
+
+Views can declare how many queries they should need with `query_budget`.
+A request that goes over is logged, or, with QUERY_BUDGET_STRICT set (as in
+the tests), raises QueryBudgetExceeded.
+"""
+
+import re
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from time import perf_counter
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# A statement run this many times in one request is reported as an N+1
+REPEATED_STATEMENT_THRESHOLD = 5
+
+# Lists of bound parameters, e.g. from `IN (...)`, of any length
+PARAM_LIST_RE = re.compile(r"\((?:\s*(?:%\(\w+\)s|\?)\s*,)*\s*(?:%\(\w+\)s|\?)\s*\)")
+
+# Transaction bookkeeping rather than queries; COMMIT and ROLLBACK never
+# reach the cursor, but savepoints (e.g. the tests' rollback fixtures) do
+SAVEPOINT_RE = re.compile(
+    r"^\s*(?:SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT)\b",
+    re.IGNORECASE)
+
+_local = threading.local()
+
+
+class QueryBudgetExceeded(Exception):
+    """A view ran more queries than its declared budget."""
+
+
+def statement_shape(statement):
+    """Return `statement` with parameter lists collapsed, so queries that
+    differ only in how many values they pass look the same."""
+
+    return PARAM_LIST_RE.sub("(...)", " ".join(statement.split()))
+
+
+class QueryStats:
+    """How many statements ran while collecting, and for how long."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+
+    def record(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.shapes[statement_shape(statement)] += 1
+
+    def repeated(self, threshold=REPEATED_STATEMENT_THRESHOLD):
+        """Return {statement shape: times run} for any run `threshold`+ times."""
+
+        return {
+            shape: times
+            for shape, times in self.shapes.items()
+            if times >= threshold
+        }
+
+
+##############################################################################
+# Collecting
+
+
+def active_collectors():
+    """Return this thread's list of collectors recording queries."""
+
+    if not hasattr(_local, 'collectors'):
+        _local.collectors = []
+
+    return _local.collectors
+
+
+def start_collecting():
+    stats = QueryStats()
+    active_collectors().append(stats)
+
+    return stats
+
+
+def stop_collecting(stats):
+    collectors = active_collectors()
+    if stats in collectors:
+        collectors.remove(stats)
+
+
+@contextmanager
+def collect_queries():
+    """Count the queries run in a `with` block:
+
+        with collect_queries() as stats:
+            ...
+        stats.count
+    """
+
+    stats = start_collecting()
+    try:
+        yield stats
+    finally:
+        stop_collecting(stats)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context,
+                      executemany):
+    conn.info['query_started'] = perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    seconds = perf_counter() - conn.info.pop('query_started', perf_counter())
+
+    if SAVEPOINT_RE.match(statement):
+        return
+
+    for stats in active_collectors():
+        stats.record(statement, seconds)
+
+
+##############################################################################
+# Flask integration
+
+
+def query_budget(max_queries):
+    """Declare the most queries a view should need; put under @app.route."""
+
+    def decorate(view):
+        view.query_budget = max_queries
+        return view
+
+    return decorate
+
+
+def init_app(app):
+    """Collect query stats for each of `app`'s requests."""
+
+    app.config.setdefault('QUERY_STATS_HEADERS', True)
+    app.config.setdefault('QUERY_BUDGET_STRICT', False)
+
+    @app.before_request
+    def start_request_query_stats():
+        g.query_stats = start_collecting()
+
+    @app.after_request
+    def report_request_query_stats(response):
+        stats = g.get('query_stats')
+        if stats is None:
+            return response
+
+        milliseconds = stats.seconds * 1000
+
+        if app.config['QUERY_STATS_HEADERS']:
+            response.headers['X-Query-Count'] = str(stats.count)
+            response.headers['X-Query-Time-Ms'] = f"{milliseconds:.1f}"
+
+        app.logger.info(
+            "%s %s queries=%d db_ms=%.1f",
+            request.method, request.path, stats.count, milliseconds)
+
+        for shape, times in stats.repeated().items():
+            app.logger.warning(
+                "%s %s ran the same statement %d times (N+1?): %s",
+                request.method, request.path, times, shape)
+
+        view = app.view_functions.get(request.endpoint)
+        budget = getattr(view, 'query_budget', None)
+
+        if budget is not None and stats.count > budget:
+            message = (
+                f"{request.endpoint} ran {stats.count} queries, "
+                f"over its budget of {budget}")
+            if app.config['QUERY_BUDGET_STRICT']:
+                raise QueryBudgetExceeded(message)
+            app.logger.warning(message)
+
+        return response
+
+    @app.teardown_request
+    def stop_request_query_stats(exc):
+        stats = g.pop('query_stats', None)
+        if stats is not None:
+            stop_collecting(stats)
@@ -0,0 +1,185 @@
+"""User search for Warbler.
+
+Which strategy is used depends on the database:
+
+- PostgreSQL with pg_trgm: substring match served by the trigram index,
+  ranked by similarity to the search term.
+- PostgreSQL without pg_trgm: prefix match on lower(username), served by
+  a text_pattern_ops index.
+- Anything else (e.g. SQLite test databases): prefix match against an
+  in-process trie of usernames, rebuilt lazily whenever users change.
+
+Results are always limited to one page.
+"""
+
+from sqlalchemy import event
+
+from models import db, User
+
+USERS_PER_PAGE = 48
+MAX_SEARCH_PAGES = 20
+
+_trigram_installed = {}
+_trie = None
+
+
+##############################################################################
+# Username trie (non-PostgreSQL fallback)
+
+
+class UsernameTrie:
+    """Prefix tree mapping lowercased usernames to user ids."""
+
+    def __init__(self):
+        self.root = {}
+
+    def insert(self, username, user_id):
+        node = self.root
+        for char in username.lower():
+            node = node.setdefault(char, {})
+        node.setdefault(None, set()).add(user_id)
+
+    def ids_with_prefix(self, prefix):
+        """Return every user id whose username starts with `prefix`."""
+
+        node = self.root
+        for char in prefix.lower():
+            node = node.get(char)
+            if node is None:
+                return set()
+
+        ids = set()
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            for char, child in node.items():
+                if char is None:
+                    ids.update(child)
+                else:
+                    stack.append(child)
+
+        return ids
+
+
+def get_username_trie():
+    """Return the process's username trie, building it if needed."""
+
+    global _trie
+
+    if _trie is None:
+        trie = UsernameTrie()
+        for user_id, username in db.session.query(User.id, User.username):
+            trie.insert(username, user_id)
+        _trie = trie
+
+    return _trie
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def invalidate_username_trie(mapper, connection, target):
+    """Usernames changed; rebuild the trie on next search."""
+
+    global _trie
+    _trie = None
+
+
+##############################################################################
+# Search
+
+
+def escape_like(term):
+    """Escape LIKE wildcards in a user-supplied search term."""
+
+    return (
+        term
+        .replace("\\", "\\\\")
+        .replace("%", "\\%")
+        .replace("_", "\\_"))
+
+
+def has_trigram_index():
+    """Is pg_trgm installed in the current database? (cached per database)"""
+
+    # The bind may be a Connection, e.g. in the tests' rollback fixtures
+    engine = db.session.get_bind().engine
+
+    if engine.url not in _trigram_installed:
+        _trigram_installed[engine.url] = db.session.execute(db.text(
+            "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"
+        )).first() is not None
+
+    return _trigram_installed[engine.url]
+
+
+def search_query(term):
+    """Query for users whose username matches `term`, best matches first."""
+
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect == 'postgresql' and has_trigram_index():
+        return (
+            User
+            .query
+            .filter(User.username.ilike(f"%{escape_like(term)}%", escape="\\"))
+            .order_by(
+                db.func.similarity(User.username, term).desc(),
+                User.username))
+
+    if dialect == 'postgresql':
+        lowered = db.func.lower(User.username)
+        return (
+            User
+            .query
+            .filter(lowered.like(
+                f"{escape_like(term.lower())}%", escape="\\"))
+            .order_by(
+                (lowered == term.lower()).desc(),
+                db.func.length(User.username),
+                User.username))
+
+    ids = get_username_trie().ids_with_prefix(term)
+    return (
+        User
+        .query
+        .filter(User.id.in_(ids))
+        .order_by(db.func.length(User.username), User.username))
+
+
+def search_users(term, page=1, per_page=USERS_PER_PAGE):
+    """Find users by username, best matches first.
+
+    Returns (users, has_more) for the 1-based `page`; pages past
+    MAX_SEARCH_PAGES are empty.
+    """
+
+    if page < 1 or page > MAX_SEARCH_PAGES:
+        return [], False
+
+    users = (
+        search_query(term)
+        .offset((page - 1) * per_page)
+        .limit(per_page + 1)
+        .all())
+
+    return users[:per_page], len(users) > per_page
+
+
+def list_users_after(after_id=None, per_page=USERS_PER_PAGE):
+    """List users in id order, starting after `after_id`.
+
+    Returns (users, next_after_id); next_after_id is None on the last page.
+    """
+
+    query = User.query
+    if after_id is not None:
+        query = query.filter(User.id > after_id)
+
+    users = query.order_by(User.id).limit(per_page + 1).all()
+
+    if len(users) <= per_page:
+        return users, None
+
+    users = users[:per_page]
+    return users, users[-1].id
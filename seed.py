@@ -1,19 +1,58 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
 
-from csv import DictReader
-from app import db
-from models import User, Message, Follows, MessagesLiked
+Run as `python seed.py [--data-dir DIR]`, where DIR holds the CSVs written by
+generator/create_csvs.py (default: generator/).
+"""
 
-db.drop_all()
-db.create_all()
+import argparse
+import os
+from time import perf_counter
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
+from app import create_app
+from models import db, User, Message, Follows, MessagesLiked, TimelineEntry
+from timeline import backfill_timelines
+from migrations import stamp
+from loader import deferred_indexes, load_csv, reset_sequences, analyze, timed
 
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
+CSV_FILES = [
+    (User, 'users.csv'),
+    (Message, 'messages.csv'),
+    (Follows, 'follows.csv'),
+    (MessagesLiked, 'likes.csv'),
+]
 
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follows, DictReader(follows))
+MODELS = [model for model, _ in CSV_FILES] + [TimelineEntry]
 
-db.session.commit()
+
+def seed(data_dir='generator'):
+    """Recreate every table and load the CSVs in `data_dir` into them."""
+
+    start = perf_counter()
+
+    db.drop_all()
+    db.create_all()
+    stamp()
+
+    with deferred_indexes(MODELS):
+        for model, filename in CSV_FILES:
+            load_csv(model, os.path.join(data_dir, filename))
+
+        timed("timelines", backfill_timelines)
+        db.session.commit()
+
+    reset_sequences(MODELS)
+
+    timed("counters", User.reconcile_counts)
+    db.session.commit()
+
+    analyze(MODELS)
+
+    print(f"Seeded in {perf_counter() - start:.2f}s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Seed the database from CSVs.")
+    parser.add_argument('--data-dir', default='generator')
+
+    with create_app().app_context():
+        seed(parser.parse_args().data_dir)
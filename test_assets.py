@@ -0,0 +1,120 @@
+"""Static asset pipeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_assets.py
+
+
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import assets
+from app import create_app
+
+
+class AssetsTestCase(TestCase):
+    def setUp(self):
+        self.app = create_app({'WARBLER_ENV': 'testing'})
+
+        # Build from a copy of static/, so the real one is left alone
+        self.tmp = tempfile.mkdtemp()
+        self.static_dir = os.path.join(self.tmp, 'static')
+        shutil.copytree(self.app.static_folder, self.static_dir,
+                        ignore=shutil.ignore_patterns(assets.BUILD_DIR))
+        self.app.static_folder = self.static_dir
+
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def build(self):
+        manifest = assets.build(self.static_dir)
+        assets.set_manifest(self.app, manifest)
+        return manifest
+
+    def built_path(self, name):
+        return os.path.join(self.static_dir, assets.BUILD_DIR, name)
+
+    def test_minify_css(self):
+        self.assertEqual(
+            assets.minify_css("/* c */\na > b,\nc {\n  color: red;\n}\n"),
+            "a>b,c{color:red}")
+
+    def test_build(self):
+        manifest = self.build()
+
+        css_name = manifest['stylesheets/style.css']
+        self.assertRegex(css_name, r"^stylesheets/style\.[0-9a-f]{12}\.css$")
+
+        with open(self.built_path(assets.MANIFEST_NAME)) as f:
+            self.assertEqual(json.load(f), manifest)
+
+        # CSS is minified and points at the fingerprinted images
+        with open(self.built_path(css_name)) as f:
+            css = f.read()
+        nav_bg = manifest['images/nav-bg.png']
+        self.assertIn(f'url("/static/build/{nav_bg}")', css)
+        self.assertNotIn("/static/images/", css)
+        self.assertNotIn("\n", css)
+
+        # Text is precompressed; images aren't
+        with gzip.open(self.built_path(css_name + '.gz')) as f:
+            self.assertEqual(f.read().decode('utf-8'), css)
+        self.assertFalse(os.path.exists(self.built_path(nav_bg + '.gz')))
+
+        # Rebuilding the same files gives the same names
+        self.assertEqual(self.build(), manifest)
+
+    def test_asset_url(self):
+        with self.app.test_request_context():
+            self.assertEqual(
+                assets.asset_url('stylesheets/style.css'),
+                "/static/stylesheets/style.css")
+
+            manifest = self.build()
+            pic = f"/static/build/{manifest['images/default-pic.png']}"
+
+            self.assertEqual(assets.asset_url('images/default-pic.png'), pic)
+            self.assertEqual(
+                assets.asset_url('/static/images/default-pic.png'), pic)
+            self.assertEqual(
+                assets.asset_url('/static/missing.png'), "/static/missing.png")
+            self.assertEqual(
+                assets.asset_url('https://example.com/a.png'),
+                "https://example.com/a.png")
+
+        resp = self.client.get("/login")
+        css = f"/static/build/{manifest['stylesheets/style.css']}"
+        self.assertIn(f'href="{css}"', resp.text)
+
+    def test_serve_precompressed(self):
+        manifest = self.build()
+        url = f"/static/build/{manifest['stylesheets/style.css']}"
+
+        resp = self.client.get(url, headers={'Accept-Encoding': 'gzip, br'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(resp.mimetype, 'text/css')
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        self.assertIn('immutable', resp.headers['Cache-Control'])
+        compressed = resp.data
+        resp.close()
+
+        resp = self.client.get(url)
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual(gzip.decompress(compressed), resp.data)
+        resp.close()
+
+    def test_manifest_not_immutable(self):
+        self.build()
+
+        resp = self.client.get(f"/static/build/{assets.MANIFEST_NAME}")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('no-cache', resp.headers['Cache-Control'])
+        self.assertNotIn('immutable', resp.headers['Cache-Control'])
+        self.assertNotIn('max-age', resp.headers['Cache-Control'])
+        resp.close()
@@ -0,0 +1,93 @@
+"""Config tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_config.py
+
+
+import os
+import subprocess
+import sys
+from unittest import TestCase
+from unittest.mock import patch
+
+from flask import Flask
+
+import config
+
+
+class ConfigTestCase(TestCase):
+    def test_get_env(self):
+        with patch.dict(os.environ, {'WARBLER_ENV': 'testing'}):
+            self.assertEqual(config.get_env(), 'testing')
+
+        with patch.dict(os.environ, {'FLASK_DEBUG': '1'}):
+            os.environ.pop('WARBLER_ENV', None)
+            self.assertEqual(config.get_env(), 'development')
+
+        with patch.dict(os.environ, {'FLASK_DEBUG': '0'}):
+            os.environ.pop('WARBLER_ENV', None)
+            self.assertEqual(config.get_env(), 'production')
+
+        with patch.dict(os.environ, {'WARBLER_ENV': 'staging'}):
+            with self.assertRaises(ValueError):
+                config.get_env()
+
+    def test_configure(self):
+        app = Flask(__name__)
+        environ = {'DATABASE_URL': "postgres:///warbler", 'SECRET_KEY': "s"}
+
+        with patch.dict(os.environ, environ):
+            config.configure(app, {'WARBLER_ENV': 'production'})
+
+        self.assertEqual(app.config['WARBLER_ENV'], 'production')
+        self.assertEqual(
+            app.config['SQLALCHEMY_DATABASE_URI'], "postgresql:///warbler")
+        self.assertFalse(app.config['DEBUG_TB_ENABLED'])
+        self.assertIsNone(config.init_toolbar(app))
+
+    def test_test_database_url(self):
+        with patch.dict(os.environ, {'PYTEST_XDIST_WORKER': 'gw1'}):
+            os.environ.pop('TEST_DATABASE_URL', None)
+            self.assertEqual(
+                config.test_database_url(), "postgresql:///warbler_test_gw1")
+
+    def test_create_app(self):
+        from app import create_app
+        from flask import current_app, has_app_context
+
+        def app_in_context():
+            return has_app_context() and current_app._get_current_object()
+
+        outer = app_in_context()
+        first = create_app({'WARBLER_ENV': 'testing'})
+        second = create_app({
+            'WARBLER_ENV': 'testing',
+            'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler_other",
+        })
+
+        self.assertIsNot(first, second)
+        self.assertEqual(
+            first.config['SQLALCHEMY_DATABASE_URI'],
+            config.test_database_url())
+        self.assertEqual(
+            second.config['SQLALCHEMY_DATABASE_URI'],
+            "postgresql:///warbler_other")
+        self.assertIn('warbler.homepage', second.view_functions)
+        self.assertIs(app_in_context(), outer)
+
+    def test_toolbar_only_loaded_in_development(self):
+        probe = "from app import app; import sys; print('flask_debugtoolbar' in sys.modules)"
+
+        for env, loaded in [('development', "True"), ('production', "False")]:
+            environ = dict(
+                os.environ,
+                WARBLER_ENV=env,
+                DATABASE_URL="postgresql:///warbler_test",
+                SECRET_KEY="s")
+            output = subprocess.run(
+                [sys.executable, '-c', probe],
+                env=environ, capture_output=True, text=True, check=True,
+            ).stdout
+
+            self.assertEqual(output.split()[-1], loaded, env)
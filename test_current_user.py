@@ -0,0 +1,78 @@
+"""Session user loading and caching tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_current_user.py
+
+
+from unittest import TestCase
+
+from models import db, User
+from app import CURR_USER_KEY
+from cache import TTLCache
+from current_user import profile_cache
+from fixtures import DatabaseTestCase, get_app
+
+app = get_app()
+
+
+class TTLCacheTestCase(TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = TTLCache(max_size=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_expires(self):
+        cache = TTLCache(max_size=2, ttl=-1)
+        cache.set("a", 1)
+
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.misses, 1)
+
+
+class CurrentUserTestCase(DatabaseTestCase):
+    @classmethod
+    def create_fixtures(cls):
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        db.session.commit()
+        cls.u1_id = u1.id
+
+    def test_profile_cached_between_requests(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            c.get('/messages/new')
+            self.assertEqual(profile_cache.get(self.u1_id)['username'], 'u1')
+
+    def test_profile_edit_invalidates(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            c.get('/messages/new')
+            c.post('/users/profile', data={
+                'username': 'u0',
+                'email': 'u1@email.com',
+                'password': 'password',
+            })
+            self.assertIsNone(profile_cache.get(self.u1_id))
+
+            resp = c.get('/messages/new')
+            html = resp.get_data(as_text=True)
+
+            self.assertIn('alt="u0"', html)
+
+    def test_deleted_user_is_logged_out(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            c.post('/users/delete')
+            self.assertIsNone(profile_cache.get(self.u1_id))
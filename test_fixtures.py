@@ -0,0 +1,75 @@
+"""Test fixture tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_fixtures.py
+
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, User
+from app import CURR_USER_KEY
+from fixtures import DatabaseTestCase, OwnDatabaseTestCase, get_app
+
+app = get_app()
+
+
+class DatabaseTestCaseTestCase(DatabaseTestCase):
+    @classmethod
+    def create_fixtures(cls):
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        db.session.commit()
+
+        cls.u1_id = u1.id
+
+    # Test methods run in name order; each checks the other left no trace
+
+    def test_commit_is_rolled_back_1(self):
+        self.assertEqual(User.query.count(), 1)
+
+        User.signup("u2", "u2@email.com", "password", None)
+        db.session.commit()
+
+        self.assertEqual(User.query.count(), 2)
+
+    def test_commit_is_rolled_back_2(self):
+        self.test_commit_is_rolled_back_1()
+
+    def test_rollback_inside_test(self):
+        User.signup("u2", "u2@email.com", "password", None)
+        db.session.commit()
+
+        with self.assertRaises(IntegrityError):
+            User.signup("u1", "other@email.com", "password", None)
+            db.session.commit()
+        db.session.rollback()
+
+        # The rollback undid only the failed insert
+        self.assertEqual(
+            {u.username for u in User.query}, {"u1", "u2"})
+
+    def test_views_see_test_rows(self):
+        User.signup("u2", "u2@email.com", "password", None)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.get("/users?q=u2")
+
+        self.assertIn("@u2", resp.get_data(as_text=True))
+
+
+class OwnDatabaseTestCaseTestCase(OwnDatabaseTestCase):
+    database_suffix = 'fixtures'
+
+    def test_schema_changes_stay_in_own_database(self):
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql("DROP TABLE timeline_entries")
+
+        self.assertFalse(db.inspect(db.engine).has_table('timeline_entries'))
+
+        with app.app_context():
+            self.assertTrue(
+                db.inspect(db.engine).has_table('timeline_entries'))
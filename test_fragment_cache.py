@@ -0,0 +1,126 @@
+"""Template fragment cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_fragment_cache.py
+
+
+from unittest import TestCase
+
+from flask import render_template_string
+
+import assets
+from models import db, Follows, Message, User
+from app import CURR_USER_KEY, create_app
+from fixtures import DatabaseTestCase, get_app
+
+app = get_app()
+
+
+class DictStore:
+    """A stand-in for a shared store."""
+
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, value):
+        self.entries[key] = value
+
+
+class FragmentCacheTagTestCase(TestCase):
+    def test_shared_store(self):
+        store = DictStore()
+        other_app = create_app({
+            'WARBLER_ENV': 'testing',
+            'FRAGMENT_CACHE_STORE': store,
+        })
+        template = (
+            "{% cache 'greeting', id, 1 %}<b>{{ name }}</b>{% endcache %}")
+
+        version = assets.manifest_version({})
+
+        with other_app.test_request_context():
+            html = render_template_string(template, id=7, name="<Ann>")
+            self.assertEqual(html, "<b>&lt;Ann&gt;</b>")
+            self.assertEqual(
+                store.entries,
+                {f'fragment:greeting:{version}:7:1': "<b>&lt;Ann&gt;</b>"})
+
+            # Cached output isn't escaped twice, and the body isn't rendered
+            html = render_template_string(template, id=7, name="Bob")
+            self.assertEqual(html, "<b>&lt;Ann&gt;</b>")
+
+            # Rebuilt assets mean new keys, as fragments hold their URLs
+            assets.set_manifest(other_app, {'a.css': 'a.0123456789ab.css'})
+            html = render_template_string(template, id=7, name="Bob")
+            self.assertEqual(html, "<b>Bob</b>")
+
+
+class FragmentCacheViewsTestCase(DatabaseTestCase):
+    @classmethod
+    def create_fixtures(cls):
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        u2.bio = "old bio"
+        db.session.commit()
+
+        m1 = Message(text="m1-text", user_id=u2.id)
+        db.session.add(m1)
+        db.session.commit()
+
+        cls.u1_id = u1.id
+        cls.u2_id = u2.id
+
+    def setUp(self):
+        super().setUp()
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+    def set_bio(self, bio, version):
+        User.query.filter_by(id=self.u2_id).update(
+            {'bio': bio, 'version': User.version + version})
+        db.session.commit()
+
+    def test_user_cards(self):
+        html = self.client.get("/users").get_data(as_text=True)
+        self.assertIn("old bio", html)
+        self.assertIn("Follow", html)
+
+        # Without a new version, the cached card is reused...
+        self.set_bio("new bio", version=0)
+        db.session.add(Follows(
+            user_following_id=self.u1_id, user_being_followed_id=self.u2_id))
+        db.session.commit()
+
+        html = self.client.get("/users").get_data(as_text=True)
+        self.assertIn("old bio", html)
+        # ...but the viewer's button is not
+        self.assertIn("Unfollow", html)
+
+        self.set_bio("new bio", version=1)
+
+        html = self.client.get("/users").get_data(as_text=True)
+        self.assertIn("new bio", html)
+
+    def test_user_messages(self):
+        url = f"/users/{self.u2_id}"
+        store = app.extensions['fragment_cache']
+
+        self.assertIn("@u2", self.client.get(url).get_data(as_text=True))
+        self.assertEqual(len(store), 1)
+
+        # A new version alone (e.g. from a like) doesn't rerender messages
+        self.set_bio("old bio", version=1)
+        self.client.get(url)
+        self.assertEqual(len(store), 1)
+
+        User.query.filter_by(id=self.u2_id).update(
+            {'username': 'u2-renamed', 'version': User.version + 1})
+        db.session.commit()
+
+        html = self.client.get(url).get_data(as_text=True)
+        self.assertIn("@u2-renamed", html)
@@ -0,0 +1,146 @@
+"""HTTP caching tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_http_cache.py
+
+
+from flask import template_rendered
+
+from models import db, Message, User
+from app import CURR_USER_KEY
+from fixtures import DatabaseTestCase, get_app
+
+app = get_app()
+
+
+class HTTPCacheTestCase(DatabaseTestCase):
+    @classmethod
+    def create_fixtures(cls):
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        m1 = Message(text="m1-text", user_id=u2.id)
+        db.session.add(m1)
+        db.session.commit()
+
+        cls.u1_id = u1.id
+        cls.u2_id = u2.id
+        cls.m1_id = m1.id
+
+    def setUp(self):
+        super().setUp()
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+    def revalidate(self, url):
+        """GET `url`, then again with its ETag; return both responses and
+        how many templates the second rendered."""
+
+        first = self.client.get(url)
+        rendered = []
+
+        def record(sender, template, context, **extra):
+            rendered.append(template.name)
+
+        with template_rendered.connected_to(record, app):
+            second = self.client.get(
+                url, headers={'If-None-Match': first.headers['ETag']})
+
+        return first, second, rendered
+
+    def test_not_modified(self):
+        for url in [
+                f"/users/{self.u2_id}",
+                f"/users/{self.u2_id}/following",
+                f"/users/{self.u2_id}/followers",
+                f"/messages/{self.m1_id}"]:
+            first, second, rendered = self.revalidate(url)
+
+            self.assertEqual(first.status_code, 200, url)
+            self.assertTrue(first.headers['ETag'].startswith('W/"'), url)
+            self.assertIn('private', first.headers['Cache-Control'])
+            self.assertIn('no-cache', first.headers['Cache-Control'])
+
+            self.assertEqual(second.status_code, 304, url)
+            self.assertEqual(second.data, b"")
+            self.assertEqual(second.headers['ETag'], first.headers['ETag'])
+            self.assertEqual(rendered, [])
+
+    def test_changes_make_new_etag(self):
+        url = f"/users/{self.u2_id}"
+        etag = self.client.get(url).headers['ETag']
+
+        # The viewer follows them, so the button changes
+        self.client.post(f"/users/follow/{self.u2_id}")
+        resp = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        etag = resp.headers['ETag']
+
+        # They post a message
+        u2 = db.session.get(User, self.u2_id)
+        u2.messages.append(Message(text="new"))
+        User.adjust_counts(u2.id, messages_count=1, version=1)
+        db.session.commit()
+
+        resp = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("new", resp.get_data(as_text=True))
+
+    def test_follower_swap_makes_new_etag(self):
+        u2 = db.session.get(User, self.u2_id)
+        u3 = User.signup("u3", "u3@email.com", "password", None)
+        u4 = User.signup("u4", "u4@email.com", "password", None)
+        db.session.flush()
+        u3.follow(u2)
+        db.session.commit()
+        u3_id, u4_id = u3.id, u4.id
+
+        url = f"/users/{self.u2_id}/followers"
+        etag = self.client.get(url).headers['ETag']
+
+        # Same follower count as before, but different followers
+        u2 = db.session.get(User, self.u2_id)
+        db.session.get(User, u3_id).unfollow(u2)
+        db.session.get(User, u4_id).follow(u2)
+        db.session.commit()
+
+        resp = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("@u4", resp.get_data(as_text=True))
+        self.assertNotIn("@u3", resp.get_data(as_text=True))
+
+    def test_other_viewer_gets_new_etag(self):
+        url = f"/users/{self.u2_id}"
+        etag = self.client.get(url).headers['ETag']
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u2_id
+
+        resp = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_no_etag_with_flashed_message(self):
+        with self.client.session_transaction() as sess:
+            sess['_flashes'] = [('success', "Hello!")]
+
+        resp = self.client.get(f"/users/{self.u2_id}")
+
+        self.assertNotIn('ETag', resp.headers)
+        self.assertIn('no-store', resp.headers['Cache-Control'])
+
+    def test_static_and_other_responses(self):
+        resp = self.client.get("/static/stylesheets/style.css")
+        self.assertIn('no-cache', resp.headers['Cache-Control'])
+        resp.close()
+
+        # A query string doesn't make an unfingerprinted file immutable
+        resp = self.client.get("/static/stylesheets/style.css?v=abc")
+        self.assertIn('no-cache', resp.headers['Cache-Control'])
+        self.assertNotIn('immutable', resp.headers['Cache-Control'])
+        resp.close()
+
+        resp = self.client.get("/users/profile")
+        self.assertEqual(resp.headers['Cache-Control'], 'no-store')
@@ -0,0 +1,84 @@
+"""Load plan tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_load_plans.py
+
+
+from unittest.mock import patch
+
+from sqlalchemy.exc import InvalidRequestError
+
+from models import db, Message, MessagesLiked, User
+from app import CURR_USER_KEY
+from fixtures import DatabaseTestCase, get_app
+from load_plans import planned
+import timeline
+
+app = get_app()
+
+
+class LoadPlansTestCase(DatabaseTestCase):
+    @classmethod
+    def create_fixtures(cls):
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        u2.followers.append(u1)
+        messages = [Message(text=f"m{i}", user_id=u2.id) for i in range(5)]
+        db.session.add_all(messages)
+        db.session.flush()
+
+        db.session.add_all(
+            MessagesLiked(user_id=u1.id, message_id=m.id) for m in messages)
+        timeline.backfill_timelines()
+        db.session.commit()
+
+        cls.u1_id = u1.id
+        cls.u2_id = u2.id
+        cls.m1_id = messages[0].id
+
+    def setUp(self):
+        super().setUp()
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+    def test_planned_views(self):
+        # Strict in testing: rendering would fail on any unplanned load
+        for url in [
+                "/",
+                f"/users/{self.u2_id}",
+                f"/users/{self.u1_id}/likedmessages",
+                f"/messages/{self.m1_id}"]:
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200, url)
+            self.assertIn("m0", resp.get_data(as_text=True), url)
+
+    def test_show_message_joins_author(self):
+        url = f"/messages/{self.m1_id}"
+        view = app.view_functions['warbler.show_message']
+        self.client.get(url)  # Cache the session user's profile
+
+        planned_count = int(self.client.get(url).headers['X-Query-Count'])
+        with patch.object(view, 'load_plan', None):
+            lazy_count = int(self.client.get(url).headers['X-Query-Count'])
+
+        self.assertEqual(planned_count, lazy_count - 1)
+
+    def test_strict(self):
+        with app.test_request_context(f"/messages/{self.m1_id}"):
+            msg = planned(Message.query).get(self.m1_id)
+
+            self.assertEqual(msg.user.id, self.u2_id)
+            with self.assertRaises(InvalidRequestError):
+                msg.users_who_liked
+            with self.assertRaises(InvalidRequestError):
+                msg.user.followers
+
+    def test_unplanned(self):
+        with app.test_request_context("/login"):
+            msg = planned(Message.query).get(self.m1_id)
+
+            self.assertEqual(len(msg.users_who_liked), 1)
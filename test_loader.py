@@ -0,0 +1,55 @@
+"""Bulk loader tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_loader.py
+
+
+import os
+import tempfile
+
+from psycopg2 import DataError
+
+from models import db, User, Message, Follows
+from loader import deferred_indexes, load_csv
+from fixtures import OwnDatabaseTestCase
+
+MODELS = [User, Message, Follows]
+
+
+class DeferredIndexesTestCase(OwnDatabaseTestCase):
+    database_suffix = 'loader'
+
+    def schema(self):
+        """Return the names of the indexes and foreign keys on MODELS'
+        tables."""
+
+        tables = [model.__table__.name for model in MODELS]
+
+        return set(db.session.execute(
+            db.text(
+                "SELECT indexname FROM pg_indexes "
+                "WHERE tablename IN :tables "
+                "UNION SELECT conname FROM pg_constraint "
+                "WHERE contype = 'f' AND conrelid::regclass::text IN :tables")
+            .bindparams(db.bindparam('tables', expanding=True)),
+            {'tables': tables}).scalars())
+
+    def test_restores_after_failed_load(self):
+        before = self.schema()
+        self.assertIn('ix_messages_user_id_timestamp', before)
+        self.assertIn('messages_user_id_fkey', before)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'messages.csv')
+            with open(path, 'w') as f:
+                f.write("text,timestamp,user_id\nhi,2022-01-01,not-a-number\n")
+
+            with self.assertRaises(DataError):
+                with deferred_indexes(MODELS):
+                    during = self.schema()
+                    self.assertNotIn('ix_messages_user_id_timestamp', during)
+                    self.assertNotIn('messages_user_id_fkey', during)
+                    load_csv(Message, path)
+
+        self.assertEqual(self.schema(), before)
@@ -5,34 +5,15 @@
 #    python -m unittest test_user_model.py
 
 
-import os
-from unittest import TestCase
+from models import db, User, Message, Follows, MessagesLiked
+from fixtures import DatabaseTestCase, get_app
 
-from models import db, User, Message, Follows, connect_db, MessagesLiked
+app = get_app()
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
-
-# Now we can import app
-
-from app import app
-app.config['WTF_CSRF_ENABLED'] = False
-# Create our tables (we do this here, so we only create the tables
-# once for all tests --- in each test, we'll delete the data
-# and create fresh new clean test data
-
-connect_db(app)
-
-db.drop_all()
-db.create_all()
-
-class MessageModelTestCase(TestCase):
-    def setUp(self):
-        User.query.delete()
+class MessageModelTestCase(DatabaseTestCase):
+    @classmethod
+    def create_fixtures(cls):
         u1 = User.signup("u1", "u1@email.com", "password", None)
         
         db.session.commit()
@@ -42,21 +23,14 @@ class MessageModelTestCase(TestCase):
 
         db.session.add_all([m1,m2])
         db.session.commit()
-        self.m1_id = m1.id
-        self.m2_id = m2.id
-        self.u1_id = u1.id
+        cls.m1_id = m1.id
+        cls.m2_id = m2.id
+        cls.u1_id = u1.id
 
-        m1_liked = MessagesLiked(message_id=self.m1_id, user_id=self.u1_id)
+        m1_liked = MessagesLiked(message_id=cls.m1_id, user_id=cls.u1_id)
         db.session.add(m1_liked)
         db.session.commit()
 
-        self.client = app.test_client()
-
-    def tearDown(self):
-        """ Clean up fouled transactions """
-
-        db.session.rollback()
-
     def test_message_model(self):
 
         message1 = Message.query.get(self.m1_id)
@@ -67,6 +41,17 @@ class MessageModelTestCase(TestCase):
 
         self.assertTrue(m1)
         self.assertFalse(m2)
+
+    def test_message_model_preload_liked(self):
+
+        message1 = Message.query.get(self.m1_id)
+        message2 = Message.query.get(self.m2_id)
+        user = User.query.get(self.u1_id)
+        user.preload_liked([message1, message2])
+
+        self.assertEqual(user._liked_cache, {self.m1_id: True, self.m2_id: False})
+        self.assertTrue(message1.is_liked_by(user))
+        self.assertFalse(message2.is_liked_by(user))
         
 
         # with self.client as c:
@@ -5,42 +5,16 @@
 #    FLASK_DEBUG=False python -m unittest test_message_views.py
 
 
-import os
-from unittest import TestCase
+from models import db, Message, MessagesLiked, User
+from app import CURR_USER_KEY
+from fixtures import DatabaseTestCase, get_app
 
-from models import db, Message, User, connect_db
+app = get_app()
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
-
-os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
-
-# Now we can import app
-
-from app import app, CURR_USER_KEY
-
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-
-# Create our tables (we do this here, so we only create the tables
-# once for all tests --- in each test, we'll delete the data
-# and create fresh new clean test data
-
-connect_db(app)
-
-db.drop_all()
-db.create_all()
-
-# Don't have WTForms use CSRF at all, since it's a pain to test
-
-app.config['WTF_CSRF_ENABLED'] = False
-
-
-class MessageBaseViewTestCase(TestCase):
-    def setUp(self):
-        User.query.delete()
 
+class MessageBaseViewTestCase(DatabaseTestCase):
+    @classmethod
+    def create_fixtures(cls):
         u1 = User.signup("u1", "u1@email.com", "password", None)
         db.session.flush()
 
@@ -48,10 +22,8 @@ class MessageBaseViewTestCase(TestCase):
         db.session.add_all([m1])
         db.session.commit()
 
-        self.u1_id = u1.id
-        self.m1_id = m1.id
-
-        self.client = app.test_client()
+        cls.u1_id = u1.id
+        cls.m1_id = m1.id
 
 
 class MessageAddViewTestCase(MessageBaseViewTestCase):
@@ -69,3 +41,28 @@ class MessageAddViewTestCase(MessageBaseViewTestCase):
             self.assertEqual(resp.status_code, 302)
 
             Message.query.filter_by(text="Hello").one()
+
+
+class MessageDeleteViewTestCase(MessageBaseViewTestCase):
+    def test_delete_liked_message(self):
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+        MessagesLiked.toggle_liked(self.m1_id, u2.id)
+        db.session.commit()
+
+        u2_id = u2.id
+        version = u2.version
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.post(f"/messages/{self.m1_id}/delete")
+
+            self.assertEqual(resp.status_code, 302)
+            self.assertIsNone(Message.query.get(self.m1_id))
+
+            # The liker's count changed, and so did their version
+            u2 = User.query.get(u2_id)
+            self.assertEqual(u2.likes_count, 0)
+            self.assertGreater(u2.version, version)
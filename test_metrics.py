@@ -0,0 +1,142 @@
+"""Metrics tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_metrics.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db, User
+from app import CURR_USER_KEY
+from fixtures import DatabaseTestCase, get_app
+from metrics import Counter, Gauge, HistogramMetric, merge, render, \
+    write_snapshot, read_snapshots
+from passwords import bcrypt_seconds
+
+app = get_app()
+
+# No process has this pid
+DEAD_PID = 2 ** 22 + 1
+
+
+def snapshot(*metrics):
+    return {metric.name: metric.snapshot() for metric in metrics}
+
+
+class MetricsTestCase(TestCase):
+    def test_render(self):
+        requests = Counter('requests_total', "Requests.", ['route'])
+        requests.inc(route="home")
+        requests.inc(2, route='say "hi"')
+
+        latency = HistogramMetric('latency_seconds', "Latency.", buckets=(1, 5))
+        latency.observe(0.5)
+        latency.observe(3)
+        latency.observe(10)
+
+        text = render(merge([(os.getpid(), snapshot(requests, latency))]))
+
+        self.assertIn("# TYPE requests_total counter", text)
+        self.assertIn('requests_total{route="home"} 1\n', text)
+        self.assertIn('requests_total{route="say \\"hi\\""} 2\n', text)
+        self.assertIn('latency_seconds_bucket{le="1"} 1\n', text)
+        self.assertIn('latency_seconds_bucket{le="5"} 2\n', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 3\n', text)
+        self.assertIn("latency_seconds_sum 13.5\n", text)
+        self.assertIn("latency_seconds_count 3\n", text)
+
+    def test_merge_workers(self):
+        requests = Counter('requests_total', "Requests.")
+        requests.inc(3)
+        connections = Gauge('connections', "Connections.")
+        connections.set(2)
+
+        merged = merge([
+            (os.getpid(), snapshot(requests, connections)),
+            (DEAD_PID, snapshot(requests, connections)),
+        ])
+
+        # Counters from exited workers still count; their gauges don't
+        self.assertEqual(merged['requests_total']['samples'][()], 6)
+        self.assertEqual(merged['connections']['samples'][()], 2)
+
+    def test_snapshot_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            write_snapshot(directory)
+            write_snapshot(directory)
+
+            (pid, data), = read_snapshots(directory)
+
+        self.assertEqual(pid, os.getpid())
+        self.assertIn('warbler_requests_total', data)
+
+
+class MetricsViewTestCase(DatabaseTestCase):
+    @classmethod
+    def create_fixtures(cls):
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.commit()
+
+        cls.u1_id = u1.id
+        cls.u2_id = u2.id
+
+    def test_metrics(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            c.post(f"/users/follow/{self.u2_id}")
+            c.get(f"/users/{self.u1_id}")
+            resp = c.get("/metrics")
+            text = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertTrue(resp.content_type.startswith("text/plain"))
+            self.assertIn(
+                'warbler_requests_total{endpoint="warbler.show_user",method="GET",'
+                'status="200"} ',
+                text)
+            self.assertIn('warbler_writes_total{kind="follow"} ', text)
+            self.assertIn(
+                'warbler_request_duration_seconds_count{endpoint="warbler.show_user",'
+                'part="db"} ',
+                text)
+            self.assertIn('warbler_bcrypt_seconds_count{operation="hash"} ', text)
+            self.assertIn("warbler_db_pool_size ", text)
+            self.assertIn("warbler_password_hash_active 0\n", text)
+            self.assertIn("warbler_password_hash_queued 0\n", text)
+            self.assertIn("warbler_password_hash_completed_total ", text)
+            self.assertIn("warbler_password_hash_rejected_total ", text)
+            self.assertIn('warbler_cache_hits_total{cache="profile"}', text)
+
+    def test_metrics_from_all_workers(self):
+        hashes = bcrypt_seconds.values[('hash',)].count
+
+        with tempfile.TemporaryDirectory() as directory:
+            app.config['METRICS_DIR'] = directory
+
+            try:
+                # Another worker's snapshot
+                os.rename(
+                    self.write_snapshot_copy(directory),
+                    os.path.join(directory, f"{DEAD_PID}.json"))
+
+                resp = self.client.get("/metrics")
+            finally:
+                app.config['METRICS_DIR'] = None
+
+        text = resp.get_data(as_text=True)
+        self.assertIn(
+            f'warbler_bcrypt_seconds_count{{operation="hash"}} {hashes * 2}\n',
+            text)
+
+    def write_snapshot_copy(self, directory):
+        write_snapshot(directory)
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        copy = f"{path}.copy"
+        os.rename(path, copy)
+        return copy
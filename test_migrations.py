@@ -0,0 +1,66 @@
+"""Schema migration and query plan tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_migrations.py
+
+
+from models import db, User
+import migrations
+from query_plans import check_query_plans
+from fixtures import OwnDatabaseTestCase
+
+
+class MigrationsTestCase(OwnDatabaseTestCase):
+    database_suffix = 'migrations'
+
+    def make_baseline_schema(self):
+        """Strip the schema back to what it was before migrations existed."""
+
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql("DROP TABLE timeline_entries")
+            connection.exec_driver_sql("DROP TABLE schema_migrations")
+            for name in migrations.USER_COUNTER_COLUMNS + ['version']:
+                connection.exec_driver_sql(f"ALTER TABLE users DROP COLUMN {name}")
+            for name in [
+                    'ix_messages_user_id_timestamp',
+                    'ix_follows_user_following_id',
+                    'ix_messages_liked_user_id',
+                    'ix_users_username_prefix']:
+                connection.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+
+            connection.exec_driver_sql(
+                "INSERT INTO users (id, email, username, password) VALUES "
+                "(1, 'u1@email.com', 'u1', 'x'), (2, 'u2@email.com', 'u2', 'x')")
+            connection.exec_driver_sql(
+                "INSERT INTO follows VALUES (1, 2)")
+            connection.exec_driver_sql(
+                "INSERT INTO messages (text, timestamp, user_id) "
+                "VALUES ('m1-text', now(), 1)")
+
+    def test_upgrade_from_baseline(self):
+        self.make_baseline_schema()
+
+        ran = migrations.upgrade()
+
+        self.assertEqual(len(ran), len(migrations.MIGRATIONS))
+        self.assertEqual(migrations.upgrade(), [])
+
+        u1 = db.session.get(User, 1)
+        self.assertEqual(u1.messages_count, 1)
+        self.assertEqual(u1.followers_count, 1)
+
+        index_names = {
+            index['name'] for index in db.inspect(db.engine).get_indexes('messages')}
+        self.assertIn('ix_messages_user_id_timestamp', index_names)
+
+    def test_stamp(self):
+        migrations.stamp()
+
+        self.assertEqual(
+            migrations.applied_versions(),
+            {version for version, _, _ in migrations.MIGRATIONS})
+        self.assertEqual(migrations.upgrade(), [])
+
+    def test_hot_queries_use_indexes(self):
+        self.assertEqual(check_query_plans(), [])
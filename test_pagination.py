@@ -0,0 +1,72 @@
+"""Keyset pagination tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_pagination.py
+
+
+from datetime import datetime, timedelta
+
+from models import db, Message, User
+from app import CURR_USER_KEY
+from fixtures import DatabaseTestCase, get_app
+from pagination import paginate, encode_cursor
+
+app = get_app()
+
+
+class PaginationTestCase(DatabaseTestCase):
+    @classmethod
+    def create_fixtures(cls):
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        db.session.flush()
+
+        # Two messages share a timestamp so the id tie-breaker is exercised
+        now = datetime(2022, 1, 1)
+        timestamps = [now, now, now - timedelta(days=1), now - timedelta(days=2)]
+        messages = [
+            Message(text=f"m{i}-text", user_id=u1.id, timestamp=ts)
+            for i, ts in enumerate(timestamps)
+        ]
+        db.session.add_all(messages)
+        db.session.commit()
+
+        cls.u1_id = u1.id
+        cls.message_ids = [m.id for m in messages]
+
+    def test_paginate_walks_all_pages(self):
+        query = Message.query.filter(Message.user_id == self.u1_id)
+        m0, m1, m2, m3 = self.message_ids
+
+        page, cursor = paginate(query, Message.timestamp, Message.id, per_page=3)
+        self.assertEqual([m.id for m in page], [m1, m0, m2])
+        self.assertIsNotNone(cursor)
+
+        page, cursor = paginate(
+            query, Message.timestamp, Message.id, cursor=cursor, per_page=3)
+        self.assertEqual([m.id for m in page], [m3])
+        self.assertIsNone(cursor)
+
+    def test_profile_older_page(self):
+        m2 = Message.query.get(self.message_ids[2])
+        cursor = encode_cursor(m2.timestamp, m2.id)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.get(f'/users/{self.u1_id}', query_string={'before': cursor})
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('m3-text', html)
+            self.assertNotIn('m0-text', html)
+
+    def test_invalid_cursor(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.get(f'/users/{self.u1_id}?before=garbage')
+
+            self.assertEqual(resp.status_code, 400)
@@ -0,0 +1,67 @@
+"""Password hashing pool tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_passwords.py
+
+
+from threading import Event, Thread
+from unittest import TestCase
+
+from flask_bcrypt import Bcrypt
+
+from passwords import PasswordHasher, PasswordHasherBusy
+
+bcrypt = Bcrypt()
+
+
+class PasswordHasherTestCase(TestCase):
+    def test_hash_and_check(self):
+        hasher = PasswordHasher(bcrypt, log_rounds=4)
+        pw_hash = hasher.hash("password")
+
+        self.assertTrue(pw_hash.startswith('$2b$'))
+        self.assertTrue(hasher.check(pw_hash, "password"))
+        self.assertFalse(hasher.check(pw_hash, "wrong"))
+        self.assertEqual(hasher.stats()['completed'], 3)
+
+    def test_needs_rehash(self):
+        hasher = PasswordHasher(bcrypt, log_rounds=4)
+        old_hash = bcrypt.generate_password_hash("password", 5).decode('UTF-8')
+
+        self.assertTrue(hasher.needs_rehash(old_hash))
+        self.assertFalse(hasher.needs_rehash(hasher.hash("password")))
+
+    def test_calibrate(self):
+        hasher = PasswordHasher(bcrypt)
+        log_rounds, timings = hasher.calibrate(0, max_rounds=5)
+
+        # Nothing can hash in 0s, so the floor is chosen after one timing
+        self.assertEqual(log_rounds, 4)
+        self.assertEqual([rounds for rounds, _ in timings], [4])
+
+    def test_rejects_when_queue_full(self):
+        hasher = PasswordHasher(bcrypt, max_workers=1, max_queue=0)
+        started = Event()
+        release = Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        blocker = Thread(target=hasher._run, args=(block,))
+        blocker.start()
+        started.wait(5)
+
+        try:
+            with self.assertRaises(PasswordHasherBusy):
+                hasher.hash("password")
+
+            stats = hasher.stats()
+            self.assertEqual(stats['active'], 1)
+            self.assertEqual(stats['rejected'], 1)
+        finally:
+            release.set()
+            blocker.join()
+
+        self.assertEqual(hasher.stats()['active'], 0)
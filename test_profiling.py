@@ -0,0 +1,141 @@
+"""Request timing and profiler tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_profiling.py
+
+
+import os
+import tempfile
+from time import perf_counter
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, User
+from app import CURR_USER_KEY
+from fixtures import DatabaseTestCase, get_app
+from profiling import Histogram, SamplingProfiler, route_timings
+
+app = get_app()
+
+
+def spin(seconds):
+    """Keep the CPU busy for `seconds`."""
+
+    deadline = perf_counter() + seconds
+    while perf_counter() < deadline:
+        pass
+
+
+class HistogramTestCase(TestCase):
+    def test_quantiles(self):
+        histogram = Histogram(buckets=(1, 2, 5))
+
+        for value in [0.5, 0.5, 1.5, 4, 20]:
+            histogram.observe(value)
+
+        self.assertEqual(histogram.count, 5)
+        self.assertEqual(histogram.sum, 26.5)
+        self.assertEqual(histogram.counts, [2, 1, 1, 1])
+        self.assertEqual(histogram.quantile(0.4), 1)
+        self.assertEqual(histogram.quantile(0.6), 2)
+        self.assertEqual(histogram.quantile(1), float('inf'))
+        self.assertIsNone(Histogram().quantile(0.5))
+
+
+class SamplingProfilerTestCase(TestCase):
+    def test_samples_registered_thread(self):
+        profiler = SamplingProfiler(0.001)
+
+        profile = profiler.start()
+        spin(0.05)
+        profiler.stop(profile)
+
+        self.assertTrue(profile.stacks)
+        self.assertTrue(
+            any("spin (test_profiling.py" in stack for stack in profile.stacks))
+
+    def test_start_after(self):
+        profiler = SamplingProfiler(0.001)
+
+        profile = profiler.start(start_after=10)
+        spin(0.02)
+        profiler.stop(profile)
+
+        self.assertFalse(profile.stacks)
+
+    def test_no_samples_after_stop(self):
+        profiler = SamplingProfiler(60)
+        profile = profiler.start()
+
+        # The profile stops while a sample of it is being taken
+        def fold_stack(frame):
+            profiler.stop(profile)
+            return "stack"
+
+        with patch('profiling.fold_stack', fold_stack):
+            profiler.sample()
+
+        self.assertFalse(profile.stacks)
+
+
+class RequestTimingTestCase(DatabaseTestCase):
+    @classmethod
+    def create_fixtures(cls):
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        db.session.commit()
+
+        cls.u1_id = u1.id
+
+    def setUp(self):
+        super().setUp()
+
+        route_timings.clear()
+
+    def test_route_timings(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            c.get(f"/users/{self.u1_id}")
+            c.get(f"/users/{self.u1_id}")
+
+        timings = route_timings.summary()['warbler.show_user']
+
+        self.assertEqual(timings['total']['count'], 2)
+        for part in ['db', 'template', 'python']:
+            self.assertEqual(timings[part]['count'], 2)
+            self.assertLessEqual(timings[part]['mean'], timings['total']['mean'])
+        self.assertGreater(timings['db']['mean'], 0)
+        self.assertGreater(timings['template']['mean'], 0)
+
+    def test_sampled_request_writes_profile(self):
+        with tempfile.TemporaryDirectory() as directory:
+            app.config['PROFILE_DIR'] = directory
+            app.config['PROFILE_SAMPLE_RATE'] = 1
+
+            try:
+                with self.client as c:
+                    with c.session_transaction() as sess:
+                        sess[CURR_USER_KEY] = self.u1_id
+
+                    # Profiles are only written if a sample was taken, so
+                    # try a few times
+                    for _ in range(20):
+                        c.get(f"/users/{self.u1_id}")
+                        if os.listdir(directory):
+                            break
+            finally:
+                app.config['PROFILE_SAMPLE_RATE'] = 0
+
+            (filename,) = os.listdir(directory)[:1]
+            self.assertIn('-warbler.show_user-', filename)
+
+            with open(os.path.join(directory, filename)) as f:
+                lines = f.read().splitlines()
+
+            # Folded stacks: "outer;...;inner count"
+            for line in lines:
+                stack, count = line.rsplit(" ", 1)
+                self.assertIn("wsgi_app (app.py", stack)
+                self.assertGreater(int(count), 0)
@@ -0,0 +1,113 @@
+"""Query counting tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_query_stats.py
+
+
+from unittest import TestCase
+
+from models import db, Message, User
+from app import CURR_USER_KEY
+from fixtures import DatabaseTestCase, get_app
+from query_stats import collect_queries, statement_shape, QueryBudgetExceeded
+from timeline import backfill_timelines
+
+app = get_app()
+
+
+class StatementShapeTestCase(TestCase):
+    def test_param_lists_collapse(self):
+        self.assertEqual(
+            statement_shape(
+                "SELECT * FROM users\n WHERE id IN (%(id_1_1)s, %(id_1_2)s)"),
+            statement_shape("SELECT * FROM users WHERE id IN (%(id_1_1)s)"))
+        self.assertEqual(
+            statement_shape("SELECT * FROM users WHERE id IN (?, ?, ?)"),
+            "SELECT * FROM users WHERE id IN (...)")
+
+
+class QueryStatsTestCase(DatabaseTestCase):
+    @classmethod
+    def create_fixtures(cls):
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        db.session.flush()
+
+        for i in range(6):
+            author = User.signup(f"a{i}", f"a{i}@email.com", "password", None)
+            db.session.flush()
+            author.messages.append(Message(text=f"message {i}"))
+            u1.follow(author)
+
+        db.session.flush()
+        backfill_timelines()
+        db.session.commit()
+
+        cls.u1_id = u1.id
+
+    def test_collect_queries(self):
+        with collect_queries() as stats:
+            User.query.all()
+            User.query.all()
+
+        self.assertEqual(stats.count, 2)
+        self.assertGreater(stats.seconds, 0)
+
+        User.query.all()
+        self.assertEqual(stats.count, 2)
+
+    def test_repeated_statements(self):
+        db.session.expire_all()
+
+        with collect_queries() as stats:
+            # One lazy load of .user per message: an N+1
+            for message in Message.query.all():
+                message.user
+
+        (times,) = stats.repeated().values()
+        self.assertEqual(times, 6)
+
+    def test_response_headers(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.get("/")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertGreater(int(resp.headers['X-Query-Count']), 0)
+            self.assertIn('X-Query-Time-Ms', resp.headers)
+
+    def test_query_budget(self):
+        homepage = app.view_functions['warbler.homepage']
+        budget = homepage.query_budget
+
+        app.config['QUERY_BUDGET_STRICT'] = True
+        # Serve the error as production would, rather than raising it here
+        app.config['PROPAGATE_EXCEPTIONS'] = False
+        homepage.query_budget = 0
+
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.u1_id
+
+                with self.assertLogs(app.logger, 'ERROR') as logs:
+                    resp = c.get("/")
+
+            self.assertEqual(resp.status_code, 500)
+            self.assertIn(QueryBudgetExceeded.__name__, logs.output[0])
+        finally:
+            homepage.query_budget = budget
+            app.config['PROPAGATE_EXCEPTIONS'] = None
+
+    def test_home_has_no_n_plus_one(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            db.session.remove()
+            with collect_queries() as stats:
+                c.get("/")
+
+        self.assertEqual(stats.repeated(), {})
@@ -0,0 +1,78 @@
+"""User search tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_search.py
+
+
+from unittest import TestCase
+
+from models import db, User
+from app import CURR_USER_KEY
+from fixtures import DatabaseTestCase, get_app
+from search import UsernameTrie, search_users, list_users_after
+
+app = get_app()
+
+
+class UsernameTrieTestCase(TestCase):
+    def test_ids_with_prefix(self):
+        trie = UsernameTrie()
+        trie.insert("warbler", 1)
+        trie.insert("Warblette", 2)
+        trie.insert("robin", 3)
+
+        self.assertEqual(trie.ids_with_prefix("warbl"), {1, 2})
+        self.assertEqual(trie.ids_with_prefix("WARBLER"), {1})
+        self.assertEqual(trie.ids_with_prefix("x"), set())
+
+
+class SearchTestCase(DatabaseTestCase):
+    @classmethod
+    def create_fixtures(cls):
+        for username in ["alice", "alicia", "bob", "al_ice"]:
+            User.signup(username, f"{username}@email.com", "password", None)
+
+        db.session.commit()
+        cls.alice_id = User.query.filter_by(username="alice").one().id
+
+    def test_search_ranks_exact_match_first(self):
+        users, has_more = search_users("alice")
+
+        self.assertEqual(users[0].username, "alice")
+        self.assertNotIn("bob", [u.username for u in users])
+        self.assertFalse(has_more)
+
+    def test_search_pages(self):
+        users, has_more = search_users("ali", per_page=1)
+        self.assertEqual(len(users), 1)
+        self.assertTrue(has_more)
+
+        users, has_more = search_users("ali", page=2, per_page=1)
+        self.assertEqual(len(users), 1)
+        self.assertFalse(has_more)
+
+    def test_search_escapes_wildcards(self):
+        users, _ = search_users("al_")
+
+        self.assertEqual([u.username for u in users], ["al_ice"])
+
+    def test_list_users_after(self):
+        users, after = list_users_after(per_page=3)
+        self.assertEqual(len(users), 3)
+
+        users, after = list_users_after(after, per_page=3)
+        self.assertEqual(len(users), 1)
+        self.assertIsNone(after)
+
+    def test_search_view(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.alice_id
+
+            resp = c.get('/users', query_string={'q': 'bo'})
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('@bob', html)
+            self.assertNotIn('@alicia', html)
@@ -0,0 +1,50 @@
+"""Compiled template cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_template_cache.py
+
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+import template_cache
+from app import create_app
+
+
+class TemplateCacheTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_app(self):
+        return create_app({
+            'WARBLER_ENV': 'testing',
+            'TEMPLATE_CACHE_DIR': self.directory,
+        })
+
+    def test_testing_has_no_cache(self):
+        app = create_app({'WARBLER_ENV': 'testing'})
+
+        self.assertIsNone(app.jinja_env.bytecode_cache)
+
+    def test_preload(self):
+        app = self.make_app()
+        count, seconds = template_cache.preload(app)
+
+        names = template_cache.template_names(app)
+        self.assertIn('users/index.html', names)
+        self.assertEqual(count, len(names))
+        self.assertEqual(len(os.listdir(self.directory)), count)
+
+        # Another process's app loads them all without compiling
+        app = self.make_app()
+        with patch.object(app.jinja_env, 'compile',
+                          side_effect=AssertionError("compiled")):
+            template_cache.preload(app)
+            app.jinja_env.get_template('base.html')
@@ -0,0 +1,139 @@
+"""Home timeline tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_timeline.py
+
+
+from models import db, Follows, Message, User, TimelineEntry
+from app import CURR_USER_KEY
+from fixtures import DatabaseTestCase, get_app
+import timeline
+
+app = get_app()
+
+
+class TimelineTestCase(DatabaseTestCase):
+    @classmethod
+    def create_fixtures(cls):
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        u3 = User.signup("u3", "u3@email.com", "password", None)
+        db.session.flush()
+
+        # u2 follows u1; u3 follows nobody
+        u1.followers.append(u2)
+        db.session.commit()
+
+        cls.u1_id = u1.id
+        cls.u2_id = u2.id
+        cls.u3_id = u3.id
+
+    def timeline_ids(self, user_id):
+        messages, _ = timeline.home_timeline(user_id)
+        return [m.id for m in messages]
+
+    def test_add_message_fans_out(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            c.post("/messages/new", data={"text": "Hello"})
+
+        msg = Message.query.filter_by(text="Hello").one()
+
+        self.assertEqual(self.timeline_ids(self.u1_id), [msg.id])
+        self.assertEqual(self.timeline_ids(self.u2_id), [msg.id])
+        self.assertEqual(self.timeline_ids(self.u3_id), [])
+
+    def test_delete_message_removes_entries(self):
+        msg = Message(text="m1-text", user_id=self.u1_id)
+        db.session.add(msg)
+        db.session.flush()
+        timeline.fan_out_message(msg)
+        db.session.commit()
+        msg_id = msg.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            c.post(f"/messages/{msg_id}/delete")
+
+        self.assertEqual(
+            TimelineEntry.query.filter_by(message_id=msg_id).count(), 0)
+
+    def test_follow_and_unfollow(self):
+        msg = Message(text="m1-text", user_id=self.u1_id)
+        db.session.add(msg)
+        db.session.commit()
+        msg_id = msg.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u3_id
+
+            c.post(f"/users/follow/{self.u1_id}")
+            self.assertEqual(self.timeline_ids(self.u3_id), [msg_id])
+
+            c.post(f"/users/stop-following/{self.u1_id}")
+            self.assertEqual(self.timeline_ids(self.u3_id), [])
+
+    def test_self_follow(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.post(f"/users/follow/{self.u1_id}")
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(Follows.query.filter_by(
+                user_following_id=self.u1_id,
+                user_being_followed_id=self.u1_id).count(), 0)
+
+            # Self-follows made before they were rejected don't break posting
+            db.session.add(Follows(
+                user_following_id=self.u1_id,
+                user_being_followed_id=self.u1_id))
+            db.session.commit()
+
+            resp = c.post("/messages/new", data={"text": "Hello"})
+            self.assertEqual(resp.status_code, 302)
+
+        msg = Message.query.filter_by(text="Hello").one()
+        self.assertEqual(self.timeline_ids(self.u1_id), [msg.id])
+
+        # ...nor backfilling: m1 -> u1 and u2
+        self.assertEqual(timeline.backfill_timelines(), 2)
+        db.session.commit()
+        self.assertEqual(self.timeline_ids(self.u1_id), [msg.id])
+
+    def test_backfill(self):
+        m1 = Message(text="m1-text", user_id=self.u1_id)
+        m2 = Message(text="m2-text", user_id=self.u3_id)
+        db.session.add_all([m1, m2])
+        db.session.commit()
+
+        count = timeline.backfill_timelines()
+        db.session.commit()
+
+        # m1 -> u1 and u2; m2 -> u3
+        self.assertEqual(count, 3)
+        self.assertEqual(self.timeline_ids(self.u2_id), [m1.id])
+        self.assertEqual(self.timeline_ids(self.u3_id), [m2.id])
+
+    def test_homepage_reads_timeline(self):
+        msg = Message(text="from-timeline", user_id=self.u1_id)
+        db.session.add(msg)
+        db.session.flush()
+        timeline.fan_out_message(msg)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u2_id
+
+            resp = c.get("/")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("from-timeline", html)
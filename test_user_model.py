@@ -5,50 +5,24 @@
 #    python -m unittest test_user_model.py
 
 
-import os
-from unittest import TestCase
-
-from models import db, User, Message, Follows, connect_db
+from models import db, User, Message, Follows, bcrypt, \
+    password_hasher
 from sqlalchemy.exc import IntegrityError
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
-
-os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
-
-# Now we can import app
-
-from app import app
-app.config['WTF_CSRF_ENABLED'] = False
-# Create our tables (we do this here, so we only create the tables
-# once for all tests --- in each test, we'll delete the data
-# and create fresh new clean test data
-
-connect_db(app)
+from fixtures import DatabaseTestCase, get_app
 
-db.drop_all()
-db.create_all()
+app = get_app()
 
 
-class UserModelTestCase(TestCase):
-    def setUp(self):
-        User.query.delete()
-
+class UserModelTestCase(DatabaseTestCase):
+    @classmethod
+    def create_fixtures(cls):
         u1 = User.signup("u1", "u1@email.com", "password", None)
         u2 = User.signup("u2", "u2@email.com", "password", None)
 
         db.session.commit()
-        self.u1_id = u1.id
-        self.u2_id = u2.id
-
-        self.client = app.test_client()
-
-    def tearDown(self):
-        """ Clean up fouled transactions """
-
-        db.session.rollback()
+        cls.u1_id = u1.id
+        cls.u2_id = u2.id
 
     def test_user_model(self):
 
@@ -66,6 +40,21 @@ class UserModelTestCase(TestCase):
 
         self.assertEqual(test_repr, u1_repr)
 
+    def test_user_model_reconcile_counts(self):
+        u1 = User.query.get(self.u1_id)
+        u2 = User.query.get(self.u2_id)
+        u1.following.append(u2)
+        u1.messages.append(Message(text="m1-text"))
+        db.session.commit()
+
+        User.reconcile_counts()
+        db.session.commit()
+
+        self.assertEqual(u1.following_count, 1)
+        self.assertEqual(u1.messages_count, 1)
+        self.assertEqual(u2.followers_count, 1)
+        self.assertEqual(u2.following_count, 0)
+
     #2 #TODO: add db.session.commit() after 73. Is u2 follow u1
     def test_user_model_is_following(self): 
         u1 = User.query.get(self.u1_id)
@@ -100,6 +89,45 @@ class UserModelTestCase(TestCase):
         is_followed = u1.is_followed_by(u2)
         self.assertEqual(is_followed, False)
 
+    def test_user_model_following_ids_among(self):
+        u1 = User.query.get(self.u1_id)
+        u2 = User.query.get(self.u2_id)
+        u1.follow(u2)
+        db.session.commit()
+
+        followed = u1.following_ids_among([self.u1_id, self.u2_id])
+        self.assertEqual(followed, {self.u2_id})
+        self.assertEqual(u2.following_ids_among([self.u1_id]), set())
+
+    def test_user_model_preload_following(self):
+        u1 = User.query.get(self.u1_id)
+        u2 = User.query.get(self.u2_id)
+        u1.preload_following([u1, u2])
+
+        self.assertEqual(u1._following_cache, {self.u1_id: False, self.u2_id: False})
+
+        # follow() keeps the preloaded answers current
+        u1.follow(u2)
+        self.assertTrue(u1.is_following(u2))
+        self.assertEqual(u2.followers_count, 1)
+
+    def test_user_model_follow_unfollow_rows(self):
+        u1 = User.query.get(self.u1_id)
+        u2 = User.query.get(self.u2_id)
+
+        # The row is written without loading everyone u1 follows
+        u1.follow(u2)
+        db.session.commit()
+        self.assertIn('following', db.inspect(u1).unloaded)
+        self.assertEqual(u1.following, [u2])
+        self.assertEqual(u2.followers, [u1])
+
+        u1.unfollow(u2)
+        db.session.commit()
+        self.assertEqual(Follows.query.count(), 0)
+        self.assertEqual(u1.following, [])
+        self.assertEqual(u2.followers_count, 0)
+
     #6 #TODO: adding, 
     def test_user_signup(self):
 
@@ -138,6 +166,15 @@ class UserModelTestCase(TestCase):
 
             self.assertIsInstance(u1, User)
 
+    def test_user_model_authenticate_rehashes(self):
+        u1 = User.query.get(self.u1_id)
+        u1.password = bcrypt.generate_password_hash(
+            "password", password_hasher.log_rounds + 1).decode('UTF-8')
+        db.session.commit()
+
+        self.assertTrue(User.authenticate("u1", "password"))
+        self.assertFalse(password_hasher.needs_rehash(u1.password))
+
     #9 & #10 
     def test_user_model_authenticate_fail(self):
 
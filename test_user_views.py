@@ -5,46 +5,18 @@
 #    FLASK_DEBUG=False python -m unittest test_message_views.py
 
 
-import os
-from unittest import TestCase
 
 from flask import session, url_for
-from models import db, Message, User, connect_db, Follows, MessagesLiked
+from models import db, Message, User, Follows, MessagesLiked
+from app import CURR_USER_KEY
+from fixtures import DatabaseTestCase, get_app
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
+app = get_app()
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
-
-# Now we can import app
-
-from app import app, CURR_USER_KEY
-
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-
-# Create our tables (we do this here, so we only create the tables
-# once for all tests --- in each test, we'll delete the data
-# and create fresh new clean test data
-
-connect_db(app)
-
-db.drop_all()
-db.create_all()
-
-# Don't have WTForms use CSRF at all, since it's a pain to test
-
-app.config['WTF_CSRF_ENABLED'] = False
-
-
-class UserBaseViewTestCase(TestCase):
-    def setUp(self):
-        MessagesLiked.query.delete()
-        Message.query.delete()
-        User.query.delete()
-        
 
+class UserBaseViewTestCase(DatabaseTestCase):
+    @classmethod
+    def create_fixtures(cls):
         u1 = User.signup("u1", "u1@email.com", "password", None)
         u2 = User.signup("u2", "u2@email.com", "password", None)
         u3 = User.signup("u3", "u3@email.com", "password", None)
@@ -59,19 +31,16 @@ class UserBaseViewTestCase(TestCase):
         
         # Create link for user and liked message
         u1.liked_messages.append(m1)
+        db.session.flush()
 
-        db.session.commit()
-        self.u1_id = u1.id
-        self.u2_id = u2.id
-        self.u3_id = u3.id
-        # self.m1_id = m1.id
-
-        self.client = app.test_client()
-
-    def tearDown(self):
-        """ Clean up fouled transactions """
+        # Fixture rows were added directly, so bring the counters in line
+        User.reconcile_counts()
 
-        db.session.rollback()
+        db.session.commit()
+        cls.u1_id = u1.id
+        cls.u2_id = u2.id
+        cls.u3_id = u3.id
+        # cls.m1_id = m1.id
 
 class UserAddViewTestCase(UserBaseViewTestCase):
     def test_user_signup(self):
@@ -299,6 +268,30 @@ class UserAddViewTestCase(UserBaseViewTestCase):
             self.assertIn('u3', html)
             self.assertTrue(following_u3)
 
+    def test_user_follow_counters(self):
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            c.post(f'users/follow/{self.u3_id}')
+
+            u1 = User.query.get(self.u1_id)
+            u3 = User.query.get(self.u3_id)
+            self.assertEqual(u1.following_count, 2)
+            self.assertEqual(u3.followers_count, 1)
+
+            # Following twice doesn't count twice
+            c.post(f'users/follow/{self.u3_id}')
+            self.assertEqual(User.query.get(self.u1_id).following_count, 2)
+
+            c.post(f'users/stop-following/{self.u3_id}')
+
+            u1 = User.query.get(self.u1_id)
+            u3 = User.query.get(self.u3_id)
+            self.assertEqual(u1.following_count, 1)
+            self.assertEqual(u3.followers_count, 0)
+
     def test_user_start_following_invalid(self):
 
         with self.client as c:
@@ -435,4 +428,39 @@ class UserAddViewTestCase(UserBaseViewTestCase):
             self.assertIn('Signup', html)
             self.assertEqual(user, None)
 
+            # u1 followed u2 and was followed by u3
+            self.assertEqual(User.query.get(self.u2_id).followers_count, 0)
+            self.assertEqual(User.query.get(self.u3_id).following_count, 0)
+
+    def test_user_deleted_with_liked_messages(self):
+
+        u2 = User.query.get(self.u2_id)
+        u2.liked_messages.extend(User.query.get(self.u1_id).messages)
+        User.adjust_counts(self.u2_id, likes_count=1)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.post('/users/delete')
+
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(User.query.get(self.u2_id).likes_count, 0)
+            self.assertEqual(MessagesLiked.query.count(), 0)
+
+
+
+    def test_csrf_token_not_shared_between_sessions(self):
+
+        app.config['WTF_CSRF_ENABLED'] = True
+
+        try:
+            for client in [app.test_client(), app.test_client()]:
+                with client as c:
+                    c.get('/login')
 
+                    with c.session_transaction() as sess:
+                        self.assertIn('csrf_token', sess)
+        finally:
+            app.config['WTF_CSRF_ENABLED'] = False
@@ -0,0 +1,159 @@
+"""Fan-out-on-write home timelines for Warbler.
+
+Instead of gathering every followed user's messages when the homepage is
+viewed, each new message is pushed into the `timeline_entries` table for its
+author and every one of the author's followers. The homepage is then a single
+indexed range read on that table.
+"""
+
+from sqlalchemy import literal
+
+from models import db, Follows, Message, TimelineEntry
+from load_plans import planned
+from pagination import paginate, MESSAGES_PER_PAGE
+
+TIMELINE_COLUMNS = ['user_id', 'message_id', 'timestamp']
+
+
+def fan_out_message(message):
+    """Deliver a newly created `message` to its author's and followers' timelines.
+
+    The message must already be flushed so it has an id and timestamp.
+    """
+
+    db.session.add(TimelineEntry(
+        user_id=message.user_id,
+        message_id=message.id,
+        timestamp=message.timestamp,
+    ))
+
+    followers = (
+        db.select(
+            Follows.user_following_id,
+            literal(message.id),
+            literal(message.timestamp),
+        )
+        .where(Follows.user_being_followed_id == message.user_id)
+        # The author got theirs above, even if they (once) followed themselves
+        .where(Follows.user_following_id != message.user_id)
+    )
+
+    db.session.execute(
+        db.insert(TimelineEntry).from_select(TIMELINE_COLUMNS, followers))
+
+
+def add_followed_user(follower_id, followed_id):
+    """Copy every message by `followed_id` into `follower_id`'s timeline."""
+
+    # Their own messages are there already
+    if follower_id == followed_id:
+        return
+
+    messages = (
+        db.select(literal(follower_id), Message.id, Message.timestamp)
+        .where(Message.user_id == followed_id)
+    )
+
+    db.session.execute(
+        db.insert(TimelineEntry).from_select(TIMELINE_COLUMNS, messages))
+
+
+def remove_followed_user(follower_id, followed_id):
+    """Remove every message by `followed_id` from `follower_id`'s timeline."""
+
+    # Their own messages stay
+    if follower_id == followed_id:
+        return
+
+    followed_messages = (
+        db.select(Message.id)
+        .where(Message.user_id == followed_id)
+        .scalar_subquery()
+    )
+
+    db.session.execute(
+        db.delete(TimelineEntry)
+        .where(TimelineEntry.user_id == follower_id)
+        .where(TimelineEntry.message_id.in_(followed_messages))
+        .execution_options(synchronize_session=False))
+
+
+def remove_message(message_id):
+    """Remove a message from every timeline it was delivered to."""
+
+    db.session.execute(
+        db.delete(TimelineEntry)
+        .where(TimelineEntry.message_id == message_id)
+        .execution_options(synchronize_session=False))
+
+
+def remove_user(user_id):
+    """Remove a user's own timeline and their messages from everyone else's."""
+
+    own_messages = (
+        db.select(Message.id)
+        .where(Message.user_id == user_id)
+        .scalar_subquery()
+    )
+
+    db.session.execute(
+        db.delete(TimelineEntry)
+        .where(
+            (TimelineEntry.user_id == user_id) |
+            (TimelineEntry.message_id.in_(own_messages)))
+        .execution_options(synchronize_session=False))
+
+
+def timeline_query(user_id):
+    """Query for the messages on `user_id`'s timeline."""
+
+    return (
+        Message
+        .query
+        .join(TimelineEntry, TimelineEntry.message_id == Message.id)
+        .filter(TimelineEntry.user_id == user_id))
+
+
+def home_timeline(user_id, cursor=None, per_page=MESSAGES_PER_PAGE):
+    """Return a page of `user_id`'s timeline and the cursor for older messages.
+
+    See `pagination.paginate`. What's loaded with the messages is up to the
+    calling view's load plan (see load_plans.py).
+    """
+
+    return paginate(
+        planned(timeline_query(user_id)),
+        TimelineEntry.timestamp,
+        TimelineEntry.message_id,
+        cursor=cursor,
+        per_page=per_page)
+
+
+def backfill_timelines(connection=None):
+    """Rebuild every timeline from the existing `follows` and `messages` rows.
+
+    Use this after bulk-loading data or when first deploying timelines.
+    Runs in the session unless given a `connection`. Returns the number of
+    timeline entries written.
+    """
+
+    executor = connection if connection is not None else db.session
+
+    executor.execute(db.delete(TimelineEntry))
+
+    followed_messages = (
+        db.select(Follows.user_following_id, Message.id, Message.timestamp)
+        .join(Message, Message.user_id == Follows.user_being_followed_id)
+        .where(Follows.user_following_id != Follows.user_being_followed_id)
+    )
+    own_messages = db.select(Message.user_id, Message.id, Message.timestamp)
+
+    executor.execute(
+        db.insert(TimelineEntry)
+        .from_select(TIMELINE_COLUMNS, followed_messages))
+    executor.execute(
+        db.insert(TimelineEntry)
+        .from_select(TIMELINE_COLUMNS, own_messages))
+
+    return executor.execute(
+        db.select(db.func.count()).select_from(TimelineEntry)).scalar()